@@ -0,0 +1,378 @@
+"""
+CFIPSelector 优选基准测试
+
+在本机回环地址别名（127.x.x.x）上为每个“候选IP”启动监听，模拟Cloudflare节点：
+- 每个IP有固定的基础延迟与抖动（在HTTP响应前注入），以及按比例丢弃请求（直接断开连接）
+- /cdn-cgi/trace 返回与真实节点一致格式的响应（colo、fl、ip、http、tls...），部分IP模拟非Cloudflare节点
+- 部分IP不监听（连接被拒绝），模拟不可用IP
+- 生成只包含这些回环网段的 locations.json
+
+然后端到端调用插件的 select_ips（ping、Cloudflare节点判断、完整测速、竞速、写hosts），
+输出每次运行的耗时、探测请求数，以及所选IP相对真实最优IP的延迟差距（准确度）。
+同一进程内多次运行时，第二次起会用到历史记录热启动。
+
+用法（需在MoviePilot运行环境中，保证 app 包可导入）：
+    PYTHONPATH=/path/to/MoviePilot python benchmarks/cfipselector_bench.py --ips 200 --domains 4 --runs 3
+
+说明：
+- Linux下整个127.0.0.0/8都是本机地址，可直接绑定；macOS需先用 ifconfig lo0 alias 添加别名
+- TCP握手由内核完成，无法在用户态注入握手延迟，延迟差异体现在HTTP阶段
+- --tls 会调用 openssl 生成临时自签证书
+"""
+import argparse
+import json
+import os
+import random
+import selectors
+import shutil
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "plugins.v2"))
+
+
+class FakeNode:
+    """
+    单个模拟节点的真实表现
+    """
+
+    def __init__(self, ip: str, colo: str, delay_ms: float, jitter_ms: float, loss: float,
+                 is_cf: bool = True, serving_colo: str = None):
+        self.ip = ip
+        self.colo = colo
+        self.delay_ms = delay_ms
+        self.jitter_ms = jitter_ms
+        self.loss = loss
+        self.is_cf = is_cf
+        self.serving_colo = serving_colo or colo
+
+    @property
+    def expected_ms(self) -> float:
+        """
+        用于准确度评估的期望耗时：丢包按失败后重试放大
+        """
+        return self.delay_ms / max(1 - self.loss, 0.05)
+
+
+class FakeCloudflare:
+    """
+    在多个回环地址上监听同一端口，单线程selector接收连接，每个连接交给独立线程处理
+    """
+
+    def __init__(self, nodes, port: int = 0, tls_context: ssl.SSLContext = None, seed: int = 0):
+        self.nodes = {node.ip: node for node in nodes}
+        self.port = port
+        self.tls_context = tls_context
+        self.rng = random.Random(seed)
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self._selector = selectors.DefaultSelector()
+        self._listeners = []
+        self._running = False
+
+    def start(self):
+        for ip in self.nodes:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((ip, self.port))
+            if not self.port:
+                self.port = sock.getsockname()[1]
+            sock.listen(128)
+            sock.setblocking(False)
+            self._selector.register(sock, selectors.EVENT_READ)
+            self._listeners.append(sock)
+        self._running = True
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def stop(self):
+        self._running = False
+        for sock in self._listeners:
+            try:
+                self._selector.unregister(sock)
+            except Exception:
+                pass
+            sock.close()
+
+    def count(self, key: str, n: int = 1):
+        with self._lock:
+            self.stats[key] += n
+
+    def _accept_loop(self):
+        while self._running:
+            try:
+                events = self._selector.select(timeout=0.2)
+            except OSError:
+                return
+            for key, _ in events:
+                try:
+                    conn, addr = key.fileobj.accept()
+                except OSError:
+                    continue
+                self.count("connections")
+                threading.Thread(target=self._handle, args=(conn, addr), daemon=True).start()
+
+    def _handle(self, conn: socket.socket, addr):
+        conn.setblocking(True)
+        conn.settimeout(10)
+        try:
+            if self.tls_context:
+                conn = self.tls_context.wrap_socket(conn, server_side=True)
+            _Handler(conn, addr, self)
+        except Exception:
+            pass
+        finally:
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "bench"
+
+    def do_GET(self):
+        bench: FakeCloudflare = self.server
+        node = bench.nodes.get(self.connection.getsockname()[0])
+        if node is None:
+            self.close_connection = True
+            return
+        trace = self.path.startswith("/cdn-cgi/trace")
+        bench.count("trace_requests" if trace else "site_requests")
+        with bench._lock:
+            lost = bench.rng.random() < node.loss
+            delay = max(0.0, node.delay_ms + bench.rng.uniform(-node.jitter_ms, node.jitter_ms)) / 1000
+        time.sleep(delay)
+        if lost:
+            bench.count("dropped")
+            self.close_connection = True
+            return
+        if trace:
+            if node.is_cf:
+                body = (f"fl=1f1\nh={self.headers.get('Host', '')}\nip=127.0.0.1\nts={time.time():.3f}\n"
+                        f"visit_scheme={'https' if bench.tls_context else 'http'}\nuag=bench\n"
+                        f"colo={node.serving_colo}\nsliver=none\nhttp=http/1.1\nloc=US\n"
+                        f"tls={'TLSv1.3' if bench.tls_context else 'off'}\nsni=plaintext\nwarp=off\ngateway=off\n")
+            else:
+                body = "not found\n"
+        else:
+            body = "<html>ok</html>" * 20
+        data = body.encode()
+        self.send_response(200 if node.is_cf or not trace else 404)
+        if node.is_cf:
+            self.send_header("Server", "cloudflare")
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def build_nodes(args, rng: random.Random):
+    """
+    按参数生成模拟节点与对应的locations数据
+    返回(监听节点列表, 全部候选IP数, locations字典)
+    """
+    colos = [c.strip().upper() for c in args.colos.split(",") if c.strip()]
+    per_colo = max(1, args.ips // len(colos))
+    nodes, locations = [], {}
+    for idx, colo in enumerate(colos):
+        # 每个数据中心一个/24，跳过网络与广播地址
+        net = f"127.{10 + idx}.0.0/24"
+        locations[colo] = {"name": colo, "nets": [net]}
+        for host in range(1, min(per_colo, 254) + 1):
+            ip = f"127.{10 + idx}.0.{host}"
+            if rng.random() < args.dead:
+                continue
+            serving = colo if rng.random() >= args.misrouted else rng.choice(colos)
+            nodes.append(FakeNode(
+                ip, colo,
+                delay_ms=rng.uniform(args.min_delay, args.max_delay),
+                jitter_ms=args.jitter,
+                loss=args.loss if rng.random() < args.lossy else 0.0,
+                is_cf=rng.random() >= args.non_cf,
+                serving_colo=serving))
+    return nodes, per_colo * len(colos), locations
+
+
+def make_tls_context(workdir: str) -> ssl.SSLContext:
+    if not shutil.which("openssl"):
+        raise SystemExit("--tls 需要 openssl 生成临时证书")
+    cert, key = os.path.join(workdir, "cert.pem"), os.path.join(workdir, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", key,
+                    "-out", cert, "-days", "1", "-subj", "/CN=bench"],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(cert, key)
+    return ctx
+
+
+def make_plugin(args, port: int, workdir: str, locations_path: str, domains):
+    """
+    构造插件实例：直接设置配置属性（不调用init_plugin，避免启动定时任务与联网同步tracker），
+    持久化与配置保存改为内存实现，hosts写入临时文件
+    """
+    from cfipselector import CFIPSelector
+    from cfipselector.budget import ProbeBudget
+    from cfipselector.history import IPHistory
+
+    plugin = CFIPSelector()
+    store = {}
+    plugin.get_data = lambda key=None, *a, **kw: store.get(key)
+    plugin.save_data = lambda key, value, *a, **kw: store.__setitem__(key, value)
+    plugin.update_config = lambda *a, **kw: True
+    plugin._locations_path = lambda: locations_path
+    plugin._enabled = True
+    plugin._notify = False
+    plugin._tls = args.tls
+    plugin._port = port
+    plugin._ip_type = "4"
+    plugin._datacenters = ",".join(c.strip().upper() for c in args.datacenters.split(","))
+    plugin._delay = 1500
+    plugin._concurrency = args.concurrency
+    plugin._ping_concurrency = args.ping_concurrency
+    plugin._cidr_sample_num = args.sample
+    plugin._candidate_num = args.candidates
+    plugin._good_ip_target = args.good_target
+    plugin._warm_start_num = args.warm_start
+    plugin._colo_filter = args.colo_filter
+    plugin._rank_metric = args.rank_metric
+    plugin._max_sockets = args.max_sockets
+    plugin._max_rps = args.max_rps
+    plugin._hosts_path = os.path.join(workdir, "hosts")
+    plugin._history = IPHistory()
+    plugin._colo_stats = {}
+    plugin._budget = ProbeBudget(args.max_sockets, args.max_rps)
+    plugin._collect_select_domains = lambda: dict(domains)
+    with open(plugin._hosts_path, "w", encoding="utf-8") as f:
+        f.write("127.0.0.1\tlocalhost\n")
+    return plugin
+
+
+def evaluate(plugin, nodes, selected, datacenters):
+    """
+    准确度：所选IP的期望耗时 / 目标数据中心内真实可用的最优IP期望耗时（1.00为最优）
+    """
+    eligible = sorted((node for node in nodes.values() if node.is_cf and node.colo in datacenters),
+                      key=lambda node: node.expected_ms)
+    if not eligible:
+        return {}
+    best = eligible[0].expected_ms
+    report = {}
+    for domain, ip in selected.items():
+        node = nodes.get(ip)
+        if node is None:
+            report[domain] = {"ip": ip, "ratio": None, "rank": None}
+            continue
+        rank = next(i for i, n in enumerate(eligible, 1) if n.ip == ip) if node in eligible else None
+        report[domain] = {"ip": ip, "expected_ms": round(node.expected_ms, 1),
+                          "ratio": round(node.expected_ms / best, 2), "rank": rank, "eligible": len(eligible)}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CFIPSelector 本地基准测试")
+    parser.add_argument("--ips", type=int, default=200, help="候选IP总数（平均分到各数据中心，每个最多254）")
+    parser.add_argument("--colos", default="SJC,LAX", help="模拟的数据中心")
+    parser.add_argument("--datacenters", default="SJC", help="插件配置的目标数据中心")
+    parser.add_argument("--domains", type=int, default=4, help="待优选域名数")
+    parser.add_argument("--tracker-ratio", type=float, default=0.5, help="域名中tracker（loose模式）的比例")
+    parser.add_argument("--runs", type=int, default=2, help="同一进程内连续运行次数（第二次起可热启动）")
+    parser.add_argument("--min-delay", type=float, default=20, help="节点最小响应延迟(ms)")
+    parser.add_argument("--max-delay", type=float, default=400, help="节点最大响应延迟(ms)")
+    parser.add_argument("--jitter", type=float, default=10, help="响应延迟抖动(ms)")
+    parser.add_argument("--loss", type=float, default=0.3, help="不稳定节点的请求丢弃率")
+    parser.add_argument("--lossy", type=float, default=0.2, help="不稳定节点所占比例")
+    parser.add_argument("--dead", type=float, default=0.2, help="不监听（连接拒绝）的IP比例")
+    parser.add_argument("--non-cf", type=float, default=0.1, help="非Cloudflare节点比例")
+    parser.add_argument("--misrouted", type=float, default=0.0, help="实际服务数据中心与网段不一致的比例")
+    parser.add_argument("--tls", action="store_true", help="使用HTTPS（自签证书）")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--ping-concurrency", type=int, default=500)
+    parser.add_argument("--sample", type=int, default=100, help="CIDR抽样数")
+    parser.add_argument("--candidates", type=int, default=20, help="候选数量")
+    parser.add_argument("--good-target", type=int, default=3, help="提前结束数")
+    parser.add_argument("--warm-start", type=int, default=3, help="历史复测数")
+    parser.add_argument("--colo-filter", action="store_true")
+    parser.add_argument("--rank-metric", default="total", choices=["total", "ttfb"])
+    parser.add_argument("--max-sockets", type=int, default=600)
+    parser.add_argument("--max-rps", type=int, default=0, help="全局请求速率，基准默认不限")
+    parser.add_argument("--json", action="store_true", help="以JSON输出结果，便于对比")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix="cfip_bench_")
+    try:
+        nodes, total_ips, locations = build_nodes(args, rng)
+        locations_path = os.path.join(workdir, "locations.json")
+        with open(locations_path, "w", encoding="utf-8") as f:
+            json.dump(locations, f)
+        tls_context = make_tls_context(workdir) if args.tls else None
+        server = FakeCloudflare(nodes, tls_context=tls_context, seed=args.seed)
+        server.start()
+        n_tracker = int(round(args.domains * args.tracker_ratio))
+        domains = {f"{'tracker' if i < n_tracker else 'site'}{i}.bench:{server.port}": i < n_tracker
+                   for i in range(args.domains)}
+        plugin = make_plugin(args, server.port, workdir, locations_path, domains)
+        datacenters = set(plugin._get_datacenter_list())
+        results = []
+        for run in range(1, args.runs + 1):
+            server.stats.clear()
+            start = time.perf_counter()
+            plugin.select_ips()
+            elapsed = time.perf_counter() - start
+            selected = plugin._read_hosts_cfipselector()
+            accuracy = evaluate(plugin, server.nodes, selected, datacenters)
+            ratios = [item["ratio"] for item in accuracy.values() if item.get("ratio")]
+            run_metrics = plugin._metrics_history.latest() if plugin._metrics_history else None
+            results.append({
+                "run": run,
+                "elapsed_s": round(elapsed, 3),
+                "selected": len(selected),
+                "domains": len(domains),
+                "connections": server.stats["connections"],
+                "trace_requests": server.stats["trace_requests"],
+                "site_requests": server.stats["site_requests"],
+                "dropped": server.stats["dropped"],
+                "budget_requests": plugin._budget.requests,
+                "ping_level": plugin._ping_controller.level if plugin._ping_controller else None,
+                "phases_s": run_metrics["phases_s"] if run_metrics else {},
+                "mean_ratio": round(sum(ratios) / len(ratios), 3) if ratios else None,
+                "worst_ratio": max(ratios) if ratios else None,
+                "per_domain": accuracy,
+            })
+        server.stop()
+        summary = {
+            "config": {k: v for k, v in vars(args).items() if k != "json"},
+            "candidate_ips": total_ips,
+            "listening_ips": len(nodes),
+            "runs": results,
+        }
+        if args.json:
+            print(json.dumps(summary, ensure_ascii=False, indent=2))
+            return
+        print(f"\n候选IP {total_ips} 个（监听 {len(nodes)} 个），域名 {len(domains)} 个，目标数据中心 {','.join(sorted(datacenters))}")
+        print(f"{'轮次':<4}{'耗时(s)':>9}{'选中':>6}{'连接数':>8}{'trace':>7}{'站点请求':>9}{'丢弃':>6}"
+              f"{'ping并发':>9}{'平均比值':>9}{'最差比值':>9}")
+        for item in results:
+            print(f"{item['run']:<6}{item['elapsed_s']:>9.2f}{item['selected']:>5}/{item['domains']:<2}"
+                  f"{item['connections']:>7}{item['trace_requests']:>7}{item['site_requests']:>9}{item['dropped']:>7}"
+                  f"{str(item['ping_level']):>9}{str(item['mean_ratio']):>11}{str(item['worst_ratio']):>10}")
+        print("比值 = 所选IP期望耗时 / 目标数据中心内最优IP期望耗时，1.00为选中最优")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import time
 import random
+import threading
 import requests
 import ipaddress
 import subprocess
@@ -20,20 +21,23 @@ import urllib.request
 import zipfile, tarfile
 import json
 from collections import defaultdict
+from contextlib import nullcontext
 
-# 尝试导入psutil，如果不可用则使用备选方案
-try:
-    import psutil
-    PSUTIL_AVAILABLE = True
-except ImportError:
-    PSUTIL_AVAILABLE = False
-    logger.warning("psutil未安装，将无法监控内存使用情况")
+from .probe import tcp_ping_many, AIMDController, PING_FAILED
+from .transport import pinned_session, parse_cf_trace, timed_get, measure_throughput, SessionPool
+from .locations import DatacenterIndex, locations_cache
+from .sampling import sample_addresses
+from .history import IPHistory
+from .budget import ProbeBudget
+from .hosts_manager import HostsManager, default_hosts_path
+from .metrics import RunMetrics, MetricsHistory
+from .tracker_rules import TrackerRules, tracker_rules_cache, write_rule_list, fetch_rule_list
 
 class CFIPSelector(_PluginBase):
     plugin_name = "PT云盾优选"
     plugin_desc = "PT站点专属优选IP，自动写入hosts，访问快人一步"
     plugin_icon = "https://raw.githubusercontent.com/xijin285/MoviePilot-Plugins/refs/heads/main/icons/cfipselector.png"
-    plugin_version = "1.1.2"
+    plugin_version = "1.2.0"
     plugin_author = "M.Jinxi"
     author_url = "https://github.com/xijin285"
     plugin_config_prefix = "cfipselector_"
@@ -58,8 +62,36 @@ class CFIPSelector(_PluginBase):
     _last_select_time = ''
     _last_selected_ip = ''
     _concurrency: int = 20  # 并发线程数
+    _ping_concurrency: int = 500  # 异步ping同时在途的连接数上限
+    _ping_controller: Optional[AIMDController] = None  # 自适应ping并发控制器，跨轮次保持并发水平
     _cidr_sample_num: int = 100  # CIDR抽样数
     _candidate_num: int = 20  # 第二阶段候选数量
+    _warm_start_num: int = 3  # 每个域名优先复测的历史最优IP数量
+    _good_ip_target: int = 3  # 每个域名找到多少个可用IP后提前结束本轮
+    _race_samples: int = 3  # 竞速胜出IP至少需要的测速样本数
+    _colo_filter: bool = False  # 按实际服务数据中心过滤候选
+    _rank_metric: str = "total"  # 测速排序口径：total完整请求耗时 / ttfb首字节时间
+    _speed_test: bool = False  # 带宽测速
+    _speed_url: str = "https://speed.cloudflare.com/__down?bytes=50000000"
+    _speed_max_mb: int = 10  # 每个IP最多下载MB
+    _speed_max_seconds: int = 5  # 每个IP最长测速秒数
+    _speed_concurrency: int = 2  # 带宽测速并发数
+    _speed_shortlist: int = 3  # 每个域名参与带宽测速的IP数
+    _speed_weight: int = 50  # 综合排序中带宽所占权重(%)
+    _max_sockets: int = 600  # 全局同时打开的探测连接数上限
+    _max_rps: int = 30  # 全局每秒HTTP探测请求数上限，0为不限
+    _budget: Optional[ProbeBudget] = None
+    _hosts_path: str = ""  # hosts文件路径，留空按系统默认
+    _hosts: Optional[HostsManager] = None
+    _run_metrics: Optional[RunMetrics] = None  # 当前运行的指标，未在运行时为None
+    _sessions: Optional[SessionPool] = None  # 当前运行内按IP复用的keep-alive会话
+    _run_lock = threading.Lock()  # 同一时间只允许一次优选/健康检查，运行状态保存在实例上
+    _metrics_history: Optional[MetricsHistory] = None
+    _colo_stats: Dict[str, int] = {}  # 累计实际服务数据中心分布
+    _history: Optional[IPHistory] = None  # IP历史表现（EWMA）
+    _health_check: bool = False  # 定时任务只做健康检查
+    _degrade_delay: int = 1000  # 健康检查延迟劣化阈值(ms)
+    _degrade_success_rate: int = 60  # 健康检查成功率劣化阈值(%)
 
     # 新增tracker优选相关私有属性
     _enable_site_select: bool = True  # PT站点优选开关
@@ -77,6 +109,9 @@ class CFIPSelector(_PluginBase):
         self._last_select_time = ''
         self._last_selected_ip = ''
         self._tracker_include_list = []  # 新增：UI tracker域名列表
+        self._history = IPHistory(self.get_data('ip_history'))
+        self._metrics_history = MetricsHistory(self.get_data('run_metrics'))
+        self._colo_stats = {}
         try:
             from app.helper.sites import SitesHelper
             from app.db.site_oper import SiteOper
@@ -96,8 +131,26 @@ class CFIPSelector(_PluginBase):
             self._tls = bool(config.get("tls", True))
             self._ipnum = int(config.get("ipnum", 10))
             self._concurrency = int(config.get("concurrency", 20))
+            self._ping_concurrency = int(config.get("ping_concurrency", 500))
             self._cidr_sample_num = int(config.get("cidr_sample_num", 100))
             self._candidate_num = int(config.get("candidate_num", 20))
+            self._warm_start_num = int(config.get("warm_start_num", 3))
+            self._good_ip_target = int(config.get("good_ip_target", 3))
+            self._colo_filter = bool(config.get("colo_filter", False))
+            self._rank_metric = config.get("rank_metric", "total") or "total"
+            self._speed_test = bool(config.get("speed_test", False))
+            self._speed_url = config.get("speed_url") or "https://speed.cloudflare.com/__down?bytes=50000000"
+            self._speed_max_mb = int(config.get("speed_max_mb", 10))
+            self._speed_max_seconds = int(config.get("speed_max_seconds", 5))
+            self._speed_concurrency = int(config.get("speed_concurrency", 2))
+            self._speed_shortlist = int(config.get("speed_shortlist", 3))
+            self._speed_weight = int(config.get("speed_weight", 50))
+            self._max_sockets = int(config.get("max_sockets", 600))
+            self._max_rps = int(config.get("max_rps", 30))
+            self._hosts_path = (config.get("hosts_path") or "").strip()
+            self._health_check = bool(config.get("health_check", False))
+            self._degrade_delay = int(config.get("degrade_delay", 1000))
+            self._degrade_success_rate = int(config.get("degrade_success_rate", 60))
             raw_sign_sites = config.get("sign_sites") or []
             self._sign_sites = [str(i) for i in raw_sign_sites]
             self._last_select_time = config.get("last_select_time", "")
@@ -117,27 +170,24 @@ class CFIPSelector(_PluginBase):
                 pass
             self._sign_sites = [i for i in self._sign_sites if i in all_ids]
             # 新增：tracker优选域名UI配置
-            tracker_include_list = config.get("tracker_include_list")
-            if tracker_include_list is not None:
-                if isinstance(tracker_include_list, str):
-                    tracker_include_list = [i.strip() for i in tracker_include_list.splitlines() if i.strip()]
+            tracker_include_list = config.get("tracker_include_list") or []
+            if isinstance(tracker_include_list, str):
+                tracker_include_list = [i.strip() for i in tracker_include_list.splitlines() if i.strip()]
+            if tracker_include_list:
                 self._tracker_include_list = tracker_include_list
-                # 保存到trackers_include.txt
+                # 保存到trackers_include.txt，内容未变化时不改写（避免重新编译规则）
                 try:
-                    include_path = '/config/plugins/CFIPSelector/trackers_include.txt'
-                    from pathlib import Path
-                    Path('/config/plugins/CFIPSelector').mkdir(parents=True, exist_ok=True)
-                    with open(include_path, 'w', encoding='utf-8') as f:
-                        for line in self._tracker_include_list:
-                            f.write(line + '\n')
+                    write_rule_list(self._tracker_list_path(), self._tracker_include_list)
                 except Exception as e:
                     logger.warning(f"写入trackers_include.txt失败: {e}")
             else:
+                # UI列表为空时沿用GitHub同步的文件，不能清空，否则条件请求的摘要失配会导致每次都全量下载
                 self._tracker_include_list = []
             self._enable_site_select = bool(config.get("enable_site_select", True))
             self._enable_tracker_select = bool(config.get("enable_tracker_select", True))
             self._github_tracker_url = config.get("github_tracker_url")  # 新增：GitHub tracker列表URL
             self.__update_config()
+        self._budget = ProbeBudget(self._max_sockets, self._max_rps)
         if self._enabled:
             if self._onlyonce:
                 try:
@@ -179,8 +229,26 @@ class CFIPSelector(_PluginBase):
             "tls": self._tls,
             "ipnum": self._ipnum,
             "concurrency": self._concurrency,
+            "ping_concurrency": self._ping_concurrency,
             "cidr_sample_num": self._cidr_sample_num,
             "candidate_num": self._candidate_num,
+            "warm_start_num": self._warm_start_num,
+            "good_ip_target": self._good_ip_target,
+            "colo_filter": self._colo_filter,
+            "rank_metric": self._rank_metric,
+            "speed_test": self._speed_test,
+            "speed_url": self._speed_url,
+            "speed_max_mb": self._speed_max_mb,
+            "speed_max_seconds": self._speed_max_seconds,
+            "speed_concurrency": self._speed_concurrency,
+            "speed_shortlist": self._speed_shortlist,
+            "speed_weight": self._speed_weight,
+            "max_sockets": self._max_sockets,
+            "max_rps": self._max_rps,
+            "hosts_path": self._hosts_path,
+            "health_check": self._health_check,
+            "degrade_delay": self._degrade_delay,
+            "degrade_success_rate": self._degrade_success_rate,
             "sign_sites": self._sign_sites or [],
             "last_select_time": getattr(self, '_last_select_time', ''),
             "last_selected_ip": getattr(self, '_last_selected_ip', ''),
@@ -196,7 +264,7 @@ class CFIPSelector(_PluginBase):
         self._scheduler = BackgroundScheduler(timezone=settings.TZ)
         try:
             trigger = CronTrigger.from_crontab(self._cron, timezone=settings.TZ)
-            self._scheduler.add_job(self.select_ips, trigger=trigger, name=f"{self.plugin_name}定时服务", id=f"{self.plugin_name}定时服务")
+            self._scheduler.add_job(self._scheduled_select, trigger=trigger, name=f"{self.plugin_name}定时服务", id=f"{self.plugin_name}定时服务")
             self._scheduler.start()
             logger.info(f"{self.plugin_name} 定时任务已启动: {self._cron}")
         except Exception as e:
@@ -251,124 +319,54 @@ class CFIPSelector(_PluginBase):
             logger.error(f"下载Cloudflare官方IPv{ip_type}网段异常: {e}")
         return []
 
-    def _get_ip_pool(self, ip_type: int = 4, max_per_net: int = 10) -> list:
+    def _get_ip_pool(self, ip_type: int = 4, sample_num: int = 100, exclude: Optional[set] = None) -> list:
         """
-        获取IP池：自动下载官方IP段并解析，返回部分真实IP
+        获取IP池：自动下载官方IP段并解析，在各网段内按整数偏移均匀随机采样
         """
         nets = self._download_cf_ip_list(ip_type)
-        ip_pool = []
-        for net in nets:
-            try:
-                net_obj = ipaddress.ip_network(net, strict=False)
-                
-                # 检查内存使用情况（仅对IPv6）
-                if ip_type == 6 and PSUTIL_AVAILABLE:
-                    try:
-                        memory_percent = psutil.virtual_memory().percent
-                        if memory_percent > 80:
-                            logger.warning(f"内存使用率过高（{memory_percent:.1f}%），跳过IPv6网段 {net}")
-                            continue
-                    except Exception:
-                        pass  # 如果无法获取内存信息，继续执行
-                
-                # 只取每个网段前max_per_net个IP，避免爆炸
-                # 对于IPv6，设置更小的采样限制
-                if ip_type == 6:
-                    max_per_net_v6 = min(max_per_net, 5)  # IPv6最多采样5个
-                    for idx, ip in enumerate(net_obj.hosts()):
-                        if idx >= max_per_net_v6:
-                            break
-                        ip_pool.append(str(ip))
-                else:
-                    for idx, ip in enumerate(net_obj.hosts()):
-                        if idx >= max_per_net:
-                            break
-                        ip_pool.append(str(ip))
-            except Exception as e:
-                logger.warning(f"解析网段{net}失败: {e}")
+        ip_pool = sample_addresses(nets, sample_num, exclude)
         logger.info(f"生成IPv{ip_type} IP池，共{len(ip_pool)}个IP")
         return ip_pool
 
-    def _get_ip_pool_by_datacenters(self, ip_type: int, datacenters: List[str], max_per_net: int = 10) -> list:
+    def _get_ip_pool_by_datacenters(self, ip_type: int, datacenters: List[str], sample_num: int = 100, exclude: Optional[set] = None) -> list:
         """
-        只生成目标数据中心的IP池，优化为所有网段均匀采样
+        只生成目标数据中心的IP池：按网段大小加权，在整个网段范围内均匀随机采样，不枚举主机
         """
-        import random
-        loc_path = os.path.join(os.path.dirname(__file__), 'resources', 'locations.json')
-        if os.path.exists(loc_path):
-            with open(loc_path, 'r', encoding='utf-8') as f:
-                locations = json.load(f)
-        else:
-            logger.warning("未找到本地 resources/locations.json，请在resources目录下自行维护数据中心映射表！")
+        index = self._load_datacenter_index()
+        if index is None:
             return []
-        nets = []
-        for dc in datacenters:
-            info = locations.get(dc)
-            if info:
-                nets += [net for net in info.get('nets', []) if (':' in net if ip_type==6 else ':' not in net)]
-        ip_pool = []
-        for net in nets:
-            try:
-                net_obj = ipaddress.ip_network(net, strict=False)
-                
-                # 检查内存使用情况（仅对IPv6）
-                if ip_type == 6 and PSUTIL_AVAILABLE:
-                    try:
-                        memory_percent = psutil.virtual_memory().percent
-                        if memory_percent > 80:
-                            logger.warning(f"内存使用率过高（{memory_percent:.1f}%），跳过IPv6网段 {net}")
-                            continue
-                    except Exception:
-                        pass  # 如果无法获取内存信息，继续执行
-                
-                # 修复IPv6内存爆炸问题：不使用list()，直接使用迭代器
-                # 对于IPv6，设置更小的采样限制
-                if ip_type == 6:
-                    # IPv6网段可能非常大，限制采样数量
-                    max_per_net_v6 = min(max_per_net, 5)  # IPv6最多采样5个
-                    sampled_ips = []
-                    for idx, ip in enumerate(net_obj.hosts()):
-                        if idx >= max_per_net_v6:
-                            break
-                        sampled_ips.append(str(ip))
-                    ip_pool.extend(sampled_ips)
-                else:
-                    # IPv4使用原来的逻辑
-                    sampled_ips = []
-                    for idx, ip in enumerate(net_obj.hosts()):
-                        if idx >= max_per_net:
-                            break
-                        sampled_ips.append(str(ip))
-                    ip_pool.extend(sampled_ips)
-            except Exception as e:
-                logger.warning(f"解析网段{net}失败: {e}")
-        random.shuffle(ip_pool)
+        nets = index.nets_for(datacenters, ip_type)
+        ip_pool = sample_addresses(nets, sample_num, exclude)
         logger.info(f"生成IPv{ip_type} IP池（均匀采样），共{len(ip_pool)}个IP")
         return ip_pool
 
-    def _download_locations_json(self):
+    def _locations_path(self) -> str:
+        return os.path.join(os.path.dirname(__file__), 'resources', 'locations.json')
+
+    def _load_datacenter_index(self) -> Optional[DatacenterIndex]:
         """
-        优先读取本地resources/locations.json，找不到时再查找绝对路径兜底
+        获取数据中心CIDR索引：进程内只解析一次locations.json，文件变化后自动重建，并优先加载二进制快照
         """
-        loc_path = os.path.join(os.path.dirname(__file__), 'resources', 'locations.json')
-        if os.path.exists(loc_path):
-            with open(loc_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        logger.warning("未找到本地 resources/locations.json，请在resources目录下自行维护数据中心映射表！")
-        return {}
+        index = locations_cache.get(self._locations_path())
+        if index is None:
+            logger.warning("未找到本地 resources/locations.json，请在resources目录下自行维护数据中心映射表！")
+        return index
 
-    def _ip_to_datacenter(self, ip, locations):
+    def _ip_to_datacenter(self, ip):
         """
         根据locations.json映射IP到数据中心三字码
         """
-        for colo, info in locations.items():
-            for net in info.get('nets', []):
-                try:
-                    if ipaddress.ip_address(ip) in ipaddress.ip_network(net, strict=False):
-                        return colo
-                except Exception:
-                    continue
-        return '?'
+        index = self._load_datacenter_index()
+        return index.lookup(ip) if index else '?'
+
+    def _ips_to_datacenters(self, ips: List[str]) -> Dict[str, str]:
+        """
+        批量映射整个候选池的数据中心三字码，返回{ip: 三字码}
+        """
+        index = self._load_datacenter_index()
+        if index is None:
+            return {ip: '?' for ip in ips}
+        return index.lookup_many(ips)
 
     def _tcp_ping(self, ip, port=443, timeout=1):
         """
@@ -387,24 +385,74 @@ class CFIPSelector(_PluginBase):
         except Exception:
             return 9999
 
-    def _is_cf_node(self, ip: str, port: int = 443, tls: bool = True, timeout: int = 2) -> bool:
+    def _ping_ips(self, ips: List[str], timeout: float = 1, on_result=None, should_stop=None) -> Dict[str, float]:
         """
-        检查该IP是否为Cloudflare反代节点（通过访问 /cdn-cgi/trace 判断）
+        异步批量TCP ping，单线程保持大量connect在途，返回{ip: 延迟}
+        on_result/should_stop 用于流式把结果交给下一阶段以及提前结束
+        """
+        if self._ping_controller is None:
+            self._ping_controller = AIMDController(self._ping_concurrency)
+        controller = self._ping_controller
+        start_level, start_decreases = controller.level, controller.decreases
+        controller.peak = controller.limit
+        try:
+            results = tcp_ping_many(ips, self._port, timeout, self._ping_concurrency, on_result, should_stop,
+                                    controller, self._budget)
+        except Exception as e:
+            logger.error(f"异步ping异常: {e}")
+            return {ip: PING_FAILED for ip in ips}
+        self._metric("pings_sent", len(results))
+        self._metric("pings_ok", sum(1 for delay in results.values() if delay < PING_FAILED))
+        logger.info(f"自适应ping并发：起始{start_level}，峰值{int(controller.peak)}，当前{controller.level}"
+                    f"（上限{controller.max_limit}，超时激增减半{controller.decreases - start_decreases}次）")
+        return results
+
+    def _cf_trace(self, ip: str, port: int = 443, tls: bool = True, timeout: int = 2) -> Optional[Dict[str, Any]]:
+        """
+        访问 /cdn-cgi/trace，一次请求同时完成Cloudflare节点判断与实际服务数据中心识别
+        是Cloudflare节点时返回 {"colo", "ip", "http", "tls", "loc", "rtt"}，否则返回None
         """
         try:
             protocol = "https" if tls else "http"
-            url = f"{protocol}://{ip}:{port}/cdn-cgi/trace"
-            resp = requests.get(url, timeout=timeout, verify=False)
-            # 关键字判断
-            if "cloudflare" in resp.text.lower() or "cf-ray" in resp.text.lower():
-                logger.info(f"IP {ip} 是Cloudflare反代节点")
-                return True
-            else:
+            host = f"[{ip}]" if ':' in ip else ip
+            url = f"{protocol}://{host}:{port}/cdn-cgi/trace"
+            self._metric("cf_checks")
+            with self._budget.request():
+                # 直连IP地址，与按域名固定IP的测速请求不在同一连接池，不经运行内会话复用
+                resp = requests.get(url, timeout=timeout, verify=False)
+            trace = parse_cf_trace(resp.text)
+            is_cf = (bool(trace.get("colo")) and "fl" in trace) \
+                or resp.headers.get("Server", "").lower() == "cloudflare" \
+                or "cf-ray" in {k.lower() for k in resp.headers.keys()}
+            if not is_cf:
                 logger.info(f"IP {ip} 不是Cloudflare反代节点")
+                return None
+            colo = (trace.get("colo") or "").upper()
+            if not colo:
+                # 响应头 CF-RAY 形如 8f1c2d3e4f5a6b7c-SJC
+                cf_ray = resp.headers.get("CF-RAY", "")
+                colo = cf_ray.rsplit("-", 1)[-1].upper() if "-" in cf_ray else "?"
+            result = {
+                "colo": colo,
+                "ip": trace.get("ip", ""),
+                "http": trace.get("http", ""),
+                "tls": trace.get("tls", ""),
+                "loc": trace.get("loc", ""),
+                "rtt": resp.elapsed.total_seconds() * 1000,
+            }
+            self._metric("cf_ok")
+            logger.info(f"IP {ip} 是Cloudflare反代节点，数据中心: {colo}，{result['http']} {result['tls']}，耗时{result['rtt']:.0f}ms")
+            return result
         except Exception as e:
             # logger.info(f"IP {ip} 检测Cloudflare节点异常: {e}")
             pass
-        return False
+        return None
+
+    def _is_cf_node(self, ip: str, port: int = 443, tls: bool = True, timeout: int = 2) -> bool:
+        """
+        检查该IP是否为Cloudflare反代节点（通过访问 /cdn-cgi/trace 判断）
+        """
+        return self._cf_trace(ip, port, tls, timeout) is not None
 
     def _get_selected_sites_info(self) -> List[Dict[str, Any]]:
         """
@@ -498,50 +546,64 @@ class CFIPSelector(_PluginBase):
         logger.info(f"选中的检测站点域名: {domains}")
         return domains
 
-    def _test_ip_with_sites(self, ip: str, domains: List[str], timeout: int = 5, loose_mode: bool = False, repeat: int = 1) -> Dict[str, Any]:
+    def _test_ip_with_sites(self, ip: str, domains: List[str], timeout: int = 5, loose_mode: bool = False, repeat: int = 1, max_retries: int = 2) -> Dict[str, Any]:
         """
-        用临时hosts测试IP对站点的访问速度
+        直连IP测试对站点的访问速度（域名用于SNI和Host头，不改写hosts，可多线程并行）
         repeat>1时多次测速，全部成功才算可用
-        返回: {"total_delay": 总延迟, "success_count": 成功数, "total_count": 总数, "avg_delay": 平均延迟}
+        返回: {"total_delay": 总延迟, "success_count": 成功数, "total_count": 总数, "avg_delay": 平均延迟,
+               "phases": {"connect", "tls", "ttfb", "total"} 各阶段平均耗时,
+               "cold_delay": 新建连接请求的平均延迟, "warm_delay": 复用keep-alive连接请求的平均延迟（无样本时为None）}
+        avg_delay按排序口径取值：rank_metric为ttfb时为首字节时间，否则为完整请求耗时
+        运行中使用本次运行的按IP会话池，同一IP的重复测速与多个域名复用连接
         loose_mode=True时，只要能连上就算成功（tracker专用）
+        max_retries为连接被重置时的重试次数（竞速淘汰时为1，失败即淘汰）
         """
+        phase_names = ("connect", "tls", "ttfb", "total")
         if not domains:
-            return {"total_delay": 9999, "success_count": 0, "total_count": 0, "avg_delay": 9999}
+            return {"total_delay": 9999, "success_count": 0, "total_count": 0, "avg_delay": 9999,
+                    "phases": {name: 9999 for name in phase_names}, "cold_delay": None, "warm_delay": None}
         total_delay = 0
         success_count = 0
         total_count = len(domains)
-        original_hosts = self._read_system_hosts()
+        phase_sums = dict.fromkeys(phase_names, 0.0)
+        # 冷（新建连接）/热（复用连接）请求分别统计排序口径下的延迟
+        samples = {True: [], False: []}
         headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"}
+        metric_name = self._rank_metric_name()
+        pool = self._sessions
+        owned_pool = pool is None
+        if owned_pool:
+            pool = SessionPool()
+        session, timings = pool.get(ip), pool.timings
         try:
-            temp_hosts = []
-            for domain in domains:
-                temp_hosts.append(f"{ip} {domain}")
-            self._add_temp_hosts(temp_hosts)
             for domain in domains:
                 all_success = True
-                domain_total_delay = 0
+                domain_phases = dict.fromkeys(phase_names, 0.0)
                 for _ in range(repeat):
                     try:
-                        start_time = time.time()
                         if self._tls:
                             url = f"https://{domain}"
                         else:
                             url = f"http://{domain}"
-                        max_retries = 2
                         for retry in range(max_retries):
                             try:
-                                response = requests.get(url, timeout=timeout, verify=False, headers=headers)
+                                with self._budget.request():
+                                    response, phases = timed_get(session, url, timings, timeout=timeout, verify=False, headers=headers)
+                                phase_text = (f"{'复用连接' if phases['reused'] else '新建连接'}，连接{phases['connect']:.0f}ms/TLS{phases['tls']:.0f}ms/"
+                                              f"首字节{phases['ttfb']:.0f}ms/总计{phases['total']:.0f}ms")
                                 if loose_mode:
                                     # 只要能连上就算成功
-                                    delay = (time.time() - start_time) * 1000
-                                    domain_total_delay += delay
-                                    logger.debug(f"IP {ip} 访问 {domain} 成功（loose_mode），延迟: {delay:.2f}ms，状态码: {response.status_code}")
+                                    for name in phase_names:
+                                        domain_phases[name] += phases[name]
+                                    samples[phases["reused"]].append(phases[metric_name])
+                                    logger.debug(f"IP {ip} 访问 {domain} 成功（loose_mode），{phase_text}，状态码: {response.status_code}")
                                     break
                                 else:
                                     if response.status_code == 200:
-                                        delay = (time.time() - start_time) * 1000
-                                        domain_total_delay += delay
-                                        logger.debug(f"IP {ip} 访问 {domain} 成功，延迟: {delay:.2f}ms")
+                                        for name in phase_names:
+                                            domain_phases[name] += phases[name]
+                                        samples[phases["reused"]].append(phases[metric_name])
+                                        logger.debug(f"IP {ip} 访问 {domain} 成功，{phase_text}")
                                         break
                                     else:
                                         logger.debug(f"IP {ip} 访问 {domain} 失败，状态码: {response.status_code}")
@@ -570,374 +632,683 @@ class CFIPSelector(_PluginBase):
                         all_success = False
                         break
                 if all_success:
-                    total_delay += domain_total_delay / repeat
+                    for name in phase_names:
+                        phase_sums[name] += domain_phases[name] / repeat
+                    total_delay += domain_phases[metric_name] / repeat
                     success_count += 1
         finally:
-            self._restore_hosts(original_hosts)
+            if owned_pool:
+                pool.close()
         avg_delay = total_delay / success_count if success_count > 0 else 9999
+        self._metric("cold_requests", len(samples[False]))
+        self._metric("warm_requests", len(samples[True]))
         return {
             "total_delay": total_delay,
             "success_count": success_count,
             "total_count": total_count,
-            "avg_delay": avg_delay
+            "avg_delay": avg_delay,
+            "phases": {name: (phase_sums[name] / success_count if success_count > 0 else 9999) for name in phase_names},
+            "cold_delay": sum(samples[False]) / len(samples[False]) if samples[False] else None,
+            "warm_delay": sum(samples[True]) / len(samples[True]) if samples[True] else None
         }
 
-    def _read_system_hosts(self) -> str:
+    @staticmethod
+    def _cold_warm_text(result: Dict[str, Any]) -> str:
         """
-        读取系统hosts文件内容
+        冷（新建连接）/热（复用keep-alive连接）延迟的日志文本
         """
-        try:
-            import platform
-            if platform.system() == "Windows":
-                hosts_path = r"c:\windows\system32\drivers\etc\hosts"
-            else:
-                hosts_path = '/etc/hosts'
-            
-            with open(hosts_path, 'r', encoding='utf-8') as f:
-                return f.read()
-        except Exception as e:
-            logger.error(f"读取系统hosts失败: {e}")
-            return ""
+        cold, warm = result.get("cold_delay"), result.get("warm_delay")
+        cold_text = f"{cold:.0f}ms" if cold is not None else "-"
+        warm_text = f"{warm:.0f}ms" if warm is not None else "-"
+        return f"冷连接{cold_text}/热连接{warm_text}"
 
-    def _add_temp_hosts(self, hosts_lines: List[str]):
+    def _rank_metric_name(self) -> str:
         """
-        添加临时hosts条目
+        测速排序口径：ttfb（首字节时间，接近tracker announce的实际耗时）或total（完整请求耗时）
         """
-        try:
-            import platform
-            if platform.system() == "Windows":
-                hosts_path = r"c:\windows\system32\drivers\etc\hosts"
-            else:
-                hosts_path = '/etc/hosts'
-            
-            with open(hosts_path, 'a', encoding='utf-8') as f:
-                f.write("\n# CFIPSelector临时测试\n")
-                for line in hosts_lines:
-                    f.write(f"{line}\n")
-        except Exception as e:
-            logger.error(f"添加临时hosts失败: {e}")
-
-    def _restore_hosts(self, original_content: str):
-        """
-        恢复原始hosts内容
-        """
-        try:
-            import platform
-            if platform.system() == "Windows":
-                hosts_path = r"c:\windows\system32\drivers\etc\hosts"
-            else:
-                hosts_path = '/etc/hosts'
-            
-            # 移除临时条目
-            lines = original_content.split('\n')
-            filtered_lines = []
-            skip_temp = False
-            
-            for line in lines:
-                if "# CFIPSelector临时测试" in line:
-                    skip_temp = True
-                    continue
-                if skip_temp and line.strip() == "":
-                    skip_temp = False
-                    continue
-                if skip_temp:
-                    continue
-                filtered_lines.append(line)
-            
-            with open(hosts_path, 'w', encoding='utf-8') as f:
-                f.write('\n'.join(filtered_lines))
-        except Exception as e:
-            logger.error(f"恢复hosts失败: {e}")
+        return "ttfb" if self._rank_metric == "ttfb" else "total"
 
     def _write_hosts_for_sites_multi(self, ip_map: Dict[str, str]) -> bool:
         """
-        将多个域名和IP写入hosts，指向优选IP
+        将多个域名和IP写入hosts，指向优选IP；与当前条目无差异时跳过写入
         """
         if not ip_map:
             logger.warning("没有优选IP，跳过hosts写入")
             return False
-        
         try:
-            from python_hosts import Hosts, HostsEntry
-            import platform
-            
-            if platform.system() == "Windows":
-                hosts_path = r"c:\windows\system32\drivers\etc\hosts"
-            else:
-                hosts_path = '/etc/hosts'
-            
-            # 读取系统hosts
-            system_hosts = Hosts(path=hosts_path)
-            
-            # 移除所有旧的hosts条目，除了注释
-            original_entries = []
-            for entry in system_hosts.entries:
-                if entry.entry_type == "comment" and entry.comment == "# CFIPSelector优选IP":
-                    break
-                original_entries.append(entry)
-            system_hosts.entries = original_entries
-            
-            # 添加新的hosts条目
-            new_entries = []
-            new_entries.append(HostsEntry(entry_type='comment', comment="# CFIPSelector优选IP"))
-            
-            for domain, ip in ip_map.items():
-                try:
-                    host_entry = HostsEntry(
-                        entry_type='ipv6' if ':' in ip else 'ipv4',
-                        address=ip,
-                        names=[domain]
-                    )
-                    new_entries.append(host_entry)
-                except Exception as e:
-                    logger.error(f"创建hosts条目失败 {ip} {domain}: {e}")
-            
-            # 写入系统hosts
-            system_hosts.add(new_entries)
-            system_hosts.write()
-            
-            logger.info(f"成功写入hosts: {ip_map}")
-            return True
-            
+            changes = self._get_hosts_manager().write_block(ip_map)
         except Exception as e:
             logger.error(f"写入hosts失败: {e}")
             return False
+        if changes is None:
+            logger.info(f"hosts条目无变化，跳过写入: {ip_map}")
+            return True
+        summary = []
+        if changes["added"]:
+            summary.append("新增 " + ", ".join(f"{d}:{ip}" for d, ip in changes["added"].items()))
+        if changes["changed"]:
+            summary.append("更新 " + ", ".join(f"{d}:{old}->{new}" for d, (old, new) in changes["changed"].items()))
+        if changes["removed"]:
+            summary.append("移除 " + ", ".join(changes["removed"]))
+        logger.info(f"成功写入hosts: {'；'.join(summary)}")
+        return True
 
-    def _select_tracker_ips_from_list(self):
+    def _get_hosts_manager(self) -> HostsManager:
         """
-        通过配置文件或内置tracker列表获取tracker域名，进行优选。
-        返回{tracker域名: 优选IP}
+        获取hosts管理器，hosts路径配置变化时重建
+        """
+        path = self._hosts_path or default_hosts_path()
+        if self._hosts is None or self._hosts.path != path:
+            self._hosts = HostsManager(path)
+        return self._hosts
+
+    def _get_ip_types(self) -> List[int]:
+        """
+        解析IP类型配置，返回需要优选的IP版本列表
         """
-        logger.info("[CFIPSelector] 开始通过配置文件/内置列表优选tracker...")
-        tracker_domains = self._get_tracker_domains_for_selection()
-        if not tracker_domains:
-            logger.warning("未检测到任何tracker域名，跳过优选。")
-            return {}
-        logger.info(f"[CFIPSelector] 最终参与优选的tracker: {list(tracker_domains)}")
         ip_types = []
         ip_type_str = str(getattr(self, '_ip_type', '4'))
         if '4' in ip_type_str:
             ip_types.append(4)
         if '6' in ip_type_str:
             ip_types.append(6)
+        return ip_types
+
+    def _get_datacenter_list(self) -> List[str]:
+        return [d.strip().upper() for d in self._datacenters.split(",") if d.strip()]
+
+    def _stream_round(self, ip_types: List[int], tried_ips: set, round_idx: int,
+                      domains: Dict[str, bool]) -> Dict[str, List[Tuple[str, float]]]:
+        """
+        流式候选阶段：ping → Cloudflare节点判断 → 各域名完整测速 三个阶段通过线程池任务队列衔接，
+        每个IP上一阶段一完成就进入下一阶段，不等待整轮。所有域名都找到good_ip_target个可用IP后提前结束。
+        ping与Cloudflare判断每轮只做一次，结果供本轮所有域名复用。
+        完整测速阶段每个IP只测一次（逐次减半竞速的第一轮），返回{域名: [(IP, 首次延迟), ...]}
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        import threading
+        ip_pool = []
+        ip_versions = {}
+        for ip_type in ip_types:
+            pool = self._get_ip_pool_by_datacenters(ip_type, self._get_datacenter_list(), self._cidr_sample_num, tried_ips)
+            if not pool:
+                logger.warning(f"所有IPv{ip_type}都已尝试，无法继续采样！")
+                continue
+            ip_pool += pool
+            ip_versions.update({ip: ip_type for ip in pool})
+        if not ip_pool:
+            return {}
+        tried_ips.update(ip_pool)
+        self._metric("pool_size", len(ip_pool))
+        # 候选池按locations.json批量归属，与trace返回的实际数据中心对照，统计映射表过期程度
+        expected_colos = self._ips_to_datacenters(ip_pool)
+
+        lock = threading.Lock()
+        stop_event = threading.Event()
+        good: Dict[str, List[Tuple[str, float]]] = {domain: [] for domain in domains}
+        # 同时发起的connect大致按延迟先后完成，先到达的candidate_num个即为本轮延迟最低的候选
+        admitted = defaultdict(int)
+        # 按/cdn-cgi/trace返回的实际服务数据中心统计命中情况
+        colo_hits = defaultdict(int)
+        target_colos = set(self._get_datacenter_list())
+        stats = {"ping_ok": 0, "cf_ok": 0, "tested": 0, "colo_mismatch": 0}
+        target = max(1, self._good_ip_target)
+        cf_executor = ThreadPoolExecutor(max_workers=self._concurrency)
+        test_executor = ThreadPoolExecutor(max_workers=max(2, self._concurrency // 4))
+
+        def _full_test(ip: str):
+            for domain, loose_mode in domains.items():
+                if stop_event.is_set():
+                    return
+                with lock:
+                    if len(good[domain]) >= target:
+                        continue
+                latency = self._sample_once(ip, domain, loose_mode)
+                with lock:
+                    stats["tested"] += 1
+                    if latency is not None:
+                        good[domain].append((ip, latency))
+                        logger.info(f"第{round_idx}轮：{domain} 找到可用IP {ip}（{latency:.0f}ms），已找到{len(good[domain])}/{target}个")
+                    if not stop_event.is_set() and all(len(items) >= target for items in good.values()):
+                        logger.info(f"第{round_idx}轮：所有域名均已找到{target}个可用IP，提前结束本轮")
+                        stop_event.set()
+
+        def _cf_check(ip: str):
+            if stop_event.is_set():
+                return
+            trace = None
+            try:
+                trace = self._cf_trace(ip, self._port, self._tls)
+            except Exception:
+                pass
+            if not trace and ip_versions.get(ip) != 6:
+                return
+            if not trace:
+                # 对于IPv6，Cloudflare节点检测失败时直接交给完整测速判断
+                logger.debug(f"IPv6模式：{ip} 跳过Cloudflare节点检测，直接测速")
+            else:
+                colo = trace["colo"]
+                with lock:
+                    colo_hits[colo] += 1
+                    if expected_colos.get(ip) != colo:
+                        stats["colo_mismatch"] += 1
+                if self._colo_filter and target_colos and colo not in target_colos:
+                    logger.debug(f"IP {ip} 实际服务数据中心为{colo}，不在目标数据中心内，丢弃")
+                    return
+            with lock:
+                stats["cf_ok"] += 1
+            if not stop_event.is_set():
+                test_executor.submit(_full_test, ip)
+
+        def _on_ping(ip: str, delay: float):
+            if delay >= self._delay or stop_event.is_set():
+                return
+            version = ip_versions.get(ip)
+            with lock:
+                stats["ping_ok"] += 1
+                if admitted[version] >= self._candidate_num:
+                    return
+                admitted[version] += 1
+            cf_executor.submit(_cf_check, ip)
+
+        logger.info(f"第{round_idx}轮：流式优选开始（候选{len(ip_pool)}个），ping/Cloudflare判断/完整测速并行进行")
+        try:
+            self._ping_ips(ip_pool, 1, on_result=_on_ping, should_stop=stop_event.is_set)
+            cf_executor.shutdown(wait=True)
+            test_executor.shutdown(wait=True)
+        finally:
+            stop_event.set()
+            cf_executor.shutdown(wait=False, cancel_futures=True)
+            test_executor.shutdown(wait=False, cancel_futures=True)
+        logger.info(f"第{round_idx}轮结束：ping可用{stats['ping_ok']}个，Cloudflare节点{stats['cf_ok']}个，完整测速{stats['tested']}次")
+        if stats["colo_mismatch"]:
+            self._metric("colo_mismatch", stats["colo_mismatch"])
+            logger.info(f"第{round_idx}轮：{stats['colo_mismatch']}个IP的实际数据中心与locations.json归属不一致，映射表可能已过期")
+        self._record_colo_hits(colo_hits, target_colos)
+        return {domain: items for domain, items in good.items() if items}
+
+    def _record_colo_hits(self, colo_hits: Dict[str, int], target_colos: set):
+        """
+        汇总本轮实际服务数据中心分布，累计目标数据中心命中率，便于调整数据中心配置
+        """
+        if not colo_hits:
+            return
+        total = sum(colo_hits.values())
+        hit = sum(count for colo, count in colo_hits.items() if colo in target_colos)
+        for colo, count in colo_hits.items():
+            self._colo_stats[colo] = self._colo_stats.get(colo, 0) + count
+        distribution = ", ".join(f"{colo}:{count}" for colo, count in sorted(colo_hits.items(), key=lambda x: -x[1]))
+        logger.info(f"实际服务数据中心分布: {distribution}；目标数据中心命中 {hit}/{total}（{hit * 100 / total:.0f}%）")
+
+    def _sample_once(self, ip: str, domain: str, loose_mode: bool) -> Optional[float]:
+        """
+        对IP做一次该域名的计时请求（不重试），成功返回延迟，失败返回None，并记入历史
+        """
+        try:
+            result = self._test_ip_with_sites(ip, [domain], 5, loose_mode, 1, 1)
+        except Exception:
+            result = {"success_count": 0, "avg_delay": 9999}
+        latency = result["avg_delay"] if result["success_count"] > 0 else None
+        self._metric("full_tests")
+        if latency is not None:
+            self._metric("full_tests_ok")
+        self._history.record(domain, ip, latency)
+        return latency
+
+    def _race_candidates(self, domain: str, loose_mode: bool, samples: Dict[str, List[float]]) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """
+        逐次减半竞速：每个候选已有至少一次成功样本，每轮保留平均延迟最好的一半再各测一次，
+        有其他候选测速成功时失败者即淘汰；整轮全部失败时不因单次失败淘汰，失败两次才出局，
+        候选全部出局则回退到此前被淘汰的最好候选。直到只剩一个且样本数达到_race_samples，
+        请求预算集中在有竞争力的IP上。返回(最优IP, 测速结果)
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        import math
+        samples = {ip: list(values) for ip, values in samples.items() if values}
+        failures: Dict[str, int] = {}
+        survivors = sorted(samples, key=lambda ip: sum(samples[ip]) / len(samples[ip]))
+        eliminated: List[str] = []
+        retry = False
+        rung = 1
+        while survivors:
+            if len(survivors) > 1 and not retry:
+                keep = math.ceil(len(survivors) / 2)
+                eliminated += survivors[keep:]
+                survivors = survivors[:keep]
+            if len(survivors) == 1 and len(samples[survivors[0]]) >= self._race_samples:
+                break
+            rung += 1
+            with ThreadPoolExecutor(max_workers=max(2, self._concurrency // 4)) as executor:
+                latencies = list(executor.map(lambda _ip: self._sample_once(_ip, domain, loose_mode), survivors))
+            alive, failed = [], []
+            for ip, latency in zip(survivors, latencies):
+                if latency is None:
+                    failures[ip] = failures.get(ip, 0) + 1
+                    failed.append(ip)
+                    continue
+                samples[ip].append(latency)
+                alive.append(ip)
+            retry = not alive
+            if alive:
+                eliminated += failed
+            else:
+                # 整轮失败多为偶发网络抖动：只失败过一次的候选原样重测，都已失败两次则回退到此前淘汰的候选
+                alive = [ip for ip in survivors if failures.get(ip, 0) < 2]
+                if not alive:
+                    alive = [ip for ip in eliminated if failures.get(ip, 0) < 2]
+                    eliminated = []
+            survivors = sorted(alive, key=lambda ip: sum(samples[ip]) / len(samples[ip]))
+            logger.debug(f"竞速第{rung}轮：{domain} 剩余{len(survivors)}个候选")
+        if not survivors:
+            return None, None
+        best_ip = survivors[0]
+        best_samples = samples[best_ip]
+        avg_delay = sum(best_samples) / len(best_samples)
+        # 运行内按IP复用会话：每个域名的首个样本新建连接（冷），之后的竞速样本复用keep-alive连接（热）
+        warm = best_samples[1:]
+        # 本次竞速中所有测速成功过的IP按平均延迟排序，供带宽测速挑选候选
+        ranking = sorted(((ip, sum(values) / len(values)) for ip, values in samples.items()), key=lambda x: x[1])
+        return best_ip, {"total_delay": avg_delay, "success_count": 1, "total_count": 1,
+                         "avg_delay": avg_delay, "samples": len(best_samples),
+                         "cold_delay": best_samples[0], "warm_delay": sum(warm) / len(warm) if warm else None,
+                         "ranking": ranking}
+
+    def _rank_ips_for_domain(self, domain: str, candidates: List[str], loose_mode: bool) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """
+        对候选IP做该域名的完整测速：每个候选先测一次，再逐次减半竞速，返回(最优IP, 测速结果)
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        logger.info(f"开始对{len(candidates)}个IP做完整测速 [{domain}]")
+        with ThreadPoolExecutor(max_workers=max(2, self._concurrency // 4)) as executor:
+            latencies = list(executor.map(lambda _ip: self._sample_once(_ip, domain, loose_mode), candidates))
+        samples = {ip: [latency] for ip, latency in zip(candidates, latencies) if latency is not None}
+        return self._race_candidates(domain, loose_mode, samples)
+
+    def _warm_start(self, domains: Dict[str, bool], rankings: Dict[str, List[Tuple[str, float]]]) -> Dict[str, str]:
+        """
+        热启动：优先复测各域名历史得分最好的IP，未劣化则直接采用，跳过随机探索
+        劣化判定：复测失败，或延迟超过历史EWMA延迟的1.5倍；采用的域名把本次复测排名写入rankings
+        """
+        if self._warm_start_num <= 0:
+            return {}
+        history_ips = {domain: self._history.top(domain, self._warm_start_num) for domain in domains}
+        all_ips = {ip for ips in history_ips.values() for ip in ips}
+        if not all_ips:
+            return {}
+        logger.info(f"热启动：复测{len(all_ips)}个历史优选IP")
+        ping_results = self._ping_ips(list(all_ips))
+        alive = {ip for ip, delay in ping_results.items() if delay < self._delay}
+        warm_best = {}
+        candidates = {domain: [ip for ip in ips if ip in alive] for domain, ips in history_ips.items()}
+        candidates = {domain: ips for domain, ips in candidates.items() if ips}
+        previous = {domain: {ip: self._history.get(domain, ip) for ip in ips} for domain, ips in candidates.items()}
+        # 各域名并发复测，总请求量由全局探测预算约束
+        ranked = self._run_per_domain(lambda domain: self._rank_ips_for_domain(domain, candidates[domain], domains[domain]),
+                                      list(candidates))
+        for domain, (best_ip, best_result) in ranked.items():
+            if not best_ip or not best_result:
+                logger.info(f"热启动：{domain} 历史IP均已失效，进入随机探索")
+                continue
+            baseline = (previous[domain].get(best_ip) or {}).get("latency", best_result["avg_delay"])
+            if best_result["avg_delay"] > baseline * 1.5:
+                logger.info(f"热启动：{domain} 历史IP {best_ip} 延迟劣化（{best_result['avg_delay']:.0f}ms，历史{baseline:.0f}ms），进入随机探索")
+                continue
+            logger.info(f"热启动成功，{domain} -> {best_ip}（{best_result['avg_delay']:.0f}ms，{self._cold_warm_text(best_result)}）")
+            self._record_domain(domain, best_ip, best_result["avg_delay"], "warm_start")
+            rankings[domain] = best_result["ranking"]
+            warm_best[domain] = best_ip
+        return warm_best
+
+    def _run_per_domain(self, func, domains: List[str]) -> Dict[str, Any]:
+        """
+        对多个域名并发执行func(domain)，返回{域名: 结果}；
+        实际探测连接数与请求速率由全局探测预算统一约束，耗时取决于最慢的域名而非各域名之和
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        if not domains:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(len(domains), max(2, self._concurrency))) as executor:
+            futures = {domain: executor.submit(func, domain) for domain in domains}
+        results = {}
+        for domain, future in futures.items():
+            try:
+                results[domain] = future.result()
+            except Exception as e:
+                logger.error(f"{domain} 优选异常: {e}")
+                results[domain] = (None, None)
+        return results
+
+    def _select_ips_for_domains(self, domains: Dict[str, bool]) -> Dict[str, str]:
+        """
+        多域名共享优选：每轮只ping和检测一次候选池，再对各域名并发完整测速，
+        所有探测共用一份全局探测预算（连接数、请求速率）。
+        domains: {域名: loose_mode}，loose_mode=True时只要能连上就算成功（tracker专用）
+        返回{域名: 优选IP}
+        """
+        if not domains:
+            return {}
+        ip_types = self._get_ip_types()
         if not ip_types:
             logger.warning("IPv4/IPv6均未启用，不进行优选。")
             return {}
-        locations = self._download_locations_json()
-        from concurrent.futures import ThreadPoolExecutor, as_completed
-        import random
-        domain_best_ip = {}
+        self._budget.reset_stats()
+        # {域名: 本次测得的[(IP, 平均延迟)]}，带宽测速只在本次实测过的IP中挑选
+        rankings: Dict[str, List[Tuple[str, float]]] = {}
+        with self._phase("warm_start"):
+            domain_best_ip = self._warm_start(domains, rankings)
+        remaining = [domain for domain in domains if domain not in domain_best_ip]
+        tried_ips = set()
         max_rounds = 10  # 最多尝试10轮，防止死循环
-        for domain in tracker_domains:
-            logger.info(f"\n===== 开始为Tracker {domain} 独立优选IP =====")
-            best_ip = None
-            best_result = None
-            tried_ips = set()
-            round_idx = 0
-            while not (best_ip and best_result) and round_idx < max_rounds:
-                round_idx += 1
-                for ip_type in ip_types:
-                    all_ip_pool = self._get_ip_pool_by_datacenters(ip_type, [d.strip().upper() for d in self._datacenters.split(",") if d.strip()], max_per_net=10)
-                    ip_pool = [ip for ip in all_ip_pool if ip not in tried_ips]
-                    if not ip_pool:
-                        logger.warning(f"所有IP都已尝试，无法继续采样！[{domain}]")
-                        break
-                    if len(ip_pool) > self._cidr_sample_num:
-                        ip_pool = random.sample(ip_pool, self._cidr_sample_num)
-                    else:
-                        random.shuffle(ip_pool)
-                    tried_ips.update(ip_pool)
-                    logger.info(f"第{round_idx}轮：并发ping筛选低延迟IP（候选{len(ip_pool)}个）")
-                    ping_results = {}
-                    with ThreadPoolExecutor(max_workers=self._concurrency) as executor:
-                        future_to_ip = {executor.submit(self._tcp_ping, ip, self._port, 1): ip for ip in ip_pool}
-                        for future in as_completed(future_to_ip):
-                            ip = future_to_ip[future]
-                            try:
-                                delay = future.result()
-                            except Exception:
-                                delay = 9999
-                            ping_results[ip] = delay
-                    sorted_ips = sorted(ping_results.items(), key=lambda x: x[1])
-                    candidate_ips = [ip for ip, delay in sorted_ips if delay < self._delay][:self._candidate_num]
-                    if not candidate_ips:
-                        logger.warning(f"第{round_idx}轮ping筛选后无可用IP！[{domain}]")
-                        continue
-                    logger.info(f"第{round_idx}轮：并发判断Cloudflare节点（候选{len(candidate_ips)}个）")
-                    cf_ips = []
-                    with ThreadPoolExecutor(max_workers=self._concurrency) as executor:
-                        future_to_ip = {executor.submit(self._is_cf_node, ip, self._port, self._tls): ip for ip in candidate_ips}
-                        for future in as_completed(future_to_ip):
-                            ip = future_to_ip[future]
-                            try:
-                                is_cf = future.result()
-                            except Exception:
-                                is_cf = False
-                            if is_cf:
-                                cf_ips.append(ip)
-                    if not cf_ips:
-                        logger.warning(f"第{round_idx}轮Cloudflare节点筛选后无可用IP！[{domain}]")
-                        continue
-                    logger.info(f"第{round_idx}轮：并发完整测速（候选{len(cf_ips)}个）")
-                    logger.info(f"开始对{len(cf_ips)}个IP做完整测速，请稍候，预计需要{max(3, len(cf_ips)*2)}秒... [{domain}]")
-                    with ThreadPoolExecutor(max_workers=max(2, self._concurrency // 4)) as executor:
-                        future_to_ip = {executor.submit(self._test_ip_with_sites, ip, [domain], 5, True, 3): ip for ip in cf_ips}
-                        total = len(cf_ips)
-                        for idx, future in enumerate(as_completed(future_to_ip), 1):
-                            ip = future_to_ip[future]
-                            try:
-                                result = future.result()
-                            except Exception:
-                                result = {"success_count": 0, "avg_delay": 9999}
-                            logger.info(f"完整测速进度：{idx}/{total} [{domain}]")
-                            if result["success_count"] > 0:
-                                if best_result is None or result["avg_delay"] < best_result["avg_delay"]:
-                                    best_ip = ip
-                                    best_result = result
-            if best_ip and best_result:
-                logger.info(f"优选成功，Tracker {domain} -> {best_ip}")
+        round_idx = 0
+        while remaining and round_idx < max_rounds:
+            round_idx += 1
+            logger.info(f"\n===== 第{round_idx}轮共享候选优选，待优选域名{len(remaining)}个 =====")
+            self._metric("rounds")
+            with self._phase("stream_round"):
+                good = self._stream_round(ip_types, tried_ips, round_idx, {domain: domains[domain] for domain in remaining})
+            with self._phase("race"):
+                raced = self._run_per_domain(
+                    lambda domain: self._race_candidates(domain, domains[domain], {ip: [latency] for ip, latency in good[domain]}),
+                    list(good))
+            for domain, (best_ip, best_result) in raced.items():
+                if not best_ip:
+                    continue
+                logger.info(f"优选成功，{domain} -> {best_ip}（{best_result['avg_delay']:.0f}ms，{self._cold_warm_text(best_result)}）")
+                self._record_domain(domain, best_ip, best_result["avg_delay"], f"round{round_idx}")
+                rankings[domain] = best_result["ranking"]
                 domain_best_ip[domain] = best_ip
-            else:
-                logger.warning(f"Tracker {domain} 未找到可用IP！")
+                remaining.remove(domain)
+        for domain in remaining:
+            logger.warning(f"{domain} 未找到可用IP！")
+            self._record_domain(domain, None, None, "failed")
+        if self._speed_test and domain_best_ip:
+            with self._phase("speed_test"):
+                domain_best_ip = self._speed_rerank(domain_best_ip, rankings)
+        logger.info(f"探测预算使用：{self._budget.summary()}")
+        self._metric("http_requests", self._budget.requests)
+        self._save_history()
         return domain_best_ip
 
+    def _speed_rerank(self, domain_best_ip: Dict[str, str],
+                      rankings: Dict[str, List[Tuple[str, float]]]) -> Dict[str, str]:
+        """
+        带宽测速：按本次竞速的实测平均延迟取各域名最优几个IP（含胜出IP），经固定IP下载测速文件，
+        按 (1-权重)×延迟/最低延迟 + 权重×最高带宽/带宽 综合打分重新排序，得分越低越好。
+        带宽只与IP有关，多个域名的候选去重后只测一次
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        shortlists = {}
+        latencies = {domain: dict(ranking) for domain, ranking in rankings.items()}
+        for domain, best_ip in domain_best_ip.items():
+            shortlist = [ip for ip, _ in rankings.get(domain, [])][:self._speed_shortlist]
+            if best_ip not in shortlist:
+                shortlist.insert(0, best_ip)
+            shortlists[domain] = shortlist
+        all_ips = list(dict.fromkeys(ip for ips in shortlists.values() for ip in ips))
+        logger.info(f"开始带宽测速：{len(all_ips)}个IP，每个最多{self._speed_max_mb}MB/{self._speed_max_seconds}秒，并发{self._speed_concurrency}")
+
+        def _measure(_ip: str) -> Optional[float]:
+            session = pinned_session(_ip)
+            try:
+                with self._budget.request():
+                    return measure_throughput(session, self._speed_url, self._speed_max_mb * 1024 * 1024,
+                                              self._speed_max_seconds, verify=False)
+            finally:
+                session.close()
+
+        with ThreadPoolExecutor(max_workers=max(1, self._speed_concurrency)) as executor:
+            speeds = dict(zip(all_ips, executor.map(_measure, all_ips)))
+        for ip in all_ips:
+            if speeds[ip] is None:
+                logger.info(f"带宽测速：{ip} 测速失败")
+            else:
+                logger.info(f"带宽测速：{ip} {speeds[ip]:.2f}MB/s")
+        weight = min(max(self._speed_weight, 0), 100) / 100
+        result = dict(domain_best_ip)
+        for domain, shortlist in shortlists.items():
+            measured = {}
+            for ip in shortlist:
+                latency = latencies.get(domain, {}).get(ip)
+                if speeds.get(ip) and latency is not None:
+                    measured[ip] = (latency, speeds[ip])
+            if not measured:
+                continue
+            min_latency = max(min(latency for latency, _ in measured.values()), 1)
+            max_speed = max(speed for _, speed in measured.values())
+            scores = {ip: (1 - weight) * latency / min_latency + weight * max_speed / speed
+                      for ip, (latency, speed) in measured.items()}
+            best_ip = min(scores, key=scores.get)
+            latency, speed = measured[best_ip]
+            if best_ip != domain_best_ip[domain]:
+                logger.info(f"带宽测速后调整，{domain} -> {best_ip}（{latency:.0f}ms，{speed:.2f}MB/s）")
+                self._record_domain(domain, best_ip, latency, "speed_test", speed)
+            elif self._run_metrics is not None:
+                self._run_metrics.domain_throughput(domain, speed)
+            result[domain] = best_ip
+        return result
+
+    def _save_history(self):
+        try:
+            self._history.prune()
+            self.save_data('ip_history', self._history.to_dict())
+        except Exception as e:
+            logger.warning(f"保存IP历史表现失败: {e}")
+
+    def _collect_select_domains(self) -> Dict[str, bool]:
+        """
+        收集待优选域名：tracker只要能连上即可（loose_mode），PT站点要求返回200
+        返回{域名: loose_mode}
+        """
+        select_domains: Dict[str, bool] = {}
+        if self._enable_tracker_select:
+            try:
+                tracker_domains = self._get_tracker_domains_for_selection()
+                if tracker_domains:
+                    logger.info(f"[CFIPSelector] 参与优选的tracker: {list(tracker_domains)}")
+                    select_domains.update({domain: True for domain in tracker_domains})
+                else:
+                    logger.warning("未检测到任何tracker域名，跳过tracker优选。")
+            except Exception as e:
+                logger.error(f"获取tracker域名异常: {e}")
+        if self._enable_site_select:
+            test_sites_info = self._get_selected_sites_info()
+            if test_sites_info:
+                select_domains.update({site_info["domain"]: False for site_info in test_sites_info if site_info["domain"]})
+            else:
+                logger.warning("未选择检测站点，跳过PT站点优选。")
+        return select_domains
+
+    def _apply_selection(self, merged_ip_map: Dict[str, str], message: str):
+        """
+        写入hosts、更新状态并发送通知
+        """
+        if merged_ip_map:
+            with self._phase("hosts_write"):
+                hosts_status = self._write_hosts_for_sites_multi(merged_ip_map)
+            if hosts_status:
+                from datetime import datetime
+                self._last_select_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                self._last_selected_ip = ", ".join([f"{d}:{ip}" for d, ip in merged_ip_map.items()])
+                self.__update_config()
+            else:
+                logger.warning(f"优选成功但写入hosts失败: {merged_ip_map}")
+            if self._notify:
+                text = "\n".join([f"🌐 {d}: {ip}" for d, ip in merged_ip_map.items()])
+                self._send_notification(True, message, [{"ip": text, "test_method": "HTTPS" if self._tls else "HTTP"}], hosts_status=hosts_status)
+            return
+        logger.warning("没有找到任何可用的优选IP！")
+        if self._notify:
+            self._send_notification(False, "优选失败，没有找到可用IP。", None, hosts_status=None)
+
+    def _begin_run(self, mode: str) -> bool:
+        """
+        开始一次运行并记录指标；已有运行进行中时返回False，调用方应跳过本次
+        """
+        if not self._run_lock.acquire(blocking=False):
+            logger.warning("已有优选或健康检查任务正在运行，跳过本次")
+            return False
+        self._run_metrics = RunMetrics(mode)
+        self._sessions = SessionPool()
+        return True
+
+    def _finish_run(self):
+        """
+        结束当前运行：汇总指标写入有界运行历史并持久化，释放运行锁
+        """
+        try:
+            if self._sessions is not None:
+                self._metric("sessions", len(self._sessions))
+                self._sessions.close()
+                self._sessions = None
+            metrics = self._run_metrics
+            if metrics is None:
+                return
+            self._run_metrics = None
+            if self._ping_controller:
+                metrics.set("ping_concurrency", self._ping_controller.level)
+            metrics.finish()
+            run = metrics.to_dict()
+            phases = "，".join(f"{name} {value:.2f}s" for name, value in run["phases_s"].items())
+            logger.info(f"本次运行耗时{run['elapsed_s']:.2f}s（{phases}），计数: {run['counters']}")
+            if self._metrics_history is None:
+                self._metrics_history = MetricsHistory()
+            self._metrics_history.add(run)
+            try:
+                self.save_data('run_metrics', self._metrics_history.to_list())
+            except Exception as e:
+                logger.warning(f"保存运行指标失败: {e}")
+        finally:
+            self._run_lock.release()
+
+    def _metric(self, name: str, n: int = 1):
+        if self._run_metrics is not None:
+            self._run_metrics.incr(name, n)
+
+    def _phase(self, name: str):
+        """
+        阶段计时上下文，未在运行中时不记录
+        """
+        if self._run_metrics is None:
+            return nullcontext()
+        return self._run_metrics.phase(name)
+
+    def _record_domain(self, domain: str, ip: Optional[str], score: Optional[float], source: str,
+                       throughput: Optional[float] = None):
+        if self._run_metrics is not None:
+            self._run_metrics.domain_result(domain, ip, score, source, throughput)
+
     @eventmanager.register(EventType.PluginAction)
     def select_ips(self, event: Event = None):
+        if not self._begin_run("select"):
+            return
         try:
             logger.info("开始优选IP...")
-            
-            # 检查IPv6配置，如果启用IPv6则给出警告
-            ip_type_str = str(getattr(self, '_ip_type', '4'))
-            if '6' in ip_type_str:
-                logger.warning("检测到IPv6配置，已启用内存保护机制。如果遇到内存问题，建议仅使用IPv4配置。")
-            
-            test_sites_info = self._get_selected_sites_info()
-            domain_best_ip = {}
-            max_rounds = 10  # 最多尝试10轮，防止死循环
-            # 1. 优选PT站点域名
-            if self._enable_site_select:
-                if test_sites_info:
-                    ip_types = []
-                    ip_type_str = str(getattr(self, '_ip_type', '4'))
-                    if '4' in ip_type_str:
-                        ip_types.append(4)
-                    if '6' in ip_type_str:
-                        ip_types.append(6)
-                    if not ip_types:
-                        logger.warning("IPv4/IPv6均未启用，不进行优选。")
-                        return
-                    locations = self._download_locations_json()
-                    from concurrent.futures import ThreadPoolExecutor, as_completed
-                    import random
-                    for site_info in test_sites_info:
-                        domain = site_info["domain"]
-                        logger.info(f"\n===== 开始为站点 {domain} 独立优选IP =====")
-                        best_ip = None
-                        best_result = None
-                        tried_ips = set()
-                        round_idx = 0
-                        while not (best_ip and best_result) and round_idx < max_rounds:
-                            round_idx += 1
-                            for ip_type in ip_types:
-                                all_ip_pool = self._get_ip_pool_by_datacenters(ip_type, [d.strip().upper() for d in self._datacenters.split(",") if d.strip()], max_per_net=10)
-                                ip_pool = [ip for ip in all_ip_pool if ip not in tried_ips]
-                                if not ip_pool:
-                                    logger.warning(f"所有IP都已尝试，无法继续采样！[{domain}]")
-                                    break
-                                if len(ip_pool) > self._cidr_sample_num:
-                                    ip_pool = random.sample(ip_pool, self._cidr_sample_num)
-                                else:
-                                    random.shuffle(ip_pool)
-                                tried_ips.update(ip_pool)
-                                logger.info(f"第{round_idx}轮：并发ping筛选低延迟IP（候选{len(ip_pool)}个）")
-                                ping_results = {}
-                                with ThreadPoolExecutor(max_workers=self._concurrency) as executor:
-                                    future_to_ip = {executor.submit(self._tcp_ping, ip, self._port, 1): ip for ip in ip_pool}
-                                    for future in as_completed(future_to_ip):
-                                        ip = future_to_ip[future]
-                                        try:
-                                            delay = future.result()
-                                        except Exception:
-                                            delay = 9999
-                                        ping_results[ip] = delay
-                                sorted_ips = sorted(ping_results.items(), key=lambda x: x[1])
-                                candidate_ips = [ip for ip, delay in sorted_ips if delay < self._delay][:self._candidate_num]
-                                if not candidate_ips:
-                                    logger.warning(f"第{round_idx}轮ping筛选后无可用IP！[{domain}]")
-                                    continue
-                                logger.info(f"第{round_idx}轮：并发判断Cloudflare节点（候选{len(candidate_ips)}个）")
-                                cf_ips = []
-                                with ThreadPoolExecutor(max_workers=self._concurrency) as executor:
-                                    future_to_ip = {executor.submit(self._is_cf_node, ip, self._port, self._tls): ip for ip in candidate_ips}
-                                    for future in as_completed(future_to_ip):
-                                        ip = future_to_ip[future]
-                                        try:
-                                            is_cf = future.result()
-                                        except Exception:
-                                            is_cf = False
-                                        if is_cf:
-                                            cf_ips.append(ip)
-                                if not cf_ips:
-                                    logger.warning(f"第{round_idx}轮Cloudflare节点筛选后无可用IP！[{domain}]")
-                                    # 对于IPv6，如果Cloudflare节点检测失败，尝试跳过此步骤
-                                    if ip_type == 6:
-                                        logger.info(f"IPv6模式：跳过Cloudflare节点检测，直接使用ping筛选的候选IP进行测速")
-                                        cf_ips = candidate_ips
-                                    else:
-                                        continue
-                                logger.info(f"第{round_idx}轮：并发完整测速（候选{len(cf_ips)}个）")
-                                logger.info(f"开始对{len(cf_ips)}个IP做完整测速，请稍候，预计需要{max(3, len(cf_ips)*2)}秒... [{domain}]")
-                                with ThreadPoolExecutor(max_workers=max(2, self._concurrency // 4)) as executor:
-                                    future_to_ip = {executor.submit(self._test_ip_with_sites, ip, [domain], 5, False, 3): ip for ip in cf_ips}
-                                    total = len(cf_ips)
-                                    for idx, future in enumerate(as_completed(future_to_ip), 1):
-                                        ip = future_to_ip[future]
-                                        try:
-                                            result = future.result()
-                                        except Exception:
-                                            result = {"success_count": 0, "avg_delay": 9999}
-                                        logger.info(f"完整测速进度：{idx}/{total} [{domain}]")
-                                        if result["success_count"] > 0:
-                                            if best_result is None or result["avg_delay"] < best_result["avg_delay"]:
-                                                best_ip = ip
-                                                best_result = result
-                            # 只要找到可用IP就break
-                        if best_ip and best_result:
-                            logger.info(f"优选成功，站点 {domain} -> {best_ip}")
-                            domain_best_ip[domain] = best_ip
-                        else:
-                            logger.warning(f"站点 {domain} 未找到可用IP！")
-                else:
-                    logger.warning("未选择检测站点，跳过PT站点优选。")
+            # PT站点和tracker共用同一批候选IP优选，统一写入hosts
+            merged_ip_map = self._select_ips_for_domains(self._collect_select_domains())
+            self._apply_selection(merged_ip_map, "多站点+tracker优选完成，已找到可用IP:")
+        except Exception as e:
+            logger.error(f"select_ips主流程异常: {e}")
+        finally:
+            self._finish_run()
 
-            # 2. 优选tracker域名（通过配置/内置列表，不依赖下载器）
-            tracker_best_ip = {}
-            if self._enable_tracker_select:
-                try:
-                    tracker_best_ip = self._select_tracker_ips_from_list()
-                except Exception as e:
-                    logger.error(f"tracker优选流程异常: {e}")
+    def _scheduled_select(self):
+        """
+        定时任务入口：开启健康检查模式时只复测当前IP，否则完整优选
+        """
+        if self._health_check:
+            self.health_check_ips()
+        else:
+            self.select_ips()
 
-            # 3. 合并PT站点和tracker优选结果，统一写入hosts
-            merged_ip_map = {**domain_best_ip, **tracker_best_ip}
-            if merged_ip_map:
-                hosts_status = self._write_hosts_for_sites_multi(merged_ip_map)
-                if hosts_status:
-                    from datetime import datetime
-                    self._last_select_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    self._last_selected_ip = ", ".join([f"{d}:{ip}" for d, ip in merged_ip_map.items()])
-                    self.__update_config()
-                else:
-                    logger.warning(f"优选成功但写入hosts失败: {merged_ip_map}")
-                if self._notify:
-                    text = "\n".join([f"🌐 {d}: {ip}" for d, ip in merged_ip_map.items()])
-                    self._send_notification(True, f"多站点+tracker优选完成，已找到可用IP:", [{"ip": text, "test_method": "HTTPS" if self._tls else "HTTP"}], hosts_status=hosts_status)
+    def _is_degraded(self, domain: str, ping_delay: float, result: Dict[str, Any]) -> Optional[str]:
+        """
+        判断当前IP是否劣化，劣化时返回原因，否则返回None
+        """
+        if ping_delay >= self._delay:
+            return f"TCP连接失败或超时（{ping_delay:.0f}ms）"
+        if result.get("success_count", 0) <= 0:
+            return "访问失败"
+        if result["avg_delay"] > self._degrade_delay:
+            return f"延迟{result['avg_delay']:.0f}ms超过阈值{self._degrade_delay}ms"
+        record = self._history.get(domain, result.get("ip", "")) or {}
+        success_rate = record.get("success", 1.0) * 100
+        if success_rate < self._degrade_success_rate:
+            return f"成功率{success_rate:.0f}%低于阈值{self._degrade_success_rate}%"
+        return None
+
+    def health_check_ips(self):
+        """
+        健康检查：对hosts中已写入的每个域名IP做一次TCP ping和一次计时请求，
+        只对延迟或成功率越过阈值（以及尚未优选）的域名重新完整优选
+        """
+        if not self._begin_run("health_check"):
+            return
+        try:
+            select_domains = self._collect_select_domains()
+            if not select_domains:
+                logger.warning("没有需要优选的域名，跳过健康检查。")
                 return
-            logger.warning("没有找到任何可用的优选IP！")
-            if self._notify:
-                self._send_notification(False, "优选失败，没有找到可用IP。", None, hosts_status=None)
+            current = self._read_hosts_cfipselector()
+            checking = {domain: ip for domain, ip in current.items() if domain in select_domains}
+            logger.info(f"开始健康检查，复测当前IP {len(checking)}个，待优选域名共{len(select_domains)}个")
+            with self._phase("health_check"):
+                healthy, degraded = self._check_current_ips(select_domains, checking)
+            if not degraded:
+                logger.info("健康检查完成，所有域名IP均正常，无需重新优选")
+                self._save_history()
+                return
+            logger.info(f"健康检查完成，{len(degraded)}个域名需要重新优选: {list(degraded.keys())}")
+            reselected = self._select_ips_for_domains(degraded)
+            # 重新优选失败的域名保留原IP
+            kept = {domain: checking[domain] for domain in degraded if domain not in reselected and domain in checking}
+            merged_ip_map = {**healthy, **kept, **reselected}
+            self._apply_selection(merged_ip_map, f"健康检查完成，重新优选{len(reselected)}个域名:")
         except Exception as e:
-            logger.error(f"select_ips主流程异常: {e}")
+            logger.error(f"健康检查流程异常: {e}")
+        finally:
+            self._finish_run()
+
+    def _check_current_ips(self, select_domains: Dict[str, bool], checking: Dict[str, str]) -> Tuple[Dict[str, str], Dict[str, bool]]:
+        """
+        复测当前IP，返回(正常的{域名: IP}, 需要重新优选的{域名: loose_mode})
+        """
+        ping_results = self._ping_ips(list(set(checking.values()))) if checking else {}
+        healthy: Dict[str, str] = {}
+        degraded: Dict[str, bool] = {domain: loose for domain, loose in select_domains.items() if domain not in checking}
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=max(2, self._concurrency // 4)) as executor:
+            futures = {domain: executor.submit(self._test_ip_with_sites, ip, [domain], 5, select_domains[domain], 1)
+                       for domain, ip in checking.items()}
+            for domain, future in futures.items():
+                ip = checking[domain]
+                try:
+                    result = future.result()
+                except Exception:
+                    result = {"success_count": 0, "avg_delay": 9999}
+                result["ip"] = ip
+                self._metric("health_checks")
+                self._history.record(domain, ip, result["avg_delay"] if result.get("success_count", 0) > 0 else None)
+                reason = self._is_degraded(domain, ping_results.get(ip, PING_FAILED), result)
+                if reason:
+                    logger.info(f"健康检查：{domain} -> {ip} 已劣化：{reason}")
+                    degraded[domain] = select_domains[domain]
+                else:
+                    phases = result["phases"]
+                    logger.info(f"健康检查：{domain} -> {ip} 正常（连接{phases['connect']:.0f}ms/TLS{phases['tls']:.0f}ms/首字节{phases['ttfb']:.0f}ms/总计{phases['total']:.0f}ms，"
+                                f"{self._cold_warm_text(result)}）")
+                    self._record_domain(domain, ip, result["avg_delay"], "health_check")
+                    healthy[domain] = ip
+        return healthy, degraded
+
+    def _read_hosts_cfipselector(self) -> Dict[str, str]:
+        """
+        读取hosts中# CFIPSelector优选IP块内当前写入的{域名: IP}
+        """
+        try:
+            return self._get_hosts_manager().read_block()
+        except Exception as e:
+            logger.error(f"读取hosts失败: {e}")
+            return {}
 
     def _send_notification(self, success: bool, message: str = "", result: Optional[List[Dict[str, Any]]] = None, hosts_status: Optional[bool] = None):
         if not self._notify:
@@ -1009,13 +1380,48 @@ class CFIPSelector(_PluginBase):
                 "methods": ["POST"],
                 "summary": "立即优选IP",
                 "description": "手动触发一次Cloudflare IP优选"
+            },
+            {
+                "path": "/cfipselector/metrics",
+                "endpoint": self.api_metrics,
+                "methods": ["GET"],
+                "summary": "优选运行指标",
+                "description": "获取正在进行及最近若干次优选/健康检查的分阶段指标"
+            },
+            {
+                "path": "/cfipselector/tracker_match",
+                "endpoint": self.api_tracker_match,
+                "methods": ["GET"],
+                "summary": "tracker规则匹配",
+                "description": "判断tracker主机名是否命中tracker列表（精确/后缀/关键字规则）"
             }
         ]
 
     def api_select_now(self, *args, **kwargs):
+        if self._run_lock.locked():
+            return {"msg": "已有优选或健康检查任务正在运行"}
         self.select_ips()
         return {"msg": "已手动触发优选"}
 
+    def api_metrics(self, *args, **kwargs):
+        """
+        返回正在进行的运行（如有）与最近的运行历史（最新的在前）
+        """
+        current = self._run_metrics
+        return {
+            "running": current.to_dict() if current else None,
+            "runs": self._metrics_history.to_list() if self._metrics_history else []
+        }
+
+    def api_tracker_match(self, host: str = None, *args, **kwargs):
+        """
+        返回主机名命中的tracker规则
+        """
+        if not host:
+            return {"success": False, "msg": "缺少host参数"}
+        rule = self.match_tracker_host(host)
+        return {"success": True, "host": host, "matched": rule is not None, "rule": rule}
+
     def api_sync_locations(self, *args, **kwargs):
         logger.info("同步数据中心API被调用")
         """
@@ -1062,6 +1468,8 @@ class CFIPSelector(_PluginBase):
             with open(out_path, 'w', encoding='utf-8') as f:
                 json.dump(processed_data, f, ensure_ascii=False, indent=2)
             
+            # 重新生成二进制快照，后续优选直接加载
+            locations_cache.rebuild(out_path)
             logger.info(f"同步成功！共处理{len(processed_data)}个数据中心")
             return {"success": True, "msg": f"同步成功！共处理{len(processed_data)}个数据中心"}
             
@@ -1074,50 +1482,50 @@ class CFIPSelector(_PluginBase):
 
     def sync_trackers_from_github(self, url: str = None):
         """
-        从GitHub拉取tracker列表并写入trackers_include.txt，支持代理
+        从GitHub拉取tracker列表并写入trackers_include.txt，支持代理；
+        使用ETag/If-Modified-Since条件请求，列表未变化时不下载、不改写文件
         """
         if not url:
             url = getattr(self, '_github_tracker_url', None) or "https://raw.githubusercontent.com/MJinxi/Rule/main/rules/trackers.list"
         try:
-            resp = requests.get(url, timeout=10, proxies=getattr(settings, 'PROXY', None))
-            if resp.status_code == 200:
-                lines = [line.strip() for line in resp.text.splitlines() if line.strip()]
-                from pathlib import Path
-                Path('/config/plugins/CFIPSelector').mkdir(parents=True, exist_ok=True)
-                include_path = '/config/plugins/CFIPSelector/trackers_include.txt'
-                with open(include_path, 'w', encoding='utf-8') as f:
-                    for line in lines:
-                        f.write(line + '\n')
-                logger.info(f"同步GitHub tracker列表成功，共{len(lines)}个")
-                return True, f"同步成功，共{len(lines)}个tracker"
-            else:
-                logger.error(f"拉取GitHub tracker列表失败，状态码: {resp.status_code}")
-                return False, f"拉取失败，状态码: {resp.status_code}"
+            updated, count = fetch_rule_list(url, self._tracker_list_path(), proxies=getattr(settings, 'PROXY', None))
+            if not updated:
+                logger.info(f"GitHub tracker列表未变化，共{count}个")
+                return True, f"列表未变化，共{count}个tracker"
+            logger.info(f"同步GitHub tracker列表成功，共{count}个")
+            return True, f"同步成功，共{count}个tracker"
+        except requests.HTTPError as e:
+            status = e.response.status_code if e.response is not None else '?'
+            logger.error(f"拉取GitHub tracker列表失败，状态码: {status}")
+            return False, f"拉取失败，状态码: {status}"
         except Exception as e:
             logger.error(f"同步GitHub tracker列表异常: {e}")
             return False, f"同步异常: {e}"
 
+    @staticmethod
+    def _tracker_list_path() -> str:
+        return '/config/plugins/CFIPSelector/trackers_include.txt'
+
+    def _tracker_rules(self) -> Optional[TrackerRules]:
+        """
+        trackers_include.txt的编译规则，文件未变化时直接复用内存或磁盘上的编译结果
+        """
+        return tracker_rules_cache.get(self._tracker_list_path())
+
     def _get_tracker_domains_for_selection(self) -> set:
         """
-        只读取trackers_include.txt（由GitHub同步和UI输入共同维护），支持DOMAIN-SUFFIX,xxx等格式自动提取域名
+        只读取trackers_include.txt（由GitHub同步和UI输入共同维护），支持DOMAIN-SUFFIX,xxx等格式自动提取域名；
+        关键字规则（如announce）无法直接优选，只用于匹配tracker主机名
         """
-        include_path = '/config/plugins/CFIPSelector/trackers_include.txt'
-        tracker_domains = set()
-        import os
-        if os.path.exists(include_path):
-            with open(include_path, 'r', encoding='utf-8-sig') as f:
-                for line in f:
-                    line = line.strip()
-                    if not line or line.startswith('#'):
-                        continue
-                    if ',' in line:
-                        parts = line.split(',', 1)
-                        domain = parts[1].strip()
-                        if domain:
-                            tracker_domains.add(domain.lower())
-                    else:
-                        tracker_domains.add(line.lower())
-        return tracker_domains
+        rules = self._tracker_rules()
+        return rules.domains() if rules else set()
+
+    def match_tracker_host(self, host: str) -> Optional[str]:
+        """
+        判断种子tracker主机名是否命中tracker列表，返回命中的规则，未命中返回None
+        """
+        rules = self._tracker_rules()
+        return rules.match(host) if rules else None
 
     def get_form(self) -> Tuple[List[dict], Dict[str, Any]]:
         site_options = []
@@ -1138,7 +1546,7 @@ class CFIPSelector(_PluginBase):
         # 新增：读取trackers_include.txt内容作为默认值（始终优先显示文件内容）
         tracker_include_default = ''
         try:
-            include_path = '/config/plugins/CFIPSelector/trackers_include.txt'
+            include_path = self._tracker_list_path()
             if os.path.exists(include_path):
                 with open(include_path, 'r', encoding='utf-8-sig') as f:
                     tracker_include_default = f.read().strip()
@@ -1204,28 +1612,45 @@ class CFIPSelector(_PluginBase):
                     {
                         'component': 'VRow',
                         'content': [
-                            {'component': 'VCol', 'props': {'cols': 6, 'md': 6}, 'content': [
+                            {'component': 'VCol', 'props': {'cols': 6, 'md': 4}, 'content': [
                                 {'component': 'VTextField', 'props': {'model': 'concurrency', 'label': '并发线程数', 'placeholder': '20', 'prepend-inner-icon': 'mdi-rocket', 'hint': '每轮检测的最大并发数，建议20-100', 'persistent-hint': True}}]},
-                            {'component': 'VCol', 'props': {'cols': 6, 'md': 6}, 'content': [
+                            {'component': 'VCol', 'props': {'cols': 6, 'md': 4}, 'content': [
                                 {'component': 'VTextField', 'props': {'model': 'cidr_sample_num', 'label': 'CIDR抽样数', 'placeholder': '100', 'prepend-inner-icon': 'mdi-shuffle-variant', 'hint': '每轮从IP池随机抽取多少个IP参与优选', 'persistent-hint': True}}]},
+                            {'component': 'VCol', 'props': {'cols': 12, 'md': 4}, 'content': [
+                                {'component': 'VTextField', 'props': {'model': 'good_ip_target', 'label': '提前结束数', 'placeholder': '3', 'prepend-inner-icon': 'mdi-flag-checkered', 'hint': '每个域名找到多少个可用IP后提前结束本轮', 'persistent-hint': True}}]},
                         ]
                     },
                     {
                         'component': 'VRow',
                         'content': [
-                            {'component': 'VCol', 'props': {'cols': 6, 'md': 6}, 'content': [
+                            {'component': 'VCol', 'props': {'cols': 6, 'md': 4}, 'content': [
                                 {'component': 'VTextField', 'props': {'model': 'candidate_num', 'label': '候选数量', 'placeholder': '20', 'prepend-inner-icon': 'mdi-account-multiple', 'hint': '第二阶段参与Cloudflare节点判断的IP数量', 'persistent-hint': True}}]},
-                            {'component': 'VCol', 'props': {'cols': 6, 'md': 6}, 'content': [
+                            {'component': 'VCol', 'props': {'cols': 6, 'md': 4}, 'content': [
                                 {'component': 'VTextField', 'props': {'model': 'ipnum', 'label': '优选数量', 'placeholder': '10', 'prepend-inner-icon': 'mdi-counter', 'hint': '最终选出多少个最优IP', 'persistent-hint': True}}]},
+                            {'component': 'VCol', 'props': {'cols': 12, 'md': 4}, 'content': [
+                                {'component': 'VTextField', 'props': {'model': 'warm_start_num', 'label': '历史复测数', 'placeholder': '3', 'prepend-inner-icon': 'mdi-history', 'hint': '每个域名优先复测的历史最优IP数，0为关闭热启动', 'persistent-hint': True}}]},
                         ]
                     },
                     {
                         'component': 'VRow',
                         'content': [
-                            {'component': 'VCol', 'props': {'cols': 6, 'md': 6}, 'content': [
+                            {'component': 'VCol', 'props': {'cols': 6, 'md': 4}, 'content': [
                                 {'component': 'VTextField', 'props': {'model': 'port', 'label': '端口', 'placeholder': '443', 'prepend-inner-icon': 'mdi-lan', 'hint': '测速时使用的端口，通常为443', 'persistent-hint': True}}]},
-                            {'component': 'VCol', 'props': {'cols': 12, 'md': 6}, 'content': [
+                            {'component': 'VCol', 'props': {'cols': 6, 'md': 4}, 'content': [
                                 {'component': 'VTextField', 'props': {'model': 'ip_type', 'label': 'IP类型(4/6/46)', 'placeholder': '4', 'prepend-inner-icon': 'mdi-numeric', 'hint': '4=IPv4, 6=IPv6, 46=双栈', 'persistent-hint': True}}]},
+                            {'component': 'VCol', 'props': {'cols': 12, 'md': 4}, 'content': [
+                                {'component': 'VTextField', 'props': {'model': 'ping_concurrency', 'label': 'Ping并发上限', 'placeholder': '500', 'prepend-inner-icon': 'mdi-access-point-network', 'hint': '异步ping在途连接数上限，实际并发按超时率自适应调节', 'persistent-hint': True}}]},
+                        ]
+                    },
+                    {
+                        'component': 'VRow',
+                        'content': [
+                            {'component': 'VCol', 'props': {'cols': 6, 'md': 4}, 'content': [
+                                {'component': 'VTextField', 'props': {'model': 'max_sockets', 'label': '全局连接数上限', 'placeholder': '600', 'prepend-inner-icon': 'mdi-lan-connect', 'hint': '所有域名并发优选时同时打开的探测连接总数', 'persistent-hint': True}}]},
+                            {'component': 'VCol', 'props': {'cols': 6, 'md': 4}, 'content': [
+                                {'component': 'VTextField', 'props': {'model': 'max_rps', 'label': '全局请求速率(次/秒)', 'placeholder': '30', 'prepend-inner-icon': 'mdi-speedometer-slow', 'hint': '每秒发往站点的HTTP探测请求上限，0为不限', 'persistent-hint': True}}]},
+                            {'component': 'VCol', 'props': {'cols': 12, 'md': 4}, 'content': [
+                                {'component': 'VTextField', 'props': {'model': 'hosts_path', 'label': 'hosts文件路径', 'placeholder': '/etc/hosts', 'prepend-inner-icon': 'mdi-file-document-edit', 'hint': '留空使用系统默认路径', 'persistent-hint': True}}]},
                         ]
                     },
                     {
@@ -1237,6 +1662,52 @@ class CFIPSelector(_PluginBase):
                                 {'component': 'VTextField', 'props': {'model': 'cron', 'label': '定时任务(cron)', 'placeholder': '0 3 * * *', 'prepend-inner-icon': 'mdi-clock-outline', 'hint': '定时自动优选的cron表达式', 'persistent-hint': True}}]},
                         ]
                     },
+                    {
+                        'component': 'VRow',
+                        'content': [
+                            {'component': 'VCol', 'props': {'cols': 12, 'md': 4, 'class': 'd-flex align-center'}, 'content': [
+                                {'component': 'VSwitch', 'props': {'model': 'health_check', 'label': '健康检查模式', 'color': 'primary', 'prepend-icon': 'mdi-heart-pulse', 'hint': '定时任务只复测当前IP，劣化的域名才重新优选', 'persistent-hint': True}}]},
+                            {'component': 'VCol', 'props': {'cols': 6, 'md': 4}, 'content': [
+                                {'component': 'VTextField', 'props': {'model': 'degrade_delay', 'label': '劣化延迟阈值(ms)', 'placeholder': '1000', 'prepend-inner-icon': 'mdi-timer-alert', 'hint': '当前IP访问延迟超过该值即重新优选', 'persistent-hint': True}}]},
+                            {'component': 'VCol', 'props': {'cols': 6, 'md': 4}, 'content': [
+                                {'component': 'VTextField', 'props': {'model': 'degrade_success_rate', 'label': '劣化成功率阈值(%)', 'placeholder': '60', 'prepend-inner-icon': 'mdi-percent', 'hint': '当前IP历史成功率低于该值即重新优选', 'persistent-hint': True}}]},
+                        ]
+                    },
+                    {
+                        'component': 'VRow',
+                        'content': [
+                            {'component': 'VCol', 'props': {'cols': 12, 'md': 4, 'class': 'd-flex align-center'}, 'content': [
+                                {'component': 'VSwitch', 'props': {'model': 'colo_filter', 'label': '按实际数据中心过滤', 'color': 'primary', 'prepend-icon': 'mdi-map-marker-check', 'hint': '丢弃/cdn-cgi/trace返回的数据中心不在所选数据中心内的IP', 'persistent-hint': True}}]},
+                            {'component': 'VCol', 'props': {'cols': 12, 'md': 4}, 'content': [
+                                {'component': 'VSelect', 'props': {'model': 'rank_metric', 'label': '测速排序口径', 'prepend-inner-icon': 'mdi-sort-clock-ascending',
+                                                                   'items': [{'title': '完整请求耗时', 'value': 'total'}, {'title': '首字节时间(TTFB)', 'value': 'ttfb'}],
+                                                                   'hint': 'TTFB不含响应体下载时间，更接近tracker announce的实际耗时', 'persistent-hint': True}}]},
+                        ]
+                    },
+                    {
+                        'component': 'VRow',
+                        'content': [
+                            {'component': 'VCol', 'props': {'cols': 12, 'md': 4, 'class': 'd-flex align-center'}, 'content': [
+                                {'component': 'VSwitch', 'props': {'model': 'speed_test', 'label': '带宽测速', 'color': 'primary', 'prepend-icon': 'mdi-speedometer', 'hint': '延迟优选后对最优几个IP做下载测速，按延迟与带宽综合排序', 'persistent-hint': True}}]},
+                            {'component': 'VCol', 'props': {'cols': 12, 'md': 8}, 'content': [
+                                {'component': 'VTextField', 'props': {'model': 'speed_url', 'label': '测速地址', 'placeholder': 'https://speed.cloudflare.com/__down?bytes=50000000', 'prepend-inner-icon': 'mdi-download-network', 'hint': '需为Cloudflare反代的下载地址，经候选IP直连下载', 'persistent-hint': True}}]},
+                        ]
+                    },
+                    {
+                        'component': 'VRow',
+                        'content': [
+                            {'component': 'VCol', 'props': {'cols': 6, 'md': 2}, 'content': [
+                                {'component': 'VTextField', 'props': {'model': 'speed_max_mb', 'label': '测速流量(MB)', 'placeholder': '10', 'hint': '每个IP最多下载', 'persistent-hint': True}}]},
+                            {'component': 'VCol', 'props': {'cols': 6, 'md': 2}, 'content': [
+                                {'component': 'VTextField', 'props': {'model': 'speed_max_seconds', 'label': '测速时长(秒)', 'placeholder': '5', 'hint': '每个IP最长测速', 'persistent-hint': True}}]},
+                            {'component': 'VCol', 'props': {'cols': 4, 'md': 2}, 'content': [
+                                {'component': 'VTextField', 'props': {'model': 'speed_concurrency', 'label': '测速并发', 'placeholder': '2', 'hint': '同时测速IP数', 'persistent-hint': True}}]},
+                            {'component': 'VCol', 'props': {'cols': 4, 'md': 3}, 'content': [
+                                {'component': 'VTextField', 'props': {'model': 'speed_shortlist', 'label': '测速IP数', 'placeholder': '3', 'hint': '每个域名延迟最优的IP数', 'persistent-hint': True}}]},
+                            {'component': 'VCol', 'props': {'cols': 4, 'md': 3}, 'content': [
+                                {'component': 'VTextField', 'props': {'model': 'speed_weight', 'label': '带宽权重(%)', 'placeholder': '50', 'hint': '0只看延迟，100只看带宽', 'persistent-hint': True}}]},
+                        ]
+                    },
                     {
                         'component': 'VRow',
                         'content': [
@@ -1300,8 +1771,26 @@ class CFIPSelector(_PluginBase):
             "tls": self._tls,
             "ipnum": self._ipnum,
             "concurrency": self._concurrency,
+            "ping_concurrency": self._ping_concurrency,
             "cidr_sample_num": self._cidr_sample_num,
             "candidate_num": self._candidate_num,
+            "warm_start_num": self._warm_start_num,
+            "good_ip_target": self._good_ip_target,
+            "colo_filter": self._colo_filter,
+            "rank_metric": self._rank_metric,
+            "speed_test": self._speed_test,
+            "speed_url": self._speed_url,
+            "speed_max_mb": self._speed_max_mb,
+            "speed_max_seconds": self._speed_max_seconds,
+            "speed_concurrency": self._speed_concurrency,
+            "speed_shortlist": self._speed_shortlist,
+            "speed_weight": self._speed_weight,
+            "max_sockets": self._max_sockets,
+            "max_rps": self._max_rps,
+            "hosts_path": self._hosts_path,
+            "health_check": self._health_check,
+            "degrade_delay": self._degrade_delay,
+            "degrade_success_rate": self._degrade_success_rate,
             "sign_sites": self._sign_sites or [],
             "last_select_time": self._last_select_time,
             "last_selected_ip": self._last_selected_ip,
@@ -1339,32 +1828,12 @@ class CFIPSelector(_PluginBase):
         has_selected_ip = bool(getattr(self, '_last_selected_ip', '') and 
                               getattr(self, '_last_selected_ip', '') != '暂无')
         
-        # 检查hosts文件中是否有优选IP条目
-        has_hosts_entries = False
+        # 检查hosts文件中是否有优选IP条目（按文件签名缓存，不重复读文件）
         try:
-            import platform
-            if platform.system() == "Windows":
-                hosts_path = r"c:\windows\system32\drivers\etc\hosts"
-            else:
-                hosts_path = '/etc/hosts'
-            
-            with open(hosts_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-                if "# CFIPSelector优选IP" in content:
-                    # 检查是否有实际的IP条目（不是只有注释）
-                    lines = content.split('\n')
-                    for line in lines:
-                        if line.strip() and not line.startswith('#') and not line.startswith('#'):
-                            # 检查是否是IP地址格式
-                            parts = line.strip().split()
-                            if len(parts) >= 2:
-                                ip_part = parts[0]
-                                if '.' in ip_part or ':' in ip_part:  # IPv4或IPv6
-                                    has_hosts_entries = True
-                                    break
+            has_hosts_entries = self._get_hosts_manager().has_entries()
         except Exception:
-            pass
-        
+            has_hosts_entries = False
+
         return has_selection_time and has_selected_ip and has_hosts_entries
 
     def get_page(self) -> List[dict]:
@@ -1462,6 +1931,15 @@ class CFIPSelector(_PluginBase):
                     {'component': 'VChip', 'props': {'color': last_time_color, 'label': True}, 'text': last_select_time}
                 ]}
             ]},
+            {'component': 'VRow', 'content': [
+                {'component': 'VCol', 'props': {'cols': 4, 'class': 'd-flex align-center'}, 'content': [
+                    {'component': 'span', 'text': 'Ping并发'}
+                ]},
+                {'component': 'VCol', 'props': {'cols': 8, 'class': 'd-flex align-center'}, 'content': [
+                    {'component': 'VChip', 'props': {'color': 'secondary', 'label': True},
+                     'text': f'{self._ping_controller.level} / 上限{self._ping_controller.max_limit}' if self._ping_controller else '尚未运行'}
+                ]}
+            ]},
             {'component': 'VRow', 'content': [
                 {'component': 'VCol', 'props': {'cols': 4, 'class': 'd-flex align-center'}, 'content': [
                     {'component': 'span', 'text': '当前 hosts IP'}
@@ -1471,6 +1949,21 @@ class CFIPSelector(_PluginBase):
                 ]}
             ]},
         ]
+        if self._colo_stats:
+            target_colos = set(self._get_datacenter_list())
+            total = sum(self._colo_stats.values())
+            hit = sum(count for colo, count in self._colo_stats.items() if colo in target_colos)
+            top_colos = sorted(self._colo_stats.items(), key=lambda x: -x[1])[:6]
+            cards.append({'component': 'VRow', 'content': [
+                {'component': 'VCol', 'props': {'cols': 4, 'class': 'd-flex align-center'}, 'content': [
+                    {'component': 'span', 'text': f'实际数据中心（命中{hit * 100 // total}%）'}
+                ]},
+                {'component': 'VCol', 'props': {'cols': 8, 'class': 'd-flex flex-wrap align-center'}, 'content': [
+                    {'component': 'VChip', 'props': {'color': 'success' if colo in target_colos else 'grey', 'label': True, 'class': 'ma-1'},
+                     'text': f'{colo} {count}'}
+                    for colo, count in top_colos
+                ]}
+            ]})
         cards.append({
             'component': 'VCardTitle', 'props': {'class': 'text-h6 font-weight-bold', 'style': 'display: flex; align-items: center;'},
             'content': [
@@ -1502,36 +1995,12 @@ class CFIPSelector(_PluginBase):
 
     def _clear_hosts_cfipselector(self):
         """
-        移除/etc/hosts中# CFIPSelector优选IP及其后面的条目
+        移除hosts中# CFIPSelector优选IP及其后面的条目
         """
         try:
-            import platform
-            if platform.system() == "Windows":
-                hosts_path = r"c:\windows\system32\drivers\etc\hosts"
-            else:
-                hosts_path = '/etc/hosts'
-            with open(hosts_path, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-            new_lines = []
-            skip = False
-            for line in lines:
-                if line.strip() == "# CFIPSelector优选IP":
-                    # 跳过该注释及其后所有非注释、非空行（即优选IP条目）
-                    skip = True
-                    continue
-                if skip:
-                    # 如果遇到下一个注释或空行，停止跳过
-                    if line.strip().startswith('#') or not line.strip():
-                        skip = False
-                        new_lines.append(line)
-                    # 否则继续跳过
-                    continue
-                new_lines.append(line)
-            with open(hosts_path, 'w', encoding='utf-8') as f:
-                f.writelines(new_lines)
-            #logger.info("已清理/etc/hosts中的CFIPSelector优选IP条目")
+            self._get_hosts_manager().clear_block()
         except Exception as e:
-            logger.error(f"清理hosts失败: {e}") 
+            logger.error(f"清理hosts失败: {e}")
 
     def _get_site_full_domain(self, site) -> str:
         """
@@ -0,0 +1,86 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class ProbeBudget:
+    """
+    全局探测预算：所有域名并发优选时共享。
+    max_sockets限制同时打开的探测连接数（异步ping与HTTP请求合计），
+    max_rps以令牌桶限制每秒发往站点的HTTP请求数，避免并发优选时对PT站点/tracker造成冲击；
+    max_rps<=0表示不限速
+    """
+
+    def __init__(self, max_sockets: int = 600, max_rps: float = 30):
+        self.max_sockets = max(1, int(max_sockets))
+        self.max_rps = float(max_rps)
+        self._cond = threading.Condition()
+        self._in_use = 0
+        self._tokens = max(self.max_rps, 1.0)
+        self._last_refill = time.monotonic()
+        # 统计
+        self.peak_sockets = 0
+        self.requests = 0
+        self.throttled = 0.0
+
+    def reset_stats(self):
+        self.peak_sockets = self._in_use
+        self.requests = 0
+        self.throttled = 0.0
+
+    def try_acquire_socket(self) -> bool:
+        """
+        非阻塞占用一个连接名额（供事件循环中的异步ping使用）
+        """
+        with self._cond:
+            if self._in_use >= self.max_sockets:
+                return False
+            self._in_use += 1
+            self.peak_sockets = max(self.peak_sockets, self._in_use)
+            return True
+
+    def acquire_socket(self):
+        with self._cond:
+            while self._in_use >= self.max_sockets:
+                self._cond.wait()
+            self._in_use += 1
+            self.peak_sockets = max(self.peak_sockets, self._in_use)
+
+    def release_socket(self):
+        with self._cond:
+            self._in_use = max(0, self._in_use - 1)
+            self._cond.notify()
+
+    def _take_token(self):
+        if self.max_rps <= 0:
+            return
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                self._tokens = min(max(self.max_rps, 1.0), self._tokens + (now - self._last_refill) * self.max_rps)
+                self._last_refill = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.max_rps
+                self.throttled += wait
+            time.sleep(wait)
+
+    @contextmanager
+    def request(self):
+        """
+        一次HTTP探测：先取令牌再占用连接名额，退出时归还名额
+        """
+        self._take_token()
+        self.acquire_socket()
+        with self._cond:
+            self.requests += 1
+        try:
+            yield
+        finally:
+            self.release_socket()
+
+    def summary(self) -> str:
+        rps = f"{self.max_rps:g}/s" if self.max_rps > 0 else "不限"
+        return (f"HTTP请求{self.requests}次，连接峰值{self.peak_sockets}/{self.max_sockets}，"
+                f"限速{rps}，累计限速等待{self.throttled:.1f}秒")
@@ -0,0 +1,88 @@
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+# 尚无成功样本的IP以该延迟参与评分
+FAILED_LATENCY = 9999
+
+
+class IPHistory:
+    """
+    按域名记录各IP的历史表现：延迟与成功率均为指数加权移动平均（EWMA），
+    得分 = 平均延迟 / 成功率，越小越好。数据通过插件 save_data/get_data 持久化
+    """
+
+    def __init__(self, data: Optional[Dict[str, Dict[str, Dict[str, Any]]]] = None,
+                 alpha: float = 0.3, max_per_domain: int = 20):
+        self._alpha = alpha
+        self._max_per_domain = max_per_domain
+        self._lock = threading.Lock()
+        self._data: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for domain, records in (data or {}).items():
+            if isinstance(records, dict):
+                self._data[domain] = {ip: dict(rec) for ip, rec in records.items() if isinstance(rec, dict)}
+
+    @staticmethod
+    def score(record: Dict[str, Any]) -> float:
+        return record.get("latency", FAILED_LATENCY) / max(record.get("success", 0.0), 0.05)
+
+    def record(self, domain: str, ip: str, latency: Optional[float]):
+        """
+        记录一次测速结果，latency为None表示失败
+        """
+        success = latency is not None
+        with self._lock:
+            records = self._data.setdefault(domain, {})
+            rec = records.get(ip)
+            if rec is None:
+                rec = {"latency": FAILED_LATENCY, "success": 1.0 if success else 0.0, "samples": 0, "ok_samples": 0}
+            else:
+                rec["success"] = self._alpha * (1.0 if success else 0.0) + (1 - self._alpha) * rec["success"]
+            # 失败只影响成功率，延迟仅由成功样本平滑，避免失败占位值污染延迟
+            ok_samples = rec.get("ok_samples", 1 if rec.get("success", 0) > 0 else 0)
+            if success:
+                if ok_samples:
+                    rec["latency"] = self._alpha * latency + (1 - self._alpha) * rec["latency"]
+                else:
+                    rec["latency"] = latency
+                ok_samples += 1
+            rec["ok_samples"] = ok_samples
+            rec["samples"] = rec.get("samples", 0) + 1
+            rec["updated"] = int(time.time())
+            records[ip] = rec
+            if len(records) > self._max_per_domain:
+                keep = sorted(records.items(), key=lambda x: self.score(x[1]))[:self._max_per_domain]
+                self._data[domain] = dict(keep)
+
+    def get(self, domain: str, ip: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            rec = self._data.get(domain, {}).get(ip)
+            return dict(rec) if rec else None
+
+    def top(self, domain: str, n: int, since: Optional[float] = None) -> List[str]:
+        """
+        返回该域名历史得分最好的n个IP；since不为空时只考虑该时间戳之后更新过的记录
+        """
+        with self._lock:
+            records = self._data.get(domain, {})
+            ranked = sorted(records.items(), key=lambda x: self.score(x[1]))
+        return [ip for ip, rec in ranked
+                if rec.get("success", 0) > 0 and (since is None or rec.get("updated", 0) >= since)][:n]
+
+    def prune(self, max_age_days: int = 30):
+        """
+        清理长期未更新的记录（如已移除的站点/tracker）
+        """
+        expire = time.time() - max_age_days * 86400
+        with self._lock:
+            for domain in list(self._data.keys()):
+                records = {ip: rec for ip, rec in self._data[domain].items() if rec.get("updated", 0) >= expire}
+                if records:
+                    self._data[domain] = records
+                else:
+                    del self._data[domain]
+
+    def to_dict(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        with self._lock:
+            return {domain: {ip: dict(rec) for ip, rec in records.items()}
+                    for domain, records in self._data.items()}
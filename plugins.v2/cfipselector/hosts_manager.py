@@ -0,0 +1,162 @@
+import os
+import platform
+import tempfile
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from app.log import logger
+
+# hosts中插件条目块的起始标记，块内为连续的非空、非注释行
+MARKER = "# CFIPSelector优选IP"
+
+
+def default_hosts_path() -> str:
+    if platform.system() == "Windows":
+        return r"c:\windows\system32\drivers\etc\hosts"
+    return "/etc/hosts"
+
+
+class HostsManager:
+    """
+    hosts文件中CFIPSelector条目块的读写：
+    按文件签名(mtime/size/inode)缓存解析结果，状态页等频繁读取不再重复读文件；
+    写入前与当前条目比对，无变化则跳过；有变化时同目录临时文件+rename原子替换，
+    rename失败（如Docker中bind mount的/etc/hosts）时退回原地覆盖写
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or default_hosts_path()
+        self._lock = threading.Lock()
+        self._signature: Optional[Tuple[int, int, int]] = None
+        self._lines: List[str] = []
+        self._block: Tuple[int, int] = (-1, -1)  # 块在_lines中的[起始, 结束)，不存在时为(-1, -1)
+        self._ip_map: Dict[str, str] = {}
+
+    def _stat_signature(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def _load(self):
+        """
+        文件签名变化时重新读取并解析，调用方需持有锁
+        """
+        signature = self._stat_signature()
+        if signature is not None and signature == self._signature:
+            return
+        lines = []
+        if signature is not None:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        start, end = -1, -1
+        ip_map = {}
+        for idx, line in enumerate(lines):
+            stripped = line.strip()
+            if start < 0:
+                if stripped == MARKER:
+                    start = end = idx + 1
+                continue
+            if not stripped or stripped.startswith('#'):
+                break
+            parts = stripped.split()
+            for name in parts[1:]:
+                ip_map[name] = parts[0]
+            end = idx + 1
+        self._signature = signature
+        self._lines = lines
+        # 块包含标记行本身
+        self._block = (start - 1, end) if start > 0 else (-1, -1)
+        self._ip_map = ip_map
+
+    def read_block(self) -> Dict[str, str]:
+        """
+        返回hosts中当前写入的{域名: IP}
+        """
+        with self._lock:
+            self._load()
+            return dict(self._ip_map)
+
+    def has_entries(self) -> bool:
+        with self._lock:
+            self._load()
+            return bool(self._ip_map)
+
+    @staticmethod
+    def diff(old: Dict[str, str], new: Dict[str, str]) -> Dict[str, Dict[str, object]]:
+        """
+        比较新旧条目，返回{"added": {域名: IP}, "changed": {域名: (旧IP, 新IP)}, "removed": {域名: IP}}
+        """
+        return {
+            "added": {d: ip for d, ip in new.items() if d not in old},
+            "changed": {d: (old[d], ip) for d, ip in new.items() if d in old and old[d] != ip},
+            "removed": {d: ip for d, ip in old.items() if d not in new},
+        }
+
+    def write_block(self, ip_map: Dict[str, str]) -> Optional[Dict[str, Dict[str, object]]]:
+        """
+        用ip_map替换插件条目块（ip_map为空时移除整个块），块外内容保持不变。
+        无变化时不写文件并返回None，否则返回变更内容；写入失败抛出OSError
+        """
+        with self._lock:
+            self._load()
+            changes = self.diff(self._ip_map, ip_map)
+            block_exists = self._block[0] >= 0
+            if not any(changes.values()) and block_exists == bool(ip_map):
+                return None
+            block = []
+            if ip_map:
+                block.append(f"{MARKER}\n")
+                block += [f"{ip}\t{domain}\n" for domain, ip in ip_map.items()]
+            lines = list(self._lines)
+            if block_exists:
+                start, end = self._block
+                lines[start:end] = block
+            elif block:
+                if lines and not lines[-1].endswith('\n'):
+                    lines[-1] += '\n'
+                lines += block
+            self._write(lines)
+            # 写入后强制下次重新解析
+            self._signature = None
+            return changes
+
+    def clear_block(self) -> bool:
+        """
+        移除插件条目块，返回是否修改了文件
+        """
+        return self.write_block({}) is not None
+
+    def _write(self, lines: List[str]):
+        content = "".join(lines)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(prefix=".hosts.", dir=directory)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            try:
+                os.chmod(tmp_path, os.stat(self.path).st_mode & 0o7777)
+            except OSError:
+                os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, self.path)
+            tmp_path = None
+            return
+        except OSError as e:
+            # /etc/hosts为bind mount时rename会返回EBUSY，目录不可写时无法创建临时文件
+            logger.debug(f"原子替换hosts失败，改为原地写入: {e}")
+        finally:
+            if tmp_path:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+        with open(self.path, 'r+' if os.path.exists(self.path) else 'w', encoding='utf-8') as f:
+            f.seek(0)
+            f.write(content)
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
@@ -0,0 +1,222 @@
+import heapq
+import ipaddress
+import json
+import os
+import pickle
+import threading
+from bisect import bisect_right
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.log import logger
+
+# 二进制快照格式版本，DatacenterIndex结构变化时递增
+SNAPSHOT_VERSION = 1
+
+
+class DatacenterIndex:
+    """
+    数据中心CIDR索引：把locations.json中的网段预编译为按起始地址排序的不相交整数区间，
+    IP→三字码查询为O(log n)。同一地址被多个数据中心覆盖时，与逐个遍历一致，取表中靠前的数据中心
+    """
+
+    def __init__(self, locations: Dict[str, dict]):
+        self.colos: List[str] = list(locations.keys())
+        # 每个数据中心按IP版本分好的网段，供生成IP池时直接使用
+        self.nets: Dict[str, Dict[int, List[str]]] = {}
+        intervals = {4: [], 6: []}
+        for order, (colo, info) in enumerate(locations.items()):
+            colo_nets = {4: [], 6: []}
+            for net in (info or {}).get('nets', []):
+                try:
+                    net_obj = ipaddress.ip_network(net, strict=False)
+                except ValueError:
+                    continue
+                colo_nets[net_obj.version].append(str(net_obj))
+                intervals[net_obj.version].append(
+                    (int(net_obj.network_address), int(net_obj.broadcast_address), order))
+            self.nets[colo] = colo_nets
+        self._starts: Dict[int, List[int]] = {}
+        self._ends: Dict[int, List[int]] = {}
+        self._owners: Dict[int, List[int]] = {}
+        for version, items in intervals.items():
+            self._starts[version], self._ends[version], self._owners[version] = self._flatten(items)
+
+    @staticmethod
+    def _flatten(intervals: List[tuple]):
+        """
+        扫描线把可能重叠的区间压平为不相交区间，每段归属覆盖它的最靠前数据中心
+        """
+        starts, ends, owners = [], [], []
+        if not intervals:
+            return starts, ends, owners
+        intervals.sort()
+        bounds = sorted({s for s, _, _ in intervals} | {e + 1 for _, e, _ in intervals})
+        active = []  # 最小堆: (order, end)
+        idx = 0
+        for i, point in enumerate(bounds[:-1]):
+            while idx < len(intervals) and intervals[idx][0] == point:
+                _, end, order = intervals[idx]
+                heapq.heappush(active, (order, end))
+                idx += 1
+            while active and active[0][1] < point:
+                heapq.heappop(active)
+            if not active:
+                continue
+            owner = active[0][0]
+            seg_end = bounds[i + 1] - 1
+            if owners and owners[-1] == owner and ends[-1] + 1 == point:
+                ends[-1] = seg_end
+            else:
+                starts.append(point)
+                ends.append(seg_end)
+                owners.append(owner)
+        return starts, ends, owners
+
+    def _lookup_int(self, version: int, value: int) -> Optional[str]:
+        starts = self._starts[version]
+        pos = bisect_right(starts, value) - 1
+        if pos >= 0 and value <= self._ends[version][pos]:
+            return self.colos[self._owners[version][pos]]
+        return None
+
+    def lookup(self, ip: str, default: str = '?') -> str:
+        """
+        查询单个IP所属数据中心三字码
+        """
+        try:
+            addr = ipaddress.ip_address(ip)
+        except ValueError:
+            return default
+        return self._lookup_int(addr.version, int(addr)) or default
+
+    def lookup_many(self, ips: Iterable[str], default: str = '?') -> Dict[str, str]:
+        """
+        批量查询：按地址排序后与区间表单次归并，返回{ip: 三字码}
+        """
+        parsed = {4: [], 6: []}
+        result = {}
+        for ip in ips:
+            try:
+                addr = ipaddress.ip_address(ip)
+            except ValueError:
+                result[ip] = default
+                continue
+            parsed[addr.version].append((int(addr), ip))
+        for version, items in parsed.items():
+            starts, ends, owners = self._starts[version], self._ends[version], self._owners[version]
+            pos = 0
+            for value, ip in sorted(items):
+                while pos < len(starts) and ends[pos] < value:
+                    pos += 1
+                if pos < len(starts) and starts[pos] <= value:
+                    result[ip] = self.colos[owners[pos]]
+                else:
+                    result[ip] = default
+        return result
+
+    def nets_for(self, datacenters: Iterable[str], ip_type: int) -> List[str]:
+        """
+        获取指定数据中心的某一IP版本网段
+        """
+        nets = []
+        for dc in datacenters:
+            nets += self.nets.get(dc, {}).get(ip_type, [])
+        return nets
+
+
+def snapshot_path(json_path: str) -> str:
+    """
+    locations.json对应的二进制快照路径（与JSON同目录）
+    """
+    return os.path.splitext(json_path)[0] + '.idx'
+
+
+def _file_signature(path: str) -> Tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class LocationsCache:
+    """
+    进程级locations缓存：JSON只解析一次，按mtime失效；编译结果以pickle快照落盘，
+    下次启动时签名一致则直接加载快照，跳过JSON解析与索引构建
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[Tuple[int, int], DatacenterIndex]] = {}
+
+    def get(self, json_path: str) -> Optional[DatacenterIndex]:
+        """
+        获取json_path对应的数据中心索引，文件不存在返回None
+        """
+        try:
+            signature = _file_signature(json_path)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._entries.get(json_path)
+            if entry and entry[0] == signature:
+                return entry[1]
+            index = self._load_snapshot(json_path, signature)
+            if index is None:
+                index = self._build(json_path, signature)
+            if index is not None:
+                self._entries[json_path] = (signature, index)
+            return index
+
+    def rebuild(self, json_path: str) -> Optional[DatacenterIndex]:
+        """
+        强制重新解析JSON并重写快照（locations.json更新后调用）
+        """
+        try:
+            signature = _file_signature(json_path)
+        except OSError:
+            return None
+        with self._lock:
+            index = self._build(json_path, signature)
+            if index is not None:
+                self._entries[json_path] = (signature, index)
+            return index
+
+    @staticmethod
+    def _load_snapshot(json_path: str, signature: Tuple[int, int]) -> Optional[DatacenterIndex]:
+        path = snapshot_path(json_path)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                data = pickle.load(f)
+            if data.get('version') != SNAPSHOT_VERSION or tuple(data.get('signature', ())) != signature:
+                return None
+            return data['index']
+        except Exception as e:
+            logger.warning(f"读取数据中心索引快照失败，将重新解析locations.json: {e}")
+            return None
+
+    @staticmethod
+    def _build(json_path: str, signature: Tuple[int, int]) -> Optional[DatacenterIndex]:
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                locations = json.load(f)
+        except Exception as e:
+            logger.error(f"解析{json_path}失败: {e}")
+            return None
+        index = DatacenterIndex(locations)
+        path = snapshot_path(json_path)
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump({'version': SNAPSHOT_VERSION, 'signature': signature, 'index': index},
+                            f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"写入数据中心索引快照失败: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        return index
+
+
+locations_cache = LocationsCache()
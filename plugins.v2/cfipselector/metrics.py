@@ -0,0 +1,106 @@
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+
+class RunMetrics:
+    """
+    单次优选/健康检查运行的结构化指标：各阶段耗时、探测计数、轮次、各域名耗时与最终IP。
+    探测在多个线程中并发进行，所有写入均加锁
+    """
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.phases: Dict[str, float] = defaultdict(float)
+        self.domains: Dict[str, Dict[str, Any]] = {}
+        self.extra: Dict[str, Any] = {}
+        self.elapsed: Optional[float] = None
+
+    def incr(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] += n
+
+    def set(self, name: str, value: Any):
+        with self._lock:
+            self.extra[name] = value
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        累计阶段耗时（秒），同名阶段多次进入时累加
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] += time.perf_counter() - start
+
+    def domain_result(self, domain: str, ip: Optional[str], score: Optional[float], source: str,
+                      throughput: Optional[float] = None):
+        """
+        记录域名的优选结果：score为延迟(ms)，throughput为带宽测速结果(MB/s)，
+        耗时为从本次运行开始到该域名确定IP
+        """
+        with self._lock:
+            self.domains[domain] = {
+                "ip": ip,
+                "score": round(score, 1) if score is not None else None,
+                "throughput": round(throughput, 2) if throughput is not None else None,
+                "source": source,
+                "elapsed_s": round(time.perf_counter() - self._start, 3),
+            }
+
+    def domain_throughput(self, domain: str, throughput: float):
+        """
+        带宽测速未改变结果时，只给已记录的域名补充带宽(MB/s)
+        """
+        with self._lock:
+            if domain in self.domains:
+                self.domains[domain]["throughput"] = round(throughput, 2)
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self._start
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            elapsed = self.elapsed if self.elapsed is not None else time.perf_counter() - self._start
+            return {
+                "mode": self.mode,
+                "started": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started)),
+                "elapsed_s": round(elapsed, 3),
+                "finished": self.elapsed is not None,
+                "counters": dict(self.counters),
+                "phases_s": {name: round(value, 3) for name, value in self.phases.items()},
+                "domains": {domain: dict(item) for domain, item in self.domains.items()},
+                **self.extra,
+            }
+
+
+class MetricsHistory:
+    """
+    最近若干次运行指标的有界记录，最新的在前，通过插件 save_data/get_data 持久化
+    """
+
+    def __init__(self, data: Optional[List[Dict[str, Any]]] = None, max_runs: int = 20):
+        runs = [item for item in (data or []) if isinstance(item, dict)]
+        self._runs = deque(runs[:max_runs], maxlen=max_runs)
+        self._lock = threading.Lock()
+
+    def add(self, run: Dict[str, Any]):
+        with self._lock:
+            self._runs.appendleft(run)
+
+    def latest(self) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._runs[0] if self._runs else None
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._runs)
@@ -0,0 +1,222 @@
+import asyncio
+import socket
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# 探测失败时返回的延迟值，与 CFIPSelector._tcp_ping 保持一致
+PING_FAILED = 9999
+
+
+def _fd_limit(default: int = 1024) -> int:
+    """
+    获取当前进程可用的文件描述符上限
+    """
+    if resource is None:
+        return default
+    try:
+        soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft == resource.RLIM_INFINITY:
+            return 65535
+        return int(soft)
+    except Exception:
+        return default
+
+
+def effective_concurrency(concurrency: int) -> int:
+    """
+    根据文件描述符上限收敛并发数，保留一半给进程内其它连接
+    """
+    return max(1, min(int(concurrency), _fd_limit() // 2))
+
+
+class AIMDController:
+    """
+    探测并发的AIMD（加性增、乘性减）控制器，思路同TCP拥塞控制：
+    以约一个并发窗口的完成数为一个观测窗口统计超时率，
+    慢启动阶段窗口内超时率低则并发翻倍，越过慢启动阈值后每窗口加increase；
+    超时率超过high则并发减半，并把该窗口内超时的IP交回重测（每个IP最多重测一次）
+    """
+
+    def __init__(self, max_limit: int, initial: int = 32, min_limit: int = 8, increase: int = 8,
+                 high: float = 0.3, low: float = 0.1, min_window: int = 16):
+        self.max_limit = max(1, int(max_limit))
+        self.min_limit = max(1, min(int(min_limit), self.max_limit))
+        self.limit = float(max(self.min_limit, min(int(initial), self.max_limit)))
+        self.ssthresh = float(self.max_limit)
+        self.increase = increase
+        self.high = high
+        self.low = low
+        self.min_window = min_window
+        self.peak = self.limit
+        self.decreases = 0
+        self._done = 0
+        self._timeouts: List[str] = []
+
+    @property
+    def level(self) -> int:
+        return int(self.limit)
+
+    def reset_limit(self, max_limit: int):
+        """
+        复用控制器时更新并发上限（如配置或文件描述符上限变化）
+        """
+        self.max_limit = max(1, int(max_limit))
+        self.min_limit = min(self.min_limit, self.max_limit)
+        self.limit = float(max(self.min_limit, min(self.limit, self.max_limit)))
+        self.ssthresh = min(self.ssthresh, float(self.max_limit))
+
+    def on_result(self, ip: str, timed_out: bool) -> Optional[Tuple[bool, List[str]]]:
+        """
+        记录一次探测结果；窗口结束时返回(是否减半, 本窗口超时的IP列表)，否则返回None
+        """
+        self._done += 1
+        if timed_out:
+            self._timeouts.append(ip)
+        if self._done < max(self.min_window, self.level):
+            return None
+        return self.close_window()
+
+    def close_window(self) -> Tuple[bool, List[str]]:
+        done, timeouts = self._done, self._timeouts
+        self._done, self._timeouts = 0, []
+        rate = len(timeouts) / done if done else 0
+        if rate > self.high:
+            self.ssthresh = max(float(self.min_limit), self.limit / 2)
+            self.limit = self.ssthresh
+            self.decreases += 1
+            return True, timeouts
+        if rate <= self.low:
+            if self.limit < self.ssthresh:
+                self.limit = min(self.limit * 2, self.ssthresh)
+            else:
+                self.limit = min(self.limit + self.increase, float(self.max_limit))
+            self.peak = max(self.peak, self.limit)
+        return False, timeouts
+
+
+async def _ping_one(ip: str, port: int, timeout: float) -> Tuple[float, bool]:
+    """
+    非阻塞connect测量单个IP的TCP握手延迟，返回(延迟, 是否超时)，失败时延迟为PING_FAILED
+    超时与连接被拒绝分开返回：只有超时才可能是本地上行拥塞导致
+    """
+    family = socket.AF_INET6 if ':' in ip else socket.AF_INET
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setblocking(False)
+    try:
+        start = time.perf_counter()
+        await asyncio.wait_for(loop.sock_connect(sock, (ip, port)), timeout)
+        return (time.perf_counter() - start) * 1000, False
+    except asyncio.TimeoutError:
+        return PING_FAILED, True
+    except OSError:
+        return PING_FAILED, False
+    finally:
+        sock.close()
+
+
+async def _ping_all(ips: Iterable[str], port: int, timeout: float, controller: AIMDController,
+                    on_result: Optional[Callable[[str, float], None]] = None,
+                    should_stop: Optional[Callable[[], bool]] = None,
+                    budget=None) -> Dict[str, float]:
+    results: Dict[str, float] = {}
+    pending = deque(ips)
+    retried = set()
+    inflight = set()
+
+    def _emit(_ip: str, delay: float):
+        results[_ip] = delay
+        if on_result:
+            try:
+                on_result(_ip, delay)
+            except Exception:
+                pass
+
+    def _settle(window: Optional[Tuple[bool, List[str]]]):
+        # 超时IP等到所在窗口结束再定论：拥塞窗口中的超时交回重测，其余记为失败
+        if window is None:
+            return
+        decreased, timeouts = window
+        for _ip in timeouts:
+            if decreased and _ip not in retried:
+                retried.add(_ip)
+                pending.appendleft(_ip)
+            else:
+                _emit(_ip, PING_FAILED)
+
+    async def _probe(_ip: str):
+        try:
+            return _ip, await _ping_one(_ip, port, timeout)
+        finally:
+            if budget is not None:
+                budget.release_socket()
+
+    while pending or inflight:
+        stopped = should_stop and should_stop()
+        while pending and not stopped and len(inflight) < controller.level:
+            # 全局连接名额被HTTP探测占满时先等在途ping完成
+            if budget is not None and not budget.try_acquire_socket():
+                break
+            inflight.add(asyncio.ensure_future(_probe(pending.popleft())))
+        if not inflight:
+            if pending and not stopped:
+                await asyncio.sleep(0.05)
+                continue
+            break
+        done, inflight = await asyncio.wait(inflight, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            ip, (delay, timed_out) = task.result()
+            if not timed_out:
+                _emit(ip, delay)
+            _settle(controller.on_result(ip, timed_out))
+    _settle(controller.close_window())
+    for ip in pending:
+        if ip in retried:
+            # 提前结束时尚未重测的IP按失败计
+            _emit(ip, PING_FAILED)
+    return results
+
+
+def _in_running_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+def tcp_ping_many(ips: Iterable[str], port: int = 443, timeout: float = 1,
+                  concurrency: int = 500,
+                  on_result: Optional[Callable[[str, float], None]] = None,
+                  should_stop: Optional[Callable[[], bool]] = None,
+                  controller: Optional[AIMDController] = None,
+                  budget=None) -> Dict[str, float]:
+    """
+    单线程asyncio批量TCP ping，在途connect数由AIMD控制器自适应调节，上限为concurrency
+    on_result: 每个IP探测完成即回调(ip, 延迟)，用于把结果流式交给下一阶段（在事件循环线程中调用，需线程安全）
+    should_stop: 返回True时不再发起新的探测，用于提前结束
+    controller: 传入时沿用其当前并发水平（跨轮次/跨运行保持），结束后可读取level/peak/decreases
+    budget: 全局探测预算（ProbeBudget），每个在途ping占用一个连接名额
+    返回: {ip: 延迟ms}，失败的IP延迟为PING_FAILED，提前结束时未探测的IP不在结果中
+    """
+    ips = list(dict.fromkeys(ips))
+    if not ips:
+        return {}
+    max_limit = effective_concurrency(concurrency)
+    if controller is None:
+        controller = AIMDController(max_limit)
+    else:
+        controller.reset_limit(max_limit)
+    coro_args = (ips, port, timeout, controller, on_result, should_stop, budget)
+    if _in_running_loop():
+        # 调用方已处于事件循环中（如异步事件回调），放到独立线程里跑新的事件循环
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, _ping_all(*coro_args)).result()
+    return asyncio.run(_ping_all(*coro_args))
@@ -0,0 +1,59 @@
+import ipaddress
+import random
+from bisect import bisect_right
+from itertools import accumulate
+from typing import Iterable, List, Optional, Set
+
+
+def _host_range(net: ipaddress._BaseNetwork):
+    """
+    返回网段可用主机的(起始整数, 数量)，口径与ip_network.hosts()一致
+    """
+    base = int(net.network_address)
+    size = net.num_addresses
+    if net.version == 4:
+        if net.prefixlen >= 31:
+            return base, size
+        return base + 1, size - 2
+    if net.prefixlen >= 127:
+        return base, size
+    return base + 1, size - 1
+
+
+def sample_addresses(nets: Iterable[str], k: int, exclude: Optional[Set[str]] = None,
+                     rng: random.Random = None) -> List[str]:
+    """
+    在多个CIDR内按网段大小加权、按整数偏移均匀随机抽取k个不重复地址，
+    时间与内存均为O(k)，不会遍历任何主机范围，IPv4/IPv6通用。
+    exclude中的地址不会被抽中；网段地址不足时返回的数量可能少于k
+    """
+    rng = rng or random
+    exclude = exclude or set()
+    ranges = []
+    for net in nets:
+        try:
+            net_obj = ipaddress.ip_network(net, strict=False)
+        except ValueError:
+            continue
+        first, count = _host_range(net_obj)
+        if count > 0:
+            ranges.append((net_obj.version, first, count))
+    if not ranges or k <= 0:
+        return []
+    cum_weights = list(accumulate(count for _, _, count in ranges))
+    total = cum_weights[-1]
+    picked: Set[str] = set()
+    result: List[str] = []
+    # 小网段可能被抽空，限制尝试次数避免死循环
+    attempts = 0
+    max_attempts = k * 8 + 64
+    while len(result) < k and attempts < max_attempts:
+        attempts += 1
+        version, first, count = ranges[bisect_right(cum_weights, rng.randrange(total))]
+        value = first + rng.randrange(count)
+        ip = str(ipaddress.IPv4Address(value) if version == 4 else ipaddress.IPv6Address(value))
+        if ip in picked or ip in exclude:
+            continue
+        picked.add(ip)
+        result.append(ip)
+    return result
@@ -0,0 +1,290 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import requests
+
+from app.log import logger
+
+# 编译结果快照格式版本，TrackerRules结构变化时递增
+SNAPSHOT_VERSION = 1
+
+
+class TrackerRules:
+    """
+    tracker规则编译结果，支持三类规则：
+    DOMAIN,x / 带点的裸域名 —— 精确匹配；DOMAIN-SUFFIX,x —— 域名及其子域名；
+    DOMAIN-KEYWORD,x / 不带点的裸关键字（如announce）—— 主机名包含该关键字。
+    后缀规则按域名标签倒序建字典树，关键字规则建Aho-Corasick自动机，
+    单个主机名匹配为O(len(host))，与规则数量无关
+    """
+
+    def __init__(self, lines: Iterable[str]):
+        self.exact: Dict[str, str] = {}
+        self._suffix_trie: dict = {}
+        self.suffixes: List[str] = []
+        self.keywords: List[str] = []
+        for line in lines:
+            self._add_rule(line)
+        self._build_automaton()
+
+    def _add_rule(self, line: str):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            return
+        if ',' in line:
+            # 兼容 DOMAIN-SUFFIX,example.com,PROXY 这类带策略组的写法
+            parts = [p.strip() for p in line.split(',')]
+            kind, value = parts[0].upper(), parts[1].lower() if len(parts) > 1 else ''
+        else:
+            value = line.lower()
+            kind = 'DOMAIN' if '.' in value else 'DOMAIN-KEYWORD'
+        value = value.strip('.')
+        if not value:
+            return
+        if kind == 'DOMAIN':
+            self.exact[value] = f"DOMAIN,{value}"
+        elif kind == 'DOMAIN-SUFFIX':
+            node = self._suffix_trie
+            for label in reversed(value.split('.')):
+                node = node.setdefault(label, {})
+            if '' not in node:
+                node[''] = f"DOMAIN-SUFFIX,{value}"
+                self.suffixes.append(value)
+        elif kind == 'DOMAIN-KEYWORD':
+            if value not in self.keywords:
+                self.keywords.append(value)
+        # IP-CIDR等其他规则类型无法用于域名优选，忽略
+
+    def _build_automaton(self):
+        """
+        关键字Aho-Corasick自动机：_goto[状态]为{字符: 下一状态}，_out[状态]为在该状态结束的关键字（含失配链上的）
+        """
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Optional[str]] = [None]
+        for keyword in self.keywords:
+            state = 0
+            for ch in keyword:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(None)
+                    self._goto[state][ch] = nxt
+                state = nxt
+            if self._out[state] is None:
+                self._out[state] = keyword
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                if self._out[nxt] is None:
+                    self._out[nxt] = self._out[self._fail[nxt]]
+
+    def _match_keyword(self, host: str) -> Optional[str]:
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for ch in host:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state] is not None:
+                return out[state]
+        return None
+
+    def _match_suffix(self, host: str) -> Optional[str]:
+        node = self._suffix_trie
+        matched = None
+        for label in reversed(host.split('.')):
+            node = node.get(label)
+            if node is None:
+                break
+            # 取最长的后缀规则
+            matched = node.get('', matched)
+        return matched
+
+    def match(self, host: str) -> Optional[str]:
+        """
+        返回命中的规则（如 DOMAIN-SUFFIX,example.com），未命中返回None；优先级：精确 > 后缀 > 关键字
+        """
+        host = (host or '').strip().strip('.').lower()
+        if not host:
+            return None
+        rule = self.exact.get(host) or self._match_suffix(host)
+        if rule:
+            return rule
+        keyword = self._match_keyword(host) if self.keywords else None
+        return f"DOMAIN-KEYWORD,{keyword}" if keyword else None
+
+    def domains(self) -> set:
+        """
+        可直接参与优选的具体域名（精确与后缀规则），关键字规则只用于匹配
+        """
+        return set(self.exact) | set(self.suffixes)
+
+    def summary(self) -> str:
+        return f"精确{len(self.exact)}条，后缀{len(self.suffixes)}条，关键字{len(self.keywords)}条"
+
+
+def snapshot_path(list_path: str) -> str:
+    """
+    规则列表对应的编译快照路径（与列表同目录）
+    """
+    return os.path.splitext(list_path)[0] + '.rules'
+
+
+def _file_signature(path: str) -> Tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class TrackerRulesCache:
+    """
+    进程级tracker规则缓存：列表文件只在签名(mtime/size)变化时重新编译，
+    编译结果以pickle快照落盘，重启后签名一致则直接加载
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[Tuple[int, int], TrackerRules]] = {}
+
+    def get(self, list_path: str) -> Optional[TrackerRules]:
+        """
+        获取list_path对应的编译规则，文件不存在返回None
+        """
+        try:
+            signature = _file_signature(list_path)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._entries.get(list_path)
+            if entry and entry[0] == signature:
+                return entry[1]
+            rules = self._load_snapshot(list_path, signature)
+            if rules is None:
+                rules = self._build(list_path, signature)
+            if rules is not None:
+                self._entries[list_path] = (signature, rules)
+            return rules
+
+    @staticmethod
+    def _load_snapshot(list_path: str, signature: Tuple[int, int]) -> Optional[TrackerRules]:
+        path = snapshot_path(list_path)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                data = pickle.load(f)
+            if data.get('version') != SNAPSHOT_VERSION or tuple(data.get('signature', ())) != signature:
+                return None
+            return data['rules']
+        except Exception as e:
+            logger.warning(f"读取tracker规则快照失败，将重新编译: {e}")
+            return None
+
+    @staticmethod
+    def _build(list_path: str, signature: Tuple[int, int]) -> Optional[TrackerRules]:
+        try:
+            with open(list_path, 'r', encoding='utf-8-sig') as f:
+                rules = TrackerRules(f)
+        except Exception as e:
+            logger.error(f"解析{list_path}失败: {e}")
+            return None
+        logger.info(f"tracker规则编译完成：{rules.summary()}")
+        path = snapshot_path(list_path)
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump({'version': SNAPSHOT_VERSION, 'signature': signature, 'rules': rules},
+                            f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"写入tracker规则快照失败: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        return rules
+
+
+tracker_rules_cache = TrackerRulesCache()
+
+
+def _content_digest(content: str) -> str:
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def write_rule_list(path: str, lines: List[str]) -> bool:
+    """
+    写入规则列表，内容未变化时不写文件（保持签名不变，避免重新编译），返回是否写入
+    """
+    content = "".join(f"{line}\n" for line in lines)
+    try:
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            if f.read() == content:
+                return False
+    except OSError:
+        pass
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+    return True
+
+
+def fetch_rule_list(url: str, path: str, proxies: Optional[dict] = None, timeout: int = 10) -> Tuple[bool, int]:
+    """
+    条件请求同步远程规则列表：携带上次响应的ETag/Last-Modified，304时不下载也不改写文件。
+    校验信息保存在同目录的 .meta 文件中，并记录写入内容的摘要；
+    本地文件被改写（如UI保存了自定义列表）或地址变化后不再发送条件头，保证能取回完整列表。
+    返回(文件是否改变, 规则行数)，请求失败抛出requests异常
+    """
+    meta_path = f"{path}.meta"
+    meta = {}
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        pass
+    headers = {}
+    try:
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            current = f.read()
+    except OSError:
+        current = None
+    if current is not None and meta.get('url') == url and meta.get('digest') == _content_digest(current):
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+    resp = requests.get(url, headers=headers, timeout=timeout, proxies=proxies)
+    if resp.status_code == 304 and headers:
+        return False, len([line for line in current.splitlines() if line.strip()])
+    resp.raise_for_status()
+    lines = [line.strip() for line in resp.text.splitlines() if line.strip()]
+    updated = write_rule_list(path, lines)
+    meta = {
+        'url': url,
+        'etag': resp.headers.get('ETag'),
+        'last_modified': resp.headers.get('Last-Modified'),
+        'digest': _content_digest("".join(f"{line}\n" for line in lines)),
+    }
+    try:
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+    except OSError as e:
+        logger.warning(f"写入tracker列表校验信息失败: {e}")
+    return updated, len(lines)
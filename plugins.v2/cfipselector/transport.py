@@ -0,0 +1,213 @@
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+class PhaseTimings(threading.local):
+    """
+    线程私有的建连耗时记录：连接在发起请求的线程中建立，
+    同一会话被多个线程并发使用时各线程只看到自己请求的TCP/TLS耗时
+    """
+
+    def __init__(self):
+        self.data: Dict[str, float] = {}
+
+    def __setitem__(self, key: str, value: float):
+        self.data[key] = value
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.data
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.data.get(key, default)
+
+    def clear(self):
+        self.data = {}
+
+
+def _pinned_pool_classes(ip: str, timings: Optional[PhaseTimings] = None) -> dict:
+    """
+    生成只连接到指定IP的连接池类：域名仍用于SNI与Host头，仅把DNS解析结果固定为ip
+    timings不为None时，新建连接会把TCP建连与TLS握手耗时(ms)写入其中的connect/tls
+    """
+
+    class PinnedHTTPConnection(HTTPConnection):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self._dns_host = ip
+
+        def _new_conn(self):
+            start = time.perf_counter()
+            sock = super()._new_conn()
+            if timings is not None:
+                timings["connect"] = (time.perf_counter() - start) * 1000
+            return sock
+
+    class PinnedHTTPSConnection(HTTPSConnection):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self._dns_host = ip
+
+        def _new_conn(self):
+            start = time.perf_counter()
+            sock = super()._new_conn()
+            if timings is not None:
+                timings["connect"] = (time.perf_counter() - start) * 1000
+            return sock
+
+        def connect(self):
+            start = time.perf_counter()
+            super().connect()
+            if timings is not None:
+                # connect()包含_new_conn的TCP建连，余下即为TLS握手
+                timings["tls"] = max(0.0, (time.perf_counter() - start) * 1000 - timings.get("connect", 0.0))
+
+    class PinnedHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = PinnedHTTPConnection
+
+    class PinnedHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = PinnedHTTPSConnection
+
+    return {"http": PinnedHTTPConnectionPool, "https": PinnedHTTPSConnectionPool}
+
+
+class PinnedIPAdapter(HTTPAdapter):
+    """
+    requests适配器：所有请求直连指定IP，URL中的域名照常用于SNI和Host头，无需改写hosts
+    timings为线程私有的建连耗时记录
+    """
+
+    __attrs__ = HTTPAdapter.__attrs__ + ["ip", "timings"]
+
+    def __init__(self, ip: str, timings: Optional[PhaseTimings] = None, **kwargs):
+        self.ip = ip
+        self.timings = timings
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = _pinned_pool_classes(self.ip, self.timings)
+
+
+def pinned_session(ip: str, pool_maxsize: int = 4, timings: Optional[PhaseTimings] = None) -> requests.Session:
+    """
+    创建固定解析到ip的会话，不读取环境代理，避免测速流量绕行代理
+    传入timings时记录新建连接的TCP/TLS耗时，配合timed_get使用
+    """
+    session = requests.Session()
+    session.trust_env = False
+    adapter = PinnedIPAdapter(ip, timings, pool_connections=pool_maxsize, pool_maxsize=pool_maxsize)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def timed_get(session: requests.Session, url: str, timings: PhaseTimings,
+              **kwargs) -> Tuple[requests.Response, Dict[str, float]]:
+    """
+    分阶段计时的GET请求，口径与curl一致（均从发起请求起算，单位ms）：
+    connect: TCP建连耗时；tls: TLS握手耗时（复用连接时两者为0）；
+    ttfb: 收到响应头（首字节）耗时；total: 响应体读取完毕耗时；
+    reused: 是否复用了keep-alive连接（冷/热请求）
+    """
+    timings.clear()
+    start = time.perf_counter()
+    response = session.get(url, stream=True, **kwargs)
+    ttfb = (time.perf_counter() - start) * 1000
+    try:
+        _ = response.content
+    finally:
+        response.close()
+    total = (time.perf_counter() - start) * 1000
+    phases = {
+        "connect": timings.get("connect", 0.0),
+        "tls": timings.get("tls", 0.0),
+        "ttfb": ttfb,
+        "total": total,
+        "reused": "connect" not in timings,
+    }
+    return response, phases
+
+
+class SessionPool:
+    """
+    一次优选运行内按IP复用的keep-alive会话：同一IP的各域名测速与重复测速共用会话，
+    每个域名的连接池在运行内保持，只有首个请求需要TCP/TLS握手。运行结束时调用close释放连接
+    """
+
+    def __init__(self, pool_maxsize: int = 4):
+        self.pool_maxsize = pool_maxsize
+        self.timings = PhaseTimings()
+        self._sessions: Dict[str, requests.Session] = {}
+        self._lock = threading.Lock()
+
+    def get(self, ip: str) -> requests.Session:
+        with self._lock:
+            session = self._sessions.get(ip)
+            if session is None:
+                session = pinned_session(ip, self.pool_maxsize, self.timings)
+                self._sessions[ip] = session
+            return session
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = list(self._sessions.values()), {}
+        for session in sessions:
+            try:
+                session.close()
+            except Exception:
+                pass
+
+
+def parse_cf_trace(text: str) -> Dict[str, Any]:
+    """
+    解析 /cdn-cgi/trace 的 key=value 响应体，如 colo=SJC、ip=1.2.3.4、http=http/2、tls=TLSv1.3
+    """
+    trace = {}
+    for line in (text or "").splitlines():
+        if "=" not in line:
+            continue
+        key, value = line.split("=", 1)
+        key = key.strip()
+        if key:
+            trace[key] = value.strip()
+    return trace
+
+
+def measure_throughput(session: requests.Session, url: str, max_bytes: int, max_seconds: float,
+                       timeout: float = 5, chunk_size: int = 64 * 1024, **kwargs) -> Optional[float]:
+    """
+    流式下载url测量带宽，读满max_bytes或耗时达到max_seconds即停止
+    计时从收到响应头开始，不含建连与首字节等待；返回MB/s，失败返回None
+    """
+    try:
+        response = session.get(url, stream=True, timeout=timeout, **kwargs)
+    except Exception:
+        return None
+    received = 0
+    start = time.perf_counter()
+    try:
+        if response.status_code != 200:
+            return None
+        for chunk in response.iter_content(chunk_size):
+            received += len(chunk)
+            if received >= max_bytes or time.perf_counter() - start >= max_seconds:
+                break
+    except Exception:
+        # 读取中途超时/断开，按已收到的数据计算
+        pass
+    finally:
+        response.close()
+    elapsed = time.perf_counter() - start
+    if received <= 0 or elapsed <= 0:
+        return None
+    return received / elapsed / (1024 * 1024)
@@ -1,3 +1,4 @@
+import time
 from pathlib import Path
 from typing import Any, List, Dict, Tuple, Optional
 
@@ -10,6 +11,7 @@ from app.helper.storage import StorageHelper
 from schemas import StorageOperSelectionEventData, FileItem
 
 from .quark_api import QuarkApi
+from .walker import QuarkWalker
 
 class QuarkDisk(_PluginBase):
     # 插件名称
@@ -36,6 +38,10 @@ class QuarkDisk(_PluginBase):
     _cookie = None
     _disk_name = None
     _quark_api = None
+    _walker = None
+    _list_workers = 4
+    _list_rps = 10
+    _upload_workers = 3
     _inited = False
 
     def __init__(self, *args, **kwargs):
@@ -62,14 +68,25 @@ class QuarkDisk(_PluginBase):
 
             self._enabled = config.get("enabled")
             self._cookie = config.get("cookie")
+            try:
+                self._list_workers = max(1, int(config.get("list_workers") or 4))
+                self._upload_workers = max(1, int(config.get("upload_workers") or 3))
+                list_rps = config.get("list_rps")
+                self._list_rps = max(0.0, float(list_rps)) if list_rps not in (None, "") else 10
+            except (TypeError, ValueError):
+                self._list_workers, self._list_rps, self._upload_workers = 4, 10, 3
             
             logger.info(f"【夸克】插件启用状态: {self._enabled}")
             logger.info(f"【夸克】Cookie长度: {len(self._cookie) if self._cookie else 0}")
 
+            # 释放旧客户端的连接池
+            self.__close_api()
             if self._enabled and self._cookie:
                 try:
                     logger.info("【夸克】开始创建API客户端")
-                    self._quark_api = QuarkApi(cookie=self._cookie)
+                    self._quark_api = QuarkApi(cookie=self._cookie, list_workers=self._list_workers,
+                                               upload_workers=self._upload_workers)
+                    self._walker = QuarkWalker(self._quark_api, self._list_workers, self._list_rps)
                     logger.info("【夸克】API客户端创建成功")
                 except Exception as e:
                     logger.error(f"【夸克】API客户端创建失败: {str(e)}")
@@ -84,7 +101,27 @@ class QuarkDisk(_PluginBase):
         pass
 
     def get_api(self) -> List[Dict[str, Any]]:
-        pass
+        return [
+            {
+                "path": "/quarkdisk/stats",
+                "endpoint": self.api_stats,
+                "methods": ["GET"],
+                "summary": "夸克网盘客户端统计",
+                "description": "获取路径缓存命中情况与各接口的请求次数、耗时",
+            }
+        ]
+
+    def api_stats(self, *args, **kwargs):
+        """
+        返回API客户端统计信息
+        """
+        if not self._quark_api:
+            return {"success": False, "msg": "API客户端未初始化"}
+        return {
+            "success": True,
+            "cache": self._quark_api.cache_stats(),
+            "requests": self._quark_api.request_stats(),
+        }
 
     def get_form(self) -> Tuple[List[dict], Dict[str, Any]]:
         """
@@ -127,6 +164,62 @@ class QuarkDisk(_PluginBase):
                             }
                         ],
                     },
+                    {
+                        "component": "VRow",
+                        "content": [
+                            {
+                                "component": "VCol",
+                                "props": {"cols": 12, "md": 4},
+                                "content": [
+                                    {
+                                        "component": "VTextField",
+                                        "props": {
+                                            "model": "list_workers",
+                                            "label": "目录遍历并发数",
+                                            "type": "number",
+                                            "placeholder": "4",
+                                            "hint": "递归列举、快照时同时列举的目录数",
+                                            "persistent-hint": True,
+                                        },
+                                    }
+                                ],
+                            },
+                            {
+                                "component": "VCol",
+                                "props": {"cols": 12, "md": 4},
+                                "content": [
+                                    {
+                                        "component": "VTextField",
+                                        "props": {
+                                            "model": "list_rps",
+                                            "label": "列表请求速率(次/秒)",
+                                            "type": "number",
+                                            "placeholder": "10",
+                                            "hint": "目录遍历时每秒最多的列表请求数，0为不限",
+                                            "persistent-hint": True,
+                                        },
+                                    }
+                                ],
+                            },
+                            {
+                                "component": "VCol",
+                                "props": {"cols": 12, "md": 4},
+                                "content": [
+                                    {
+                                        "component": "VTextField",
+                                        "props": {
+                                            "model": "upload_workers",
+                                            "label": "分片上传并发数",
+                                            "type": "number",
+                                            "placeholder": "3",
+                                            "hint": "上传时同时上传的分片数，中断后再次上传自动续传",
+                                            "persistent-hint": True,
+                                        },
+                                    }
+                                ],
+                            },
+                        ],
+                    },
                     {
                         "component": "VRow",
                         "content": [
@@ -157,6 +250,9 @@ class QuarkDisk(_PluginBase):
         ], {
             "enabled": False,
             "cookie": "",
+            "list_workers": 4,
+            "list_rps": 10,
+            "upload_workers": 3,
         }
 
     def get_page(self) -> List[dict]:
@@ -222,24 +318,11 @@ class QuarkDisk(_PluginBase):
             logger.error("【夸克】API客户端未初始化")
             return None
 
-        def __get_files(_item: schemas.FileItem, _r: Optional[bool] = False):
-            """
-            递归处理
-            """
-            _items = self._quark_api.list(_item)
-            if _items:
-                if _r:
-                    for t in _items:
-                        result.append(t)
-                        if t.type == "dir":
-                            __get_files(t, _r)
-                else:
-                    result.extend(_items)
-
-        # 返回结果
-        result = []
         try:
-            __get_files(fileitem, recursion)
+            if recursion:
+                result = list(self._walker.walk(fileitem, recursive=True))
+            else:
+                result = self._quark_api.list(fileitem)
             logger.info(f"【夸克】获取到 {len(result)} 个文件")
             return result
         except Exception as e:
@@ -255,28 +338,20 @@ class QuarkDisk(_PluginBase):
         if fileitem.storage != self._disk_name:
             return None
 
-        def __any_file(_item: FileItem):
-            """
-            递归处理
-            """
-            _items = self._quark_api.list(_item)
-            if _items:
-                if not extensions:
-                    return True
-                for t in _items:
-                    if (
-                        t.type == "file"
-                        and t.extension
-                        and f".{t.extension.lower()}" in extensions
-                    ):
-                        return True
-                    elif t.type == "dir":
-                        if __any_file(t):
-                            return True
-            return False
-
-        # 返回结果
-        return __any_file(fileitem)
+        if not self._walker:
+            return None
+
+        # 找到第一个匹配项即结束遍历，未完成的目录列举随之取消
+        for t in self._walker.walk(fileitem, recursive=bool(extensions)):
+            if not extensions:
+                return True
+            if (
+                t.type == "file"
+                and t.extension
+                and f".{t.extension.lower()}" in extensions
+            ):
+                return True
+        return False
 
     def create_folder(
         self, fileitem: schemas.FileItem, name: str
@@ -314,7 +389,26 @@ class QuarkDisk(_PluginBase):
         if fileitem.storage != self._disk_name:
             return None
 
-        return self._quark_api.upload(fileitem, path, new_name)
+        return self._quark_api.upload(fileitem, path, new_name,
+                                      progress_callback=self.__upload_progress(new_name or path.name))
+
+    @staticmethod
+    def __upload_progress(name: str, interval: float = 10):
+        """
+        上传进度回调：按间隔在日志中输出进度、速度与剩余时间
+        """
+        last = [0.0]
+
+        def __progress(uploaded: int, total: int, speed: float, eta: Optional[float]):
+            now = time.monotonic()
+            if uploaded < total and now - last[0] < interval:
+                return
+            last[0] = now
+            percent = uploaded * 100 / total if total else 100
+            eta_text = f"，剩余约 {int(eta // 60)}分{int(eta % 60)}秒" if eta else ""
+            logger.info(f"【夸克】上传 {name}: {percent:.1f}%，{speed / 1024 / 1024:.2f}MB/s{eta_text}")
+
+        return __progress
 
     def delete_file(self, fileitem: schemas.FileItem) -> Optional[bool]:
         """
@@ -379,21 +473,19 @@ class QuarkDisk(_PluginBase):
 
         files_info = {}
 
-        def __snapshot_file(_fileitm: schemas.FileItem):
-            """
-            递归获取文件信息
-            """
-            if _fileitm.type == "dir":
-                for sub_file in self._quark_api.list(_fileitm):
-                    __snapshot_file(sub_file)
-            else:
-                files_info[_fileitm.path] = _fileitm.size
-
         fileitem = self._quark_api.get_item(path)
         if not fileitem:
             return {}
 
-        __snapshot_file(fileitem)
+        if fileitem.type != "dir":
+            files_info[fileitem.path] = fileitem.size
+            return files_info
+
+        if not fileitem.path.endswith("/"):
+            fileitem.path = f"{fileitem.path}/"
+        for sub_file in self._walker.walk(fileitem, recursive=True):
+            if sub_file.type != "dir":
+                files_info[sub_file.path] = sub_file.size
 
         return files_info
 
@@ -415,8 +507,14 @@ class QuarkDisk(_PluginBase):
 
         return {"move": "移动", "copy": "复制"}
 
+    def __close_api(self):
+        if self._quark_api:
+            self._quark_api.close()
+            self._quark_api = None
+            self._walker = None
+
     def stop_service(self):
         """
         退出插件
         """
-        pass 
\ No newline at end of file
+        self.__close_api() 
\ No newline at end of file
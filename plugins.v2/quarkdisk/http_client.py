@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import defaultdict
+from typing import Dict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class QuarkHttpClient:
+    """
+    夸克网盘HTTP客户端：单个keep-alive会话复用到pan.quark.cn/drive-pc.quark.cn及上传下载地址的连接。
+    连接失败自动重试；读超时与状态码429/5xx只对GET等无请求体的方法重试，POST/PUT由调用方决定是否重试。
+    按接口统计请求次数、失败次数与耗时
+    """
+
+    def __init__(self, timeout: float = 30, max_retries: int = 3, pool_maxsize: int = 16):
+        self.timeout = timeout
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=max_retries,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            # POST接口不幂等，分片PUT由上传器按分片重新签名后重试，这里只对无请求体的方法做读超时/状态码重试
+            allowed_methods=frozenset({"GET", "HEAD", "OPTIONS"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=retry)
+        self._session = requests.Session()
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = defaultdict(
+            lambda: {"count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+
+    def request(self, endpoint: str, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        发送请求并计入endpoint的统计；未指定timeout时使用默认超时，stream请求只统计到响应头返回
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        start = time.perf_counter()
+        failed = True
+        try:
+            resp = self._session.request(method, url, **kwargs)
+            failed = resp.status_code >= 400
+            return resp
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            with self._lock:
+                item = self._stats[endpoint]
+                item["count"] += 1
+                item["errors"] += int(failed)
+                item["total_ms"] += elapsed
+                item["max_ms"] = max(item["max_ms"], elapsed)
+
+    def get(self, endpoint: str, url: str, **kwargs) -> requests.Response:
+        return self.request(endpoint, "GET", url, **kwargs)
+
+    def post(self, endpoint: str, url: str, **kwargs) -> requests.Response:
+        return self.request(endpoint, "POST", url, **kwargs)
+
+    def put(self, endpoint: str, url: str, **kwargs) -> requests.Response:
+        return self.request(endpoint, "PUT", url, **kwargs)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        {接口: {count, errors, avg_ms, max_ms}}
+        """
+        with self._lock:
+            return {
+                endpoint: {
+                    "count": item["count"],
+                    "errors": item["errors"],
+                    "avg_ms": round(item["total_ms"] / item["count"], 1) if item["count"] else 0.0,
+                    "max_ms": round(item["max_ms"], 1),
+                }
+                for endpoint, item in self._stats.items()
+            }
+
+    def close(self):
+        self._session.close()
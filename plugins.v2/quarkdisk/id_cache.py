@@ -0,0 +1,152 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+
+def normalize_path(path: str) -> str:
+    """
+    统一缓存键：以/开头、不以/结尾（根目录为/）
+    """
+    path = str(path or "/").replace("\\", "/")
+    if not path.startswith("/"):
+        path = "/" + path
+    if len(path) > 1:
+        path = path.rstrip("/") or "/"
+    return path
+
+
+class PathIdCache:
+    """
+    路径→fid缓存：LRU+TTL，按账号隔离。
+    删除时连同子路径一起失效；重命名/移动时整棵子树改挂到新路径（夸克重命名、移动不改变fid）
+    """
+
+    # 账号→缓存，账号以Cookie摘要区分，Cookie变化即视为新账号，旧缓存不会被误用
+    _accounts: "OrderedDict[str, PathIdCache]" = OrderedDict()
+    _accounts_lock = threading.Lock()
+    _max_accounts = 4
+
+    def __init__(self, max_entries: int = 20000, ttl: float = 600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def for_account(cls, cookie: str) -> "PathIdCache":
+        key = hashlib.sha1((cookie or "").encode("utf-8")).hexdigest()
+        with cls._accounts_lock:
+            cache = cls._accounts.get(key)
+            if cache is None:
+                cache = cls()
+                cls._accounts[key] = cache
+                while len(cls._accounts) > cls._max_accounts:
+                    cls._accounts.popitem(last=False)
+            else:
+                cls._accounts.move_to_end(key)
+            return cache
+
+    def _get_locked(self, path: str) -> Optional[str]:
+        entry = self._entries.get(path)
+        if entry is None:
+            return None
+        fid, expires = entry
+        if expires < time.monotonic():
+            del self._entries[path]
+            return None
+        self._entries.move_to_end(path)
+        return fid
+
+    def get(self, path: str) -> Optional[str]:
+        path = normalize_path(path)
+        if path == "/":
+            return "0"
+        with self._lock:
+            fid = self._get_locked(path)
+            if fid is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return fid
+
+    def put(self, path: str, fid: str):
+        path = normalize_path(path)
+        if path == "/":
+            return
+        with self._lock:
+            self._entries[path] = (str(fid), time.monotonic() + self.ttl)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def deepest_ancestor(self, path: str) -> Tuple[str, str]:
+        """
+        返回path自身或其最深的已缓存祖先(路径, fid)，均未缓存时为根目录("/", "0")；
+        命中计一次hit，完全未命中计一次miss
+        """
+        path = normalize_path(path)
+        if path == "/":
+            return "/", "0"
+        with self._lock:
+            prefix = path
+            while prefix != "/":
+                fid = self._get_locked(prefix)
+                if fid is not None:
+                    self.hits += 1
+                    return prefix, fid
+                prefix = prefix.rsplit("/", 1)[0] or "/"
+            self.misses += 1
+            return "/", "0"
+
+    def _subtree_keys(self, path: str):
+        prefix = path.rstrip("/") + "/"
+        return [key for key in self._entries if key == path or key.startswith(prefix)]
+
+    def invalidate(self, path: str):
+        """
+        删除path及其所有子路径
+        """
+        path = normalize_path(path)
+        with self._lock:
+            if path == "/":
+                self._entries.clear()
+                return
+            for key in self._subtree_keys(path):
+                del self._entries[key]
+
+    def move(self, old_path: str, new_path: str):
+        """
+        把old_path整棵子树改挂到new_path下，原目标路径下的旧条目一并清除
+        """
+        old_path, new_path = normalize_path(old_path), normalize_path(new_path)
+        if old_path == new_path or old_path == "/":
+            return
+        with self._lock:
+            for key in self._subtree_keys(new_path):
+                del self._entries[key]
+            now = time.monotonic()
+            for key in self._subtree_keys(old_path):
+                fid, expires = self._entries.pop(key)
+                if expires >= now:
+                    self._entries[new_path + key[len(old_path):]] = (fid, expires)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
@@ -1,7 +1,7 @@
 import ast
 import time
 from pathlib import Path
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Iterator, Callable
 from datetime import datetime
 
 import pytz
@@ -12,26 +12,96 @@ import schemas
 from app.core.config import settings
 from app.log import logger
 
+from .http_client import QuarkHttpClient
+from .id_cache import PathIdCache, normalize_path
+from .uploader import MultipartUploader, ProgressCallback
+
+# pan.quark.cn接口的公共请求头模板，Cookie、设备ID与时间戳在实例中补充
+API_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
+    "Content-Type": "application/json;charset=UTF-8",
+    "Referer": "https://pan.quark.cn",
+    "Origin": "https://pan.quark.cn",
+    "Accept": "application/json, text/plain, */*",
+    "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
+    "Accept-Encoding": "gzip, deflate, br",
+    "Connection": "keep-alive",
+    "x-requested-with": "XMLHttpRequest",
+    "x-client-version": "3.1.0",
+    "x-platform-version": "web",
+    "x-platform-type": "web",
+    "x-sdk-version": "3.1.0",
+    "x-device-model": "web",
+    "x-device-name": "Chrome",
+    "x-device-platform": "web",
+    "x-app-id": "30",
+    "x-app-version": "3.1.0",
+    "x-app-package": "com.quark.pan",
+    "x-web-timezone": "8",
+    "x-web-source": "pc",
+    "x-web-os": "web",
+    "x-web-browser": "Chrome",
+    "x-web-browser-version": "122.0.0.0"
+}
+
+# drive-pc.quark.cn文件列表接口（/file/sort）的请求头模板，与网页端一致
+SORT_HEADERS = {
+    "Accept": "application/json, text/plain, */*",
+    "Accept-Encoding": "gzip, deflate, br, zstd",
+    "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8,en-GB;q=0.7,en-US;q=0.6",
+    "Cache-Control": "no-cache",
+    "Origin": "https://pan.quark.cn",
+    "Pragma": "no-cache",
+    "Priority": "u=1",
+    "Referer": "https://pan.quark.cn/",
+    "Sec-Ch-Ua": '"Microsoft Edge";v="137", "Chromium";v="137", "Not/A)Brand";v="24"',
+    "Sec-Ch-Ua-Mobile": "?0",
+    "Sec-Ch-Ua-Platform": '"macOS"',
+    "Sec-Fetch-Dest": "empty",
+    "Sec-Fetch-Mode": "cors",
+    "Sec-Fetch-Site": "same-site",
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36 Edg/137.0.0.0"
+}
+
 
 class QuarkApi:
     """
     夸克网盘基础操作
     """
 
-    # FileId和路径缓存
-    _id_cache: Dict[str, str] = {}
-    
     # 请求重试次数
     _max_retries = 3
     
     # 请求超时时间(秒)
     _timeout = 30
 
-    def __init__(self, cookie: str):
+    # /file/list每页条目数
+    _list_limit = 100
+
+    def __init__(self, cookie: str, list_workers: int = 4, upload_workers: int = 3):
         try:
             self._cookie = cookie.strip()
             self._disk_name = "夸克网盘"
             self._base_url = "https://pan.quark.cn/1/clouddrive"
+            self._sort_url = "https://drive-pc.quark.cn/1/clouddrive/file/sort"
+            # 所有请求共用一个keep-alive会话，每个主机的连接池按遍历与上传并发数确定，另留余量给其他接口调用
+            self._client = QuarkHttpClient(timeout=self._timeout, max_retries=self._max_retries,
+                                           pool_maxsize=max(1, int(list_workers)) + max(1, int(upload_workers)) + 4)
+            # 分片上传，断点状态保存在临时目录
+            self._uploader = MultipartUploader(self._client, self._api_post,
+                                               Path(settings.TEMP_PATH) / "quarkdisk_upload",
+                                               workers=upload_workers, max_retries=self._max_retries)
+            # FileId和路径缓存，按账号隔离
+            self._id_cache = PathIdCache.for_account(self._cookie)
+            # 生成设备ID
+            device_id = str(int(time.time() * 1000))
+            self._headers = {
+                **API_HEADERS,
+                "Cookie": self._cookie,
+                "x-device-id": device_id,
+                "x-web-timestamp": device_id,
+            }
+            self._sort_headers = {**SORT_HEADERS, "Cookie": self._cookie}
             logger.info(f"【夸克】初始化API客户端, Cookie长度: {len(cookie)}")
             
             # 解析Cookie
@@ -72,9 +142,6 @@ class QuarkApi:
                 logger.error(f"【夸克】解析Cookie失败: {str(e)}")
                 raise
                 
-            # 生成设备ID
-            device_id = str(int(time.time() * 1000))
-            
             def filter_cookies(cookie_str, exclude_keys):
                 filtered = []
                 for item in cookie_str.split(';'):
@@ -84,30 +151,6 @@ class QuarkApi:
                             filtered.append(f"{key}={value}")
                 return '; '.join(filtered)
             
-            self._headers = {
-                "Cookie": self._cookie,
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
-                "Content-Type": "application/json;charset=UTF-8",
-                "Referer": "https://pan.quark.cn",
-                "Origin": "https://pan.quark.cn",
-                "Accept": "application/json, text/plain, */*",
-                "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
-                "Accept-Encoding": "gzip, deflate, br",
-                "Connection": "keep-alive",
-                "x-requested-with": "XMLHttpRequest",
-                "x-device-id": device_id,
-                "x-client-version": "3.1.0",
-                "x-platform-version": "web",
-                "x-platform-type": "web",
-                "x-sdk-version": "3.1.0",
-                "x-web-timestamp": str(int(time.time() * 1000)),
-                "x-device-model": "web",
-                "x-device-name": "Chrome",
-                "x-device-platform": "web",
-                "x-app-id": "30",
-                "x-app-version": "3.1.0",
-                "x-app-package": "com.quark.pan"
-            }
             # 日志输出前过滤Cookie字段
             filtered_headers = self._headers.copy()
             filtered_headers["Cookie"] = filter_cookies(self._headers["Cookie"], ["_UP_A4A_11_", "_UP_D_", "_qk_bx_ck_v1", "tfstk"])
@@ -117,259 +160,229 @@ class QuarkApi:
             logger.error(f"【夸克】初始化API客户端失败: {str(e)}")
             raise
 
+    def _request_headers(self) -> Dict[str, str]:
+        """
+        基于共享模板生成请求头，只刷新时间戳
+        """
+        headers = dict(self._headers)
+        headers["x-web-timestamp"] = str(int(time.time() * 1000))
+        return headers
+
+    def _api_post(self, endpoint: str, payload: Optional[dict] = None,
+                  params: Optional[dict] = None) -> requests.Response:
+        """
+        通过共享会话调用pan.quark.cn接口
+        """
+        return self._client.post(
+            endpoint,
+            f"{self._base_url}/{endpoint}",
+            headers=self._request_headers(),
+            params=params,
+            json=payload
+        )
+
+    def _list_page(self, pdir_fid: str, start: int) -> Optional[List[dict]]:
+        """
+        通过/file/list获取目录的一页条目（按文件名升序），失败返回None
+        """
+        request_data = {
+            "pdir_fid": pdir_fid,
+            "limit": self._list_limit,
+            "start": start,
+            "with_audit": 1,
+            "filters": {"phase": "all"},
+            "orderBy": [{"field": "file_name", "order": "asc"}],
+            "_web_timestamp": int(time.time() * 1000)
+        }
+        api_url = f"{self._base_url}/file/list"
+        logger.debug(f"【夸克】请求URL: {api_url}")
+        logger.debug(f"【夸克】请求参数: {request_data}")
+
+        # 添加重试机制
+        for retry in range(self._max_retries):
+            try:
+                resp = self._client.post(
+                    "file/list",
+                    api_url,
+                    headers=self._request_headers(),
+                    json=request_data
+                )
+                logger.debug(f"【夸克】第{retry + 1}次尝试请求文件列表，状态码: {resp.status_code}")
+                if resp.status_code == 200:
+                    break
+                elif retry == self._max_retries - 1:
+                    logger.error(f"【夸克】请求失败,状态码: {resp.status_code}")
+                    return None
+                else:
+                    time.sleep(1)
+            except requests.exceptions.RequestException as e:
+                if retry == self._max_retries - 1:
+                    logger.error(f"【夸克】API请求失败: {str(e)}")
+                    return None
+                time.sleep(1)
+
+        try:
+            resp_json = resp.json()
+        except ValueError as e:
+            logger.error(f"【夸克】解析响应JSON失败: {str(e)}")
+            logger.error(f"【夸克】响应内容: {resp.text}")
+            return None
+
+        if resp_json.get("code") != 0:
+            error_msg = resp_json.get("message", "未知错误")
+            logger.error(f"【夸克】获取文件列表失败: {error_msg}")
+            return None
+        return resp_json.get("data", {}).get("list", [])
+
+    def _find_child(self, parent_path: str, parent_id: str, name: str) -> Optional[str]:
+        """
+        分页查找目录下名为name的条目ID，途经的所有同级条目都写入缓存
+        """
+        start = 0
+        while True:
+            item_list = self._list_page(parent_id, start)
+            if item_list is None:
+                # 父目录ID可能已失效
+                self._id_cache.invalidate(parent_path)
+                return None
+            found = None
+            for item in item_list:
+                self._id_cache.put(f"{parent_path.rstrip('/')}/{item['file_name']}", str(item["fid"]))
+                if item["file_name"] == name:
+                    found = str(item["fid"])
+            if found or len(item_list) < self._list_limit:
+                return found
+            start += len(item_list)
+
     def _path_to_id(self, path: str):
         """
-        通过路径获取ID
+        通过路径获取ID：从缓存中最深的已知祖先目录开始，分页逐级查找
         """
         try:
             logger.info(f"【夸克】开始获取路径 {path} 的ID")
-            
+
+            path = normalize_path(path)
             # 根目录
-            if path == "/" or path == "":
+            if path == "/":
                 logger.info("【夸克】根目录ID为0")
                 return "0"
-                
-            if len(path) > 1 and path.endswith("/"):
-                path = path[:-1]
-                
-            # 检查缓存
-            if path in self._id_cache:
-                logger.info(f"【夸克】从缓存获取到ID: {self._id_cache[path]}")
-                return self._id_cache[path]
-                
-            # 确保路径以/开头
-            if not path.startswith("/"):
-                path = "/" + path
-                
-            logger.info(f"【夸克】开始逐级查找路径: {path}")
-            
-            parts = [p for p in Path(path).parts if p != "/"]
-            if not parts:
-                return "0"
-                
-            current_id = "0"
-            for part in parts:
-                try:
-                    logger.info(f"【夸克】查找目录 {part} (当前ID: {current_id})")
-                    
-                    # 更新时间戳和设备ID
-                    current_time = int(time.time() * 1000)
-                    device_id = f"web_{current_time}"
-                    
-                    headers = {
-                        "Cookie": self._cookie,
-                        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
-                        "Content-Type": "application/json;charset=UTF-8",
-                        "Referer": "https://pan.quark.cn",
-                        "Origin": "https://pan.quark.cn",
-                        "Accept": "application/json, text/plain, */*",
-                        "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
-                        "Accept-Encoding": "gzip, deflate, br",
-                        "Connection": "keep-alive",
-                        "x-requested-with": "XMLHttpRequest",
-                        "x-device-id": device_id,
-                        "x-client-version": "3.1.0",
-                        "x-platform-version": "web",
-                        "x-platform-type": "web",
-                        "x-sdk-version": "3.1.0",
-                        "x-web-timestamp": str(current_time),
-                        "x-device-model": "web",
-                        "x-device-name": "Chrome",
-                        "x-device-platform": "web",
-                        "x-app-id": "30",
-                        "x-app-version": "3.1.0",
-                        "x-app-package": "com.quark.pan",
-                        "x-web-timezone": "8",
-                        "x-web-source": "pc",
-                        "x-web-os": "web",
-                        "x-web-browser": "Chrome",
-                        "x-web-browser-version": "122.0.0.0"
-                    }
-                    
-                    request_data = {
-                        "pdir_fid": current_id,
-                        "limit": 100,
-                        "start": 0,
-                        "with_audit": 1,
-                        "filters": {"phase": "all"},
-                        "orderBy": [{"field": "file_name", "order": "asc"}],
-                        "_web_timestamp": current_time
-                    }
-                    
-                    api_url = f"{self._base_url}/file/list"
-                    logger.debug(f"【夸克】请求URL: {api_url}")
-                    logger.debug(f"【夸克】请求头: {headers}")
-                    logger.debug(f"【夸克】请求参数: {request_data}")
-                    
-                    # 添加重试机制
-                    for retry in range(self._max_retries):
-                        try:
-                            resp = requests.post(
-                                api_url,
-                                headers=headers,
-                                json=request_data,
-                                timeout=self._timeout
-                            )
-                            logger.info(f"【夸克】第{retry + 1}次尝试请求文件列表")
-                            logger.info(f"【夸克】API响应状态码: {resp.status_code}")
-                            logger.debug(f"【夸克】API响应头: {dict(resp.headers)}")
-                            
-                            if resp.status_code == 200:
-                                break
-                            elif retry == self._max_retries - 1:
-                                logger.error(f"【夸克】请求失败,状态码: {resp.status_code}")
-                                return None
-                            else:
-                                time.sleep(1)
-                                continue
-                                
-                        except requests.exceptions.RequestException as e:
-                            if retry == self._max_retries - 1:
-                                logger.error(f"【夸克】API请求失败: {str(e)}")
-                                return None
-                            else:
-                                time.sleep(1)
-                                continue
-                    
-                    try:
-                        resp_text = resp.text
-                        logger.debug(f"【夸克】API响应内容: {resp_text}")
-                        resp_json = resp.json()
-                    except ValueError as e:
-                        logger.error(f"【夸克】解析响应JSON失败: {str(e)}")
-                        logger.error(f"【夸克】响应内容: {resp_text}")
-                        return None
-                    
-                    if resp_json.get("code") != 0:
-                        error_msg = resp_json.get("message", "未知错误")
-                        logger.error(f"【夸克】获取文件列表失败: {error_msg}")
-                        logger.error(f"【夸克】完整响应: {resp_text}")
-                        return None
-                        
-                    found = False
-                    for item in resp_json.get("data", {}).get("list", []):
-                        if item["file_name"] == part:
-                            current_id = str(item["fid"])
-                            found = True
-                            logger.info(f"【夸克】找到目录 {part} 的ID: {current_id}")
-                            break
-                            
-                    if not found:
-                        logger.error(f"【夸克】未找到目录: {part}")
-                        return None
-                        
-                except Exception as e:
-                    logger.error(f"【夸克】查找目录ID失败: {str(e)}")
+
+            # 检查缓存（逐级前缀）
+            current_path, current_id = self._id_cache.deepest_ancestor(path)
+            if current_path == path:
+                logger.info(f"【夸克】从缓存获取到ID: {current_id}")
+                return current_id
+
+            logger.info(f"【夸克】从 {current_path} (ID: {current_id}) 开始逐级查找路径: {path}")
+
+            for part in [p for p in path[len(current_path):].split("/") if p]:
+                logger.info(f"【夸克】查找目录 {part} (当前ID: {current_id})")
+                child_id = self._find_child(current_path, current_id, part)
+                if not child_id:
+                    logger.error(f"【夸克】未找到目录: {part}")
                     return None
-                    
-            # 缓存结果
-            self._id_cache[path] = current_id
+                current_path = f"{current_path.rstrip('/')}/{part}"
+                current_id = child_id
+                logger.info(f"【夸克】找到目录 {part} 的ID: {current_id}")
+
             logger.info(f"【夸克】路径 {path} 的最终ID为: {current_id}")
             return current_id
-            
+
         except Exception as e:
             logger.error(f"【夸克】获取路径ID失败: {str(e)}")
             return None
 
-    def list(self, fileitem: schemas.FileItem) -> List[schemas.FileItem]:
+    def iter_list(self, fileitem: schemas.FileItem, page_size: int = 50,
+                  throttle: Optional[Callable[[], bool]] = None) -> Iterator[List[schemas.FileItem]]:
         """
-        获取文件列表（新版，完全模拟网页端接口，GET方式）
+        按页获取目录下的文件（完全模拟网页端/file/sort接口，GET方式），每取到一页即返回该页条目；
+        throttle在每次分页请求前调用（用于限速），返回False时结束迭代；出错时记录日志并结束迭代
         """
-        try:
+        page = 1
+        logger.info(f"【夸克】开始获取目录 {fileitem.path} 的文件列表（新版/sort接口）")
+        parent_id = self._path_to_id(fileitem.path)
+        if not parent_id:
+            logger.error(f"【夸克】获取文件列表失败: 无法获取目录ID {fileitem.path}")
+            return
+        logger.info(f"【夸克】目录 {fileitem.path} 的ID为 {parent_id}")
+        while True:
+            if throttle and not throttle():
+                return
+            try:
+                logger.info(f"【夸克】请求第 {page} 页文件列表")
+                # 拼接url参数
+                params = {
+                    "pr": "ucpro",
+                    "fr": "pc",
+                    "uc_param_str": "",
+                    "pdir_fid": parent_id,
+                    "_page": page,
+                    "_size": page_size,
+                    "_fetch_total": 1,
+                    "_fetch_sub_dirs": 0,
+                    "_sort": "file_type:asc,updated_at:desc"
+                }
+                url = f"{self._sort_url}?" + urllib.parse.urlencode(params)
+                resp = self._client.get("file/sort", url, headers=self._sort_headers)
+                logger.info(f"【夸克】API响应状态码: {resp.status_code}")
+                if resp.status_code != 200:
+                    logger.error(f"【夸克】请求失败,状态码: {resp.status_code}")
+                    return
+                resp_json = resp.json()
+                if resp_json.get("code") != 0:
+                    error_msg = resp_json.get("message", "未知错误")
+                    logger.error(f"【夸克】获取文件列表失败: {error_msg}")
+                    # 缓存的目录ID可能已失效（如在网页端被删除），下次重新查找
+                    self._id_cache.invalidate(fileitem.path)
+                    return
+                data = resp_json.get("data", {})
+                item_list = data.get("list", [])
+                if not item_list:
+                    logger.info("【夸克】没有更多文件")
+                    return
+            except Exception as e:
+                logger.error(f"【夸克】获取文件列表失败: {str(e)}")
+                return
             items = []
-            page = 1
-            size = 50
-            logger.info(f"【夸克】开始获取目录 {fileitem.path} 的文件列表（新版/sort接口）")
-            parent_id = self._path_to_id(fileitem.path)
-            if not parent_id:
-                logger.error(f"【夸克】获取文件列表失败: 无法获取目录ID {fileitem.path}")
-                return []
-            logger.info(f"【夸克】目录 {fileitem.path} 的ID为 {parent_id}")
-            while True:
+            for item in item_list:
                 try:
-                    logger.info(f"【夸克】请求第 {page} 页文件列表")
-                    # 拼接url参数
-                    params = {
-                        "pr": "ucpro",
-                        "fr": "pc",
-                        "uc_param_str": "",
-                        "pdir_fid": parent_id,
-                        "_page": page,
-                        "_size": size,
-                        "_fetch_total": 1,
-                        "_fetch_sub_dirs": 0,
-                        "_sort": "file_type:asc,updated_at:desc"
-                    }
-                    url = "https://drive-pc.quark.cn/1/clouddrive/file/sort?" + urllib.parse.urlencode(params)
-                    # 构造headers
-                    headers = {
-                        "Accept": "application/json, text/plain, */*",
-                        "Accept-Encoding": "gzip, deflate, br, zstd",
-                        "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8,en-GB;q=0.7,en-US;q=0.6",
-                        "Cache-Control": "no-cache",
-                        "Cookie": self._cookie,
-                        "Origin": "https://pan.quark.cn",
-                        "Pragma": "no-cache",
-                        "Priority": "u=1",
-                        "Referer": "https://pan.quark.cn/",
-                        "Sec-Ch-Ua": '"Microsoft Edge";v="137", "Chromium";v="137", "Not/A)Brand";v="24"',
-                        "Sec-Ch-Ua-Mobile": "?0",
-                        "Sec-Ch-Ua-Platform": '"macOS"',
-                        "Sec-Fetch-Dest": "empty",
-                        "Sec-Fetch-Mode": "cors",
-                        "Sec-Fetch-Site": "same-site",
-                        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36 Edg/137.0.0.0"
-                    }
-                    resp = requests.get(url, headers=headers)
-                    logger.info(f"【夸克】API响应状态码: {resp.status_code}")
-                    if resp.status_code != 200:
-                        logger.error(f"【夸克】请求失败,状态码: {resp.status_code}")
-                        return []
-                    resp_json = resp.json()
-                    if resp_json.get("code") != 0:
-                        error_msg = resp_json.get("message", "未知错误")
-                        logger.error(f"【夸克】获取文件列表失败: {error_msg}")
-                        return []
-                    data = resp_json.get("data", {})
-                    item_list = data.get("list", [])
-                    if not item_list:
-                        logger.info("【夸克】没有更多文件")
-                        break
-                    for item in item_list:
-                        try:
-                            path = f"{fileitem.path}{item['file_name']}"
-                            if not path.startswith("/"):
-                                path = "/" + path
-                            self._id_cache[path] = str(item["fid"])
-                            file_path = path + ("/" if item["file_type"] == 0 else "")
-                            file_item = schemas.FileItem(
-                                storage=fileitem.storage,
-                                fileid=str(item["fid"]),
-                                parent_fileid=str(item["pdir_fid"]),
-                                name=item["file_name"],
-                                basename=path.split("/")[-1],
-                                extension=None,
-                                type="dir" if item["file_type"] == 0 else "file",
-                                path=file_path,
-                                size=item.get("size"),
-                                modify_time=int(item.get("updated_at", 0)),
-                                pickcode=str(item),
-                            )
-                            items.append(file_item)
-                        except Exception as e:
-                            logger.error(f"【夸克】处理文件项失败: {str(e)}")
-                            continue
-                    if len(item_list) < size:
-                        break
-                    page += 1
+                    path = f"{fileitem.path}{item['file_name']}"
+                    if not path.startswith("/"):
+                        path = "/" + path
+                    self._id_cache.put(path, str(item["fid"]))
+                    is_dir = item["file_type"] == 0
+                    file_path = path + ("/" if is_dir else "")
+                    file_item = schemas.FileItem(
+                        storage=fileitem.storage,
+                        fileid=str(item["fid"]),
+                        parent_fileid=str(item["pdir_fid"]),
+                        name=item["file_name"],
+                        basename=path.split("/")[-1],
+                        extension=None if is_dir else Path(item["file_name"]).suffix[1:] or None,
+                        type="dir" if is_dir else "file",
+                        path=file_path,
+                        size=item.get("size"),
+                        modify_time=int(item.get("updated_at", 0)),
+                        pickcode=str(item),
+                    )
+                    items.append(file_item)
                 except Exception as e:
-                    logger.error(f"【夸克】获取文件列表失败: {str(e)}")
-                    return []
-            logger.info(f"【夸克】共获取到 {len(items)} 个文件")
-            return items
-        except Exception as e:
-            logger.error(f"【夸克】获取文件列表失败: {str(e)}")
-            return []
+                    logger.error(f"【夸克】处理文件项失败: {str(e)}")
+                    continue
+            yield items
+            if len(item_list) < page_size:
+                return
+            page += 1
+
+    def list(self, fileitem: schemas.FileItem) -> List[schemas.FileItem]:
+        """
+        获取文件列表
+        """
+        items = []
+        for page_items in self.iter_list(fileitem):
+            items.extend(page_items)
+        logger.info(f"【夸克】共获取到 {len(items)} 个文件")
+        return items
 
     def get_item(self, path: Path) -> Optional[schemas.FileItem]:
         """
@@ -379,10 +392,9 @@ class QuarkApi:
             file_id = self._path_to_id(str(path))
             if not file_id:
                 return None
-            resp = requests.post(
-                f"{self._base_url}/file/info",
-                headers=self._headers,
-                json={
+            resp = self._api_post(
+                "file/info",
+                {
                     "fid": file_id
                 }
             ).json()
@@ -431,10 +443,9 @@ class QuarkApi:
             parent_id = self._path_to_id(fileitem.path)
             if not parent_id:
                 return None
-            resp = requests.post(
-                f"{self._base_url}/file/create",
-                headers=self._headers,
-                json={
+            resp = self._api_post(
+                "file/create",
+                {
                     "parent_id": parent_id,
                     "file_name": name,
                     "file_type": 0
@@ -446,7 +457,7 @@ class QuarkApi:
             if not item:
                 return None
             path = f"{fileitem.path}{name}/"
-            self._id_cache[path[:-1]] = str(item["fid"])
+            self._id_cache.put(path, str(item["fid"]))
             return schemas.FileItem(
                 storage=self._disk_name,
                 fileid=str(item["fid"]),
@@ -464,58 +475,25 @@ class QuarkApi:
             logger.error(f"【夸克】创建文件夹失败: {str(e)}")
             return None
 
-    def upload(self, fileitem: schemas.FileItem, path: Path, new_name: Optional[str] = None) -> Optional[schemas.FileItem]:
+    def upload(self, fileitem: schemas.FileItem, path: Path, new_name: Optional[str] = None,
+               progress_callback: Optional[ProgressCallback] = None) -> Optional[schemas.FileItem]:
         """
-        上传文件
+        上传文件：分片并行上传，支持秒传与断点续传
+        :param progress_callback: 进度回调(已上传字节, 总字节, 速度(字节/秒), 预计剩余秒数)
         """
         try:
             parent_id = self._path_to_id(fileitem.path)
             if not parent_id:
                 return None
-            # 获取上传地址
-            resp = requests.post(
-                f"{self._base_url}/file/upload/init",
-                headers=self._headers,
-                json={
-                    "parent_id": parent_id,
-                    "file_name": new_name or path.name,
-                    "size": path.stat().st_size
-                }
-            ).json()
-            if resp.get("code") != 0:
-                return None
-            upload_data = resp.get("data")
-            if not upload_data:
+            file_name = new_name or path.name
+            item = self._uploader.upload(path, parent_id, file_name, progress_callback)
+            if not item.get("fid"):
                 return None
-            # 上传文件
-            with open(path, "rb") as f:
-                resp = requests.put(
-                    upload_data["url"],
-                    headers={
-                        "Content-Type": "application/octet-stream",
-                    },
-                    data=f
-                )
-                if resp.status_code != 200:
-                    return None
-            # 完成上传
-            resp = requests.post(
-                f"{self._base_url}/file/upload/complete",
-                headers=self._headers,
-                json={
-                    "upload_id": upload_data["upload_id"]
-                }
-            ).json()
-            if resp.get("code") != 0:
-                return None
-            item = resp.get("data")
-            if not item:
-                return None
-            path = f"{fileitem.path}{new_name or path.name}"
-            self._id_cache[path] = str(item["fid"])
+            path = f"{fileitem.path}{item['file_name']}"
+            self._id_cache.put(path, item["fid"])
             return schemas.FileItem(
                 storage=self._disk_name,
-                fileid=str(item["fid"]),
+                fileid=item["fid"],
                 parent_fileid=str(item["parent_id"]),
                 name=item["file_name"],
                 basename=Path(item["file_name"]).stem,
@@ -523,7 +501,7 @@ class QuarkApi:
                 type="file",
                 path=path,
                 size=item["size"],
-                modify_time=int(item["modified_time"]),
+                modify_time=int(time.time()),
                 pickcode=str(item),
             )
         except Exception as e:
@@ -539,10 +517,9 @@ class QuarkApi:
             if not file_id:
                 return None
             # 获取下载地址
-            resp = requests.post(
-                f"{self._base_url}/file/download",
-                headers=self._headers,
-                json={
+            resp = self._api_post(
+                "file/download",
+                {
                     "fids": [file_id]
                 }
             ).json()
@@ -551,23 +528,24 @@ class QuarkApi:
             download_data = resp.get("data", [])
             if not download_data:
                 return None
-            # 下载文件
-            resp = requests.get(
+            # 下载文件，流式响应无论成败都要关闭，连接才能归还共享连接池
+            with self._client.get(
+                "download/get",
                 download_data[0]["download_url"],
                 headers={
-                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"
+                    "User-Agent": API_HEADERS["User-Agent"]
                 },
                 stream=True
-            )
-            if resp.status_code != 200:
-                return None
-            # 保存文件
-            if not path:
-                path = Path(settings.TEMP_PATH) / fileitem.name
-            with open(path, "wb") as f:
-                for chunk in resp.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
+            ) as resp:
+                if resp.status_code != 200:
+                    return None
+                # 保存文件
+                if not path:
+                    path = Path(settings.TEMP_PATH) / fileitem.name
+                with open(path, "wb") as f:
+                    for chunk in resp.iter_content(chunk_size=8192):
+                        if chunk:
+                            f.write(chunk)
             return path
         except Exception as e:
             logger.error(f"【夸克】下载文件失败: {str(e)}")
@@ -581,15 +559,16 @@ class QuarkApi:
             file_id = self._path_to_id(fileitem.path)
             if not file_id:
                 return None
-            resp = requests.post(
-                f"{self._base_url}/file/delete",
-                headers=self._headers,
-                json={
+            resp = self._api_post(
+                "file/delete",
+                {
                     "fids": [file_id]
                 }
             ).json()
             if resp.get("code") != 0:
                 return None
+            # 目录删除后其下所有子路径一并失效
+            self._id_cache.invalidate(fileitem.path)
             return True
         except Exception as e:
             logger.error(f"【夸克】删除文件失败: {str(e)}")
@@ -603,30 +582,47 @@ class QuarkApi:
             file_id = self._path_to_id(fileitem.path)
             if not file_id:
                 return None
-            resp = requests.post(
-                f"{self._base_url}/file/rename",
-                headers=self._headers,
-                json={
+            resp = self._api_post(
+                "file/rename",
+                {
                     "fid": file_id,
                     "file_name": name
                 }
             ).json()
             if resp.get("code") != 0:
                 return None
+            # 重命名不改变fid，子树整体改挂到新路径
+            old_path = normalize_path(fileitem.path)
+            self._id_cache.move(old_path, f"{old_path.rsplit('/', 1)[0]}/{name}")
             return True
         except Exception as e:
             logger.error(f"【夸克】重命名文件失败: {str(e)}")
             return None
 
+    def request_stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        按接口统计的请求次数、失败次数与平均/最大耗时(ms)
+        """
+        return self._client.stats()
+
+    def close(self):
+        """
+        关闭连接池
+        """
+        self._client.close()
+
+    def cache_stats(self) -> Dict[str, float]:
+        """
+        路径缓存统计：条目数、命中/未命中次数、淘汰数、命中率
+        """
+        return self._id_cache.stats()
+
     def usage(self) -> Optional[schemas.StorageUsage]:
         """
         获取存储空间使用情况
         """
         try:
-            resp = requests.post(
-                "https://pan.quark.cn/1/clouddrive/capacity",
-                headers=self._headers
-            ).json()
+            resp = self._api_post("capacity").json()
             if resp.get("code") != 0:
                 return None
             data = resp.get("data")
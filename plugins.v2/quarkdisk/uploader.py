@@ -0,0 +1,339 @@
+import base64
+import hashlib
+import json
+import mimetypes
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
+from email.utils import formatdate
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from app.log import logger
+
+# 阿里云OSS签名中使用的客户端标识，与网页端一致
+OSS_USER_AGENT = "aliyun-sdk-js/6.6.1 Chrome 98.0.4758.80 on Windows 10 64-bit"
+
+# 断点状态的保留时长(秒)：超过一天未更新的上传任务在服务端已失效，无法续传
+STATE_TTL = 24 * 3600
+
+# 进度回调：(已上传字节, 总字节, 速度(字节/秒), 预计剩余秒数)
+ProgressCallback = Callable[[int, int, float, Optional[float]], None]
+
+
+class UploadError(Exception):
+    pass
+
+
+class UploadState:
+    """
+    分片上传的断点状态，以JSON保存在临时目录，按(本地文件, 大小, 修改时间, 目标目录, 文件名)区分；
+    每完成一个分片即原子写入一次
+    """
+
+    def __init__(self, state_dir: Path, path: Path, parent_id: str, file_name: str):
+        stat = path.stat()
+        key = f"{path.resolve()}|{stat.st_size}|{stat.st_mtime_ns}|{parent_id}|{file_name}"
+        self.path = state_dir / f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.json"
+        self._lock = threading.Lock()
+        self.data: Dict = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = {}
+
+    @property
+    def etags(self) -> Dict[str, str]:
+        return self.data.setdefault("etags", {})
+
+    def update(self, **kwargs):
+        with self._lock:
+            self.data.update(kwargs)
+            self._save()
+
+    def part_done(self, part_number: int, etag: str):
+        with self._lock:
+            self.etags[str(part_number)] = etag
+            self._save()
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        with self._lock:
+            self.data = {}
+            try:
+                self.path.unlink()
+            except OSError:
+                pass
+
+
+class _Progress:
+    def __init__(self, total: int, callback: Optional[ProgressCallback], interval: float = 1.0):
+        self.total = total
+        self._callback = callback
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self._last_report = 0.0
+        self.uploaded = 0
+        self._base = 0
+
+    def resume_from(self, uploaded: int):
+        # 续传前已完成的部分不计入速度
+        self.uploaded = self._base = uploaded
+
+    def add(self, n: int, final: bool = False):
+        with self._lock:
+            self.uploaded += n
+            now = time.monotonic()
+            if not self._callback or (not final and now - self._last_report < self._interval):
+                return
+            self._last_report = now
+            elapsed = max(now - self._start, 1e-6)
+            speed = (self.uploaded - self._base) / elapsed
+            eta = (self.total - self.uploaded) / speed if speed > 0 else None
+            uploaded, total = self.uploaded, self.total
+        try:
+            self._callback(uploaded, total, speed, eta)
+        except Exception as e:
+            logger.debug(f"【夸克】上传进度回调异常: {str(e)}")
+
+
+class MultipartUploader:
+    """
+    夸克网盘分片上传（OSS Multipart）：
+    upload/pre取得上传任务 → update/hash（服务端已有相同文件时秒传）→
+    各分片经upload/auth取得签名后并行PUT到OSS → 提交分片列表 → upload/finish。
+    已完成分片的ETag持久化到临时目录，中断后再次上传同一文件时只补传缺失分片
+    """
+
+    def __init__(self, client, api_post: Callable, state_dir: Path, workers: int = 3, max_retries: int = 3):
+        self._client = client
+        self._api_post = api_post
+        self._state_dir = state_dir
+        self.workers = max(1, int(workers))
+        self.max_retries = max_retries
+        self._prune_states()
+
+    def _prune_states(self):
+        """
+        清理过期的断点状态：放弃上传或源文件已变化的任务不会再被续传，其状态文件只能按时间清除
+        """
+        expire = time.time() - STATE_TTL
+        removed = 0
+        for state_file in self._state_dir.glob("*"):
+            if state_file.suffix not in (".json", ".tmp"):
+                continue
+            try:
+                if state_file.stat().st_mtime < expire:
+                    state_file.unlink()
+                    removed += 1
+            except OSError:
+                pass
+        if removed:
+            logger.info(f"【夸克】已清理{removed}个过期的上传断点状态")
+
+    def _call(self, endpoint: str, payload: dict) -> dict:
+        resp = self._api_post(endpoint, payload, params={"pr": "ucpro", "fr": "pc"}).json()
+        if resp.get("code") != 0:
+            raise UploadError(f"{endpoint}失败: {resp.get('message', '未知错误')}")
+        return resp
+
+    @staticmethod
+    def _file_hashes(path: Path) -> Dict[str, str]:
+        md5, sha1 = hashlib.md5(), hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(4 * 1024 * 1024), b""):
+                md5.update(chunk)
+                sha1.update(chunk)
+        return {"md5": md5.hexdigest(), "sha1": sha1.hexdigest()}
+
+    def _oss_url(self, task: dict) -> str:
+        upload_url = task["upload_url"].split("://", 1)[-1]
+        return f"https://{task['bucket']}.{upload_url}/{task['obj_key']}"
+
+    def _auth(self, task: dict, auth_meta: str) -> str:
+        resp = self._call("file/upload/auth", {
+            "auth_info": task["auth_info"],
+            "auth_meta": auth_meta,
+            "task_id": task["task_id"],
+        })
+        return resp["data"]["auth_key"]
+
+    def _put_part(self, task: dict, path: Path, part_number: int, progress: _Progress) -> str:
+        part_size = task["part_size"]
+        with open(path, "rb") as f:
+            f.seek((part_number - 1) * part_size)
+            data = f.read(part_size)
+        last_error = None
+        for retry in range(self.max_retries):
+            date = formatdate(usegmt=True)
+            auth_meta = (f"PUT\n\n{task['mime_type']}\n{date}\n"
+                         f"x-oss-date:{date}\nx-oss-user-agent:{OSS_USER_AGENT}\n"
+                         f"/{task['bucket']}/{task['obj_key']}?partNumber={part_number}&uploadId={task['upload_id']}")
+            try:
+                auth_key = self._auth(task, auth_meta)
+                resp = self._client.put(
+                    "upload/part",
+                    self._oss_url(task),
+                    params={"partNumber": part_number, "uploadId": task["upload_id"]},
+                    headers={
+                        "Authorization": auth_key,
+                        "Content-Type": task["mime_type"],
+                        "Referer": "https://pan.quark.cn/",
+                        "x-oss-date": date,
+                        "x-oss-user-agent": OSS_USER_AGENT,
+                    },
+                    data=data
+                )
+                if resp.status_code == 200 and resp.headers.get("ETag"):
+                    progress.add(len(data))
+                    return resp.headers["ETag"]
+                last_error = f"状态码: {resp.status_code}"
+            except Exception as e:
+                last_error = str(e)
+            logger.warning(f"【夸克】分片 {part_number} 第{retry + 1}次上传失败: {last_error}")
+            time.sleep(1 + retry)
+        raise UploadError(f"分片 {part_number} 上传失败: {last_error}")
+
+    def _commit(self, task: dict, etags: Dict[str, str]):
+        parts = "".join(f"<Part>\n<PartNumber>{n}</PartNumber>\n<ETag>{etags[str(n)]}</ETag>\n</Part>\n"
+                        for n in range(1, task["part_count"] + 1))
+        body = f'<?xml version="1.0" encoding="UTF-8"?>\n<CompleteMultipartUpload>\n{parts}</CompleteMultipartUpload>'
+        content_md5 = base64.b64encode(hashlib.md5(body.encode("utf-8")).digest()).decode()
+        callback = base64.b64encode(
+            json.dumps(task["callback"], separators=(",", ":")).encode("utf-8")).decode()
+        date = formatdate(usegmt=True)
+        auth_meta = (f"POST\n{content_md5}\napplication/xml\n{date}\n"
+                     f"x-oss-callback:{callback}\nx-oss-date:{date}\nx-oss-user-agent:{OSS_USER_AGENT}\n"
+                     f"/{task['bucket']}/{task['obj_key']}?uploadId={task['upload_id']}")
+        auth_key = self._auth(task, auth_meta)
+        resp = self._client.post(
+            "upload/commit",
+            self._oss_url(task),
+            params={"uploadId": task["upload_id"]},
+            headers={
+                "Authorization": auth_key,
+                "Content-MD5": content_md5,
+                "Content-Type": "application/xml",
+                "Referer": "https://pan.quark.cn/",
+                "x-oss-callback": callback,
+                "x-oss-date": date,
+                "x-oss-user-agent": OSS_USER_AGENT,
+            },
+            data=body.encode("utf-8")
+        )
+        if resp.status_code != 200:
+            raise UploadError(f"提交分片失败，状态码: {resp.status_code}")
+
+    def _pre(self, parent_id: str, file_name: str, size: int) -> dict:
+        now = int(time.time() * 1000)
+        mime_type = mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+        resp = self._call("file/upload/pre", {
+            "ccp_hash_update": True,
+            "parallel_upload": True,
+            "pdir_fid": parent_id,
+            "dir_name": "",
+            "size": size,
+            "file_name": file_name,
+            "format_type": mime_type,
+            "l_created_at": now,
+            "l_updated_at": now,
+        })
+        data, metadata = resp.get("data") or {}, resp.get("metadata") or {}
+        part_size = int(metadata.get("part_size") or 0)
+        if not data.get("task_id") or part_size <= 0:
+            raise UploadError("upload/pre返回数据不完整")
+        return {
+            "task_id": data["task_id"],
+            "upload_id": data.get("upload_id"),
+            "obj_key": data.get("obj_key"),
+            "bucket": data.get("bucket"),
+            "upload_url": data.get("upload_url", ""),
+            "auth_info": data.get("auth_info"),
+            "callback": data.get("callback") or {},
+            "fid": data.get("fid"),
+            "finish": bool(data.get("finish")),
+            "mime_type": mime_type,
+            "part_size": part_size,
+            "part_count": max(1, -(-size // part_size)),
+        }
+
+    def upload(self, path: Path, parent_id: str, file_name: str,
+               progress_callback: Optional[ProgressCallback] = None) -> dict:
+        """
+        上传文件，成功返回{"fid", "file_name", "size", "parent_id"}；失败时保留断点状态并抛出UploadError。
+        续传失败（如服务端上传任务已过期）时丢弃断点状态，重新上传一次
+        """
+        state = UploadState(self._state_dir, path, parent_id, file_name)
+        if state.data.get("task"):
+            try:
+                return self._upload(path, parent_id, file_name, state, progress_callback)
+            except UploadError as e:
+                logger.warning(f"【夸克】续传失败，重新上传: {str(e)}")
+                state.clear()
+        return self._upload(path, parent_id, file_name, state, progress_callback)
+
+    def _upload(self, path: Path, parent_id: str, file_name: str, state: UploadState,
+                progress_callback: Optional[ProgressCallback]) -> dict:
+        size = path.stat().st_size
+        progress = _Progress(size, progress_callback)
+        task = state.data.get("task")
+        if task:
+            logger.info(f"【夸克】发现未完成的上传任务，已完成 {len(state.etags)}/{task['part_count']} 个分片，继续上传")
+        else:
+            hashes = self._file_hashes(path)
+            task = self._pre(parent_id, file_name, size)
+            state.update(task=task, etags={})
+            if not task["finish"]:
+                resp = self._call("file/update/hash", {**hashes, "task_id": task["task_id"]})
+                task["finish"] = bool((resp.get("data") or {}).get("finish"))
+            if task["finish"]:
+                logger.info(f"【夸克】{file_name} 秒传成功")
+                progress.resume_from(size)
+                progress.add(0, final=True)
+                return self._finish(task, state, file_name, size, parent_id)
+
+        done = {int(n) for n in state.etags}
+        progress.resume_from(sum(min(task["part_size"], size - (n - 1) * task["part_size"]) for n in done))
+        missing = [n for n in range(1, task["part_count"] + 1) if n not in done]
+        if missing:
+            cancelled = threading.Event()
+
+            def __upload_part(part_number: int):
+                if cancelled.is_set():
+                    return
+                etag = self._put_part(task, path, part_number, progress)
+                state.part_done(part_number, etag)
+
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(missing)),
+                                    thread_name_prefix="quark-upload") as executor:
+                futures = [executor.submit(__upload_part, n) for n in missing]
+                finished, _ = wait(futures, return_when=FIRST_EXCEPTION)
+                for future in finished:
+                    if future.exception():
+                        cancelled.set()
+                        for f in futures:
+                            f.cancel()
+                        raise future.exception()
+        progress.add(0, final=True)
+        self._commit(task, state.etags)
+        return self._finish(task, state, file_name, size, parent_id)
+
+    def _finish(self, task: dict, state: UploadState, file_name: str, size: int, parent_id: str) -> dict:
+        resp = self._call("file/upload/finish", {"obj_key": task["obj_key"], "task_id": task["task_id"]})
+        state.clear()
+        data = resp.get("data") or {}
+        return {
+            "fid": str(data.get("fid") or task.get("fid") or ""),
+            "file_name": data.get("file_name") or file_name,
+            "size": size,
+            "parent_id": parent_id,
+        }
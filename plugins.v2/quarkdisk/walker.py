@@ -0,0 +1,108 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
+
+import schemas
+from app.log import logger
+
+# 队列中表示一个目录已列举完毕的标记
+_DIR_DONE = object()
+
+
+class RateLimiter:
+    """
+    令牌桶限速，rate<=0表示不限速
+    """
+
+    def __init__(self, rate: float):
+        self.rate = float(rate)
+        self._lock = threading.Lock()
+        self._tokens = max(self.rate, 1.0)
+        self._last = time.monotonic()
+
+    def wait(self, cancelled: threading.Event = None) -> bool:
+        """
+        等待取得一个令牌，等待期间被取消时返回False
+        """
+        if self.rate <= 0:
+            return True
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(max(self.rate, 1.0), self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                delay = (1 - self._tokens) / self.rate
+            if cancelled is not None:
+                if cancelled.wait(delay):
+                    return False
+            else:
+                time.sleep(delay)
+
+
+class QuarkWalker:
+    """
+    并发广度优先遍历目录：同级子目录在线程池中并行列举（并发数有上限），
+    所有分页请求共用一个令牌桶限速；每取到一页即把条目交给调用方，
+    调用方提前结束迭代（如any_files已找到匹配）时取消尚未完成的列举
+    """
+
+    def __init__(self, api, max_workers: int = 4, max_rps: float = 10):
+        self._api = api
+        self.max_workers = max(1, int(max_workers))
+        self._limiter = RateLimiter(max_rps)
+
+    def walk(self, root: schemas.FileItem, recursive: bool = True) -> Iterator[schemas.FileItem]:
+        """
+        逐个返回root下的文件与目录（不含root本身），recursive为False时只列举一层
+        """
+        results: queue.Queue = queue.Queue()
+        cancelled = threading.Event()
+        lock = threading.Lock()
+        pending = [1]
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="quark-walk")
+
+        def __throttle() -> bool:
+            return not cancelled.is_set() and self._limiter.wait(cancelled)
+
+        def __list_dir(_item: schemas.FileItem):
+            try:
+                for page_items in self._api.iter_list(_item, throttle=__throttle):
+                    if cancelled.is_set():
+                        break
+                    for t in page_items:
+                        if recursive and t.type == "dir" and not cancelled.is_set():
+                            # 先计数再提交，保证父目录的完成标记出队前子目录已计入
+                            with lock:
+                                pending[0] += 1
+                            try:
+                                executor.submit(__list_dir, t)
+                            except RuntimeError:
+                                # 遍历已被取消，线程池已关闭，撤销刚才的计数
+                                with lock:
+                                    pending[0] -= 1
+                                break
+                        results.put(t)
+            except Exception as e:
+                logger.error(f"【夸克】列举目录 {_item.path} 失败: {str(e)}")
+            finally:
+                results.put(_DIR_DONE)
+
+        try:
+            executor.submit(__list_dir, root)
+            while True:
+                item = results.get()
+                if item is _DIR_DONE:
+                    with lock:
+                        pending[0] -= 1
+                        if pending[0] == 0:
+                            break
+                    continue
+                yield item
+        finally:
+            cancelled.set()
+            executor.shutdown(wait=False, cancel_futures=True)